@@ -0,0 +1,71 @@
+"""
+Micro-benchmarks for Fixed4/Money scalar arithmetic.
+
+Each case times the current operator against the same operation on the
+implementation it replaced, a frozen copy of which lives in
+legacy_fixed4.py.  Run directly:
+
+    python bench/fixed4_bench.py
+"""
+import sys
+from decimal import Decimal
+from math import ceil
+from pathlib import Path
+from timeit import repeat
+
+HERE = Path(__file__).expanduser().resolve().parent
+REPOROOT = HERE.parent
+if __name__ == '__main__':
+    sys.path.append(str(REPOROOT))
+
+from legacy_fixed4 import Fixed4 as OldFixed4  # noqa: E402
+from legacy_fixed4 import Money as OldMoney  # noqa: E402
+from pyrig.models.acctng.fixed4 import Fixed4  # noqa: E402
+from pyrig.models.acctng.money import Money  # noqa: E402
+
+NUMBER = 20000
+REPEAT = 7
+
+
+def get_ops(fixed4: type, money: type):
+    "Return the benchmarked operations on the given scalar classes."
+    a = fixed4(123.4567)
+    b = fixed4(-98.7654)
+    m = money(1234.5678)
+    dec = Decimal('123.4567')
+    return {
+        'Fixed4(int)': lambda: fixed4(12345),
+        'Fixed4(str)': lambda: fixed4('123.4567'),
+        'Fixed4(Decimal)': lambda: fixed4(dec),
+        'int*Fixed4': lambda: 3*a,
+        'int*Money': lambda: 3*m,
+        'Fixed4*Fixed4': lambda: a*b,
+        'Fixed4/int': lambda: a/7,
+        'Money/int': lambda: m/7,
+        'Fixed4<=Fixed4': lambda: a <= b,
+        'ceil(Fixed4)': lambda: ceil(a),
+    }
+
+
+def get_cases():
+    current = get_ops(Fixed4, Money)
+    legacy = get_ops(OldFixed4, OldMoney)
+    return {name: (func, legacy[name]) for name, func in current.items()}
+
+
+def time_ns(func) -> float:
+    return min(repeat(func, number=NUMBER, repeat=REPEAT))/NUMBER*1e9
+
+
+def run_benchmarks(out=sys.stdout):
+    print(f"{'case':<18}{'current':>12}{'legacy':>12}{'speedup':>10}",
+          file=out)
+    for name, (current, legacy) in get_cases().items():
+        t_cur = time_ns(current)
+        t_old = time_ns(legacy)
+        print(f"{name:<18}{t_cur:>10.0f}ns{t_old:>10.0f}ns"
+              f"{t_old/t_cur:>9.1f}x", file=out)
+
+
+if __name__ == '__main__':
+    run_benchmarks()
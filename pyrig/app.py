@@ -3,7 +3,9 @@ from pathlib import Path
 from pyapp import PyApp
 
 from .logging import get_logger, DEBUG, log_func_call
-from .models.avcad.constants import CFG_AVCAD_DB_KEY, CFG_AVCAD_LAYERS_KEY
+from .models.avcad.constants import (
+    CFG_AVCAD_DB_KEY, CFG_AVCAD_LAYERS_KEY, CFG_AVCAD_WATCH_KEY,
+)
 
 
 class PyRigApp(PyApp):
@@ -24,6 +26,7 @@ class PyRigApp(PyApp):
         "avcad_sharedlib": "C:/Users/Public/SharedLibrary",
         CFG_AVCAD_DB_KEY: "${avcad_sharedlib}",
         CFG_AVCAD_LAYERS_KEY: "${avcad_sharedlib}/Settings/Layers.txt",
+        CFG_AVCAD_WATCH_KEY: False,
     }
     APP_LOCAL_DEFAULTS = {
         # "delivery_config_dir": "${assets_dir}/delivery_config",
@@ -32,6 +35,7 @@ class PyRigApp(PyApp):
         "ynab_token": None,
     }
     APP_ASSETS_DIR = "${package_dir}/assets"
+    watcher = None
 
     @classmethod
     @log_func_call
@@ -45,17 +49,44 @@ class PyRigApp(PyApp):
         if '--print-models' in args:
             log.info("Printing all models from the database...")
             print_all_models()
+        if '--search-models' in args:
+            from .models.avcad.catalog import print_model_search
+            # the search text is everything after the flag, quoted or not
+            text = ' '.join(args[args.index('--search-models') + 1:])
+            if not text.strip():
+                log.error("--search-models needs the text to search for")
+                return
+            print_model_search(text)
+            return
+
+        from .models.db import check_pyrig_db, rebuild_pyrig_balances
+        if '--dry-run' in args:
+            log.info("Dry run of database migrations...")
+            check_pyrig_db(dry_run=True)
+            return
 
-        from .models.db import check_pyrig_db
         check_pyrig_db()
+        if '--rebuild-balances' in args:
+            log.info("Rebuilding account balances...")
+            rebuild_pyrig_balances()
+
+        # the YNAB token is resolved (and its setting read) on first use
 
-        from .models.ynab import load_ynab_token
-        load_ynab_token()
+        # optionally keep AVCAD caches current as the SharedLibrary changes
+        if '--watch-avcad' in args or cls.get(CFG_AVCAD_WATCH_KEY, False):
+            from .models.avcad.watch import LibraryWatcher
+            cls.watcher = LibraryWatcher()
+            cls.watcher.start()
 
         from .gui import PyRigGui
-        gui = PyRigGui(args)
-        cls.gui = gui
-        return gui.main(*args, **kwargs)
+        try:
+            gui = PyRigGui(args)
+            cls.gui = gui
+            return gui.main(*args, **kwargs)
+        finally:
+            if cls.watcher is not None:
+                cls.watcher.stop()
+                cls.watcher = None
 
     @classmethod
     @log_func_call
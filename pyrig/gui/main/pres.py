@@ -69,3 +69,15 @@ class MainWindow(GuiWindow[MainWindowView]):
     def click_config(self):
         dlg = ConfigTreeDialog(self)
         dlg.show()
+
+    @log_func_call
+    def set_layer_visible(self, layer: str, visible: bool = True):
+        "Show or hide an AVCAD layer without re-reading the layers file."
+        self.gui_view.layers.set_visible(layer, visible)
+        self.gui_view.show_layer(layer, visible)
+
+    @log_func_call
+    def toggle_layer(self, layer: str) -> bool:
+        visible = self.gui_view.layers.toggle(layer)
+        self.gui_view.show_layer(layer, visible)
+        return visible
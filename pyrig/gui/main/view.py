@@ -1,7 +1,9 @@
+from collections import defaultdict
+from pathlib import Path
 from typing import TYPE_CHECKING
 
-from PySide2.QtWidgets import QToolBar, QStatusBar, QLabel
-from PySide2.QtCore import Qt
+from PySide2.QtWidgets import QToolBar, QStatusBar, QLabel, QGraphicsItem
+from PySide2.QtCore import QObject, Qt, Signal, Slot
 
 from pyapp.gui.window import GuiWindowView
 from pyapp.gui.loadstatus import (
@@ -13,6 +15,10 @@ from pyapp.gui.styles import STATUS_LABEL
 
 from ...app import PyRigApp
 from ...logging import log_func_call
+from ...models.avcad.layers import (
+    AvcadLayers, add_layers_listener, load_avcad_layers,
+    remove_layers_listener,
+)
 from ...constants import (
     CHIP_I_MAX, CHIP_I_MIN, CHIP_I_STEP, CHIP_J_MAX, CHIP_J_MIN, CHIP_J_STEP,
 )
@@ -22,6 +28,30 @@ if TYPE_CHECKING:
     from .pres import MainWindow
 
 
+class LayersChangedRelay(QObject):
+    """
+    Hands layers file changes reported on the watcher's thread to the view
+    on the GUI thread, through a queued signal.
+    """
+    changed = Signal(object)
+
+    def __init__(self, view: 'MainWindowView'):
+        super().__init__(view.qtobj)
+        self.view = view
+        self.changed.connect(self.reload, Qt.QueuedConnection)
+        notify = self.notify
+        add_layers_listener(notify)
+        # the wrapper may be gone by then, so don't call back into it
+        self.destroyed.connect(lambda *args: remove_layers_listener(notify))
+
+    def notify(self, path: Path):
+        self.changed.emit(path)
+
+    @Slot(object)
+    def reload(self, path: Path):
+        self.view.reload_layers(path)
+
+
 class MainWindowView(GuiWindowView['MainWindow', BaseView]):
     @staticmethod
     @log_func_call
@@ -39,6 +69,7 @@ class MainWindowView(GuiWindowView['MainWindow', BaseView]):
 
         self.create_toolbar()
         self.create_statusbar()
+        self.load_layers()
         self.create_chips()
 
     @load_status_step("Creating toolbar")
@@ -81,6 +112,44 @@ class MainWindowView(GuiWindowView['MainWindow', BaseView]):
 
         ctrl.update_avcad_dbdir_label(self)
 
+    @load_status_step("Loading AVCAD layers")
+    @log_func_call
+    def load_layers(self):
+        self.layers: AvcadLayers = load_avcad_layers()
+        # scene items by layer name, so a layer is shown or hidden at once
+        self.layer_items: dict[str, list[QGraphicsItem]] = defaultdict(list)
+        # reload when the library watcher sees the layers file change
+        self.layers_relay = LayersChangedRelay(self)
+
+    @log_func_call
+    def reload_layers(self, path: Path = None):
+        """
+        Re-read the layers file (if `path` is it) and re-apply drawing order
+        and the file's visibility to the items already in the scene.
+        """
+        if path is not None and self.layers.path not in (None, Path(path)):
+            return
+        self.layers = layers = load_avcad_layers(self.layers.path)
+        for layer, items in self.layer_items.items():
+            order, visible = layers.order(layer), layers.is_visible(layer)
+            for item in items:
+                item.setZValue(order)
+                item.setVisible(visible)
+
+    @log_func_call
+    def add_layer_item(self, item: QGraphicsItem, layer: str):
+        "Add an item to the scene on an AVCAD layer."
+        layers = self.layers
+        item.setZValue(layers.order(layer))
+        item.setVisible(layers.is_visible(layer))
+        self.layer_items[layer].append(item)
+        self.basewidget.viewwidget.scene.addItem(item)
+
+    @log_func_call
+    def show_layer(self, layer: str, visible: bool):
+        for item in self.layer_items.get(layer, ()):
+            item.setVisible(visible)
+
     @log_func_call
     def create_basewidget(self):
         return BaseView(self)
@@ -0,0 +1,3 @@
+from .pdext import (  # noqa: F401
+    Fixed4Dtype, MoneyDtype, fixed_to_sql, read_sql_fixed,
+)
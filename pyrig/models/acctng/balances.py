@@ -0,0 +1,414 @@
+from sqlite3 import Connection
+
+from numpy import int64
+from pandas import DataFrame, Series, read_sql_query
+
+from ...logging import log_func_call, get_logger
+from .money import MoneyArray
+from .pdext import MoneyExtensionArray
+
+BALANCE_COLUMNS = (
+    'opening_balance',
+    'debit_total',
+    'credit_total',
+    'closing_balance',
+)
+
+
+def amounts_to_intvals(values) -> Series:
+    "Convert stored DECIMAL amounts to scaled Money integers."
+    values = Series(values)
+    return Series(MoneyArray(values.fillna(0).to_numpy(dtype=float)).intvals,
+                  index=values.index)
+
+
+def _to_amounts(intvals) -> list[float]:
+    return (Series(intvals, dtype=int64)/MoneyArray.INTSCALAR).tolist()
+
+
+@log_func_call
+def get_fiscal_periods(cxn: Connection) -> DataFrame:
+    "All fiscal periods ordered by start date."
+    return read_sql_query(
+        "SELECT id, start_date, end_date, is_closed FROM fiscal_periods "
+        "ORDER BY start_date", cxn
+    )
+
+
+@log_func_call
+def assign_fiscal_periods(cxn: Connection, dates: Series,
+                          periods: DataFrame = None) -> Series:
+    """
+    Map ISO entry dates to the id of the fiscal period containing them, as a
+    nullable Int64 series (NA where no period covers the date).
+    """
+    if periods is None:
+        periods = get_fiscal_periods(cxn)
+
+    dates = Series(dates)
+    if periods.empty:
+        return Series(None, index=dates.index, dtype='Int64')
+
+    starts = periods['start_date'].to_numpy(dtype=str)
+    pos = starts.searchsorted(dates.fillna('').to_numpy(dtype=str),
+                              side='right') - 1
+    clipped = pos.clip(0)
+    found = ((pos >= 0)
+             & (dates.fillna('').to_numpy(dtype=str)
+                <= periods['end_date'].to_numpy(dtype=str)[clipped]))
+    ids = Series(periods['id'].to_numpy()[clipped], index=dates.index,
+                 dtype='Int64')
+    return ids.where(found)
+
+
+@log_func_call
+def compute_balance_deltas(cxn: Connection, lines: DataFrame,
+                           periods: DataFrame = None) -> DataFrame:
+    """
+    Aggregate lines into per-(account, fiscal period) debit/credit deltas.
+
+    `lines` needs account_id, entry_date, and debit_amount/credit_amount as
+    scaled Money integers.  Lines outside every fiscal period are dropped
+    with a warning, since there is no snapshot row to attribute them to.
+    """
+    period_ids = assign_fiscal_periods(cxn, lines['entry_date'], periods)
+    missing = int(period_ids.isna().sum())
+    if missing:
+        get_logger().warning(f"{missing} journal lines fall outside every "
+                             "fiscal period and are not in account_balances")
+
+    frame = DataFrame({
+        'account_id': lines['account_id'].to_numpy(),
+        'fiscal_period_id': period_ids.to_numpy(),
+        'debit': lines['debit_amount'].to_numpy(dtype=int64),
+        'credit': lines['credit_amount'].to_numpy(dtype=int64),
+    })[period_ids.notna().to_numpy()]
+    return frame.groupby(['account_id', 'fiscal_period_id'],
+                         as_index=False)[['debit', 'credit']].sum()
+
+
+@log_func_call
+def apply_balance_deltas(cxn: Connection, deltas: DataFrame, sign: int = 1):
+    """
+    Apply per-(account, period) deltas to account_balances.
+
+    Rows are kept so that each opening_balance equals the previous row's
+    closing_balance for the account (in period order), and closing_balance
+    is opening + debits - credits.  A delta therefore adds to its own row's
+    totals and shifts the opening/closing of every later row for the
+    account.  Balances are debit-positive for every account type.
+
+    Must be called inside the caller's transaction.
+    """
+    if deltas.empty:
+        return
+
+    deltas = deltas.merge(get_fiscal_periods(cxn)[['id', 'start_date']],
+                          left_on='fiscal_period_id', right_on='id')
+    deltas = deltas.sort_values(['start_date', 'account_id'])
+    debit = _to_amounts(deltas['debit']*sign)
+    credit = _to_amounts(deltas['credit']*sign)
+    net = _to_amounts((deltas['debit'] - deltas['credit'])*sign)
+    keys = list(zip(deltas['account_id'].tolist(),
+                    deltas['fiscal_period_id'].tolist()))
+
+    # 1. create missing rows carrying the previous closing balance forward
+    cxn.executemany("""
+    INSERT OR IGNORE INTO account_balances
+    (account_id, fiscal_period_id, opening_balance, closing_balance)
+    SELECT ?1, ?2, prev, prev FROM (SELECT COALESCE((
+        SELECT ab.closing_balance
+        FROM account_balances ab
+        JOIN fiscal_periods fp ON fp.id = ab.fiscal_period_id
+        WHERE ab.account_id = ?1 AND fp.start_date < (
+            SELECT start_date FROM fiscal_periods WHERE id = ?2
+        )
+        ORDER BY fp.start_date DESC LIMIT 1
+    ), 0) AS prev)
+    """, keys)
+
+    # 2. add the period's own activity
+    cxn.executemany("""
+    UPDATE account_balances SET
+        debit_total = ROUND(debit_total + ?3, 4),
+        credit_total = ROUND(credit_total + ?4, 4),
+        closing_balance = ROUND(closing_balance + ?5, 4),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE account_id = ?1 AND fiscal_period_id = ?2
+    """, [k + d for k, d in zip(keys, zip(debit, credit, net))])
+
+    # 3. shift every later period for the account
+    cxn.executemany("""
+    UPDATE account_balances SET
+        opening_balance = ROUND(opening_balance + ?3, 4),
+        closing_balance = ROUND(closing_balance + ?3, 4),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE account_id = ?1 AND fiscal_period_id IN (
+        SELECT id FROM fiscal_periods WHERE start_date > (
+            SELECT start_date FROM fiscal_periods WHERE id = ?2
+        )
+    )
+    """, [k + (n,) for k, n in zip(keys, net)])
+
+
+@log_func_call
+def get_posted_lines(cxn: Connection, where: str = '1',
+                     params: tuple = ()) -> DataFrame:
+    """
+    Read posted journal lines (account_id, entry_date and scaled amounts),
+    optionally filtered by a WHERE clause over journal_entries (alias je)
+    and journal_entry_lines (alias jel).
+    """
+    lines = read_sql_query(f"""
+    SELECT jel.journal_entry_id, jel.account_id, je.entry_date,
+           jel.debit_amount, jel.credit_amount
+    FROM journal_entry_lines jel
+    JOIN journal_entries je ON je.id = jel.journal_entry_id
+    WHERE je.posted AND ({where})
+    """, cxn, params=params)
+    lines['debit_amount'] = amounts_to_intvals(lines['debit_amount'])
+    lines['credit_amount'] = amounts_to_intvals(lines['credit_amount'])
+    return lines
+
+
+def _frozen_boundary(periods: DataFrame):
+    "Start date of the last closed period, or None if none are closed."
+    closed = periods.loc[periods['is_closed'].astype(bool), 'start_date']
+    return closed.max() if len(closed) else None
+
+
+@log_func_call
+def compute_account_balances(cxn: Connection,
+                             keys: DataFrame = None) -> DataFrame:
+    """
+    Recompute account_balances rows for all open fiscal periods.
+
+    Periods up to and including the last closed period are treated as
+    frozen snapshots (their lines may have been archived), so balances
+    start from each account's latest closing balance in that range and add
+    the posted lines of the later periods.  Extra (account_id,
+    fiscal_period_id) `keys` in open periods get rows even without
+    activity.  Amounts are scaled integers.
+    """
+    periods = get_fiscal_periods(cxn)
+    boundary = _frozen_boundary(periods)
+    open_periods = (periods if boundary is None
+                    else periods[periods['start_date'] > boundary])
+
+    if boundary is None:
+        base = Series(dtype=int64)
+    else:
+        rows = read_sql_query("""
+        SELECT account_id, closing_balance FROM (
+            SELECT ab.account_id, ab.closing_balance, ROW_NUMBER() OVER (
+                PARTITION BY ab.account_id ORDER BY fp.start_date DESC
+            ) AS rn
+            FROM account_balances ab
+            JOIN fiscal_periods fp ON fp.id = ab.fiscal_period_id
+            WHERE fp.start_date <= ?
+        ) WHERE rn = 1
+        """, cxn, params=(boundary,))
+        base = Series(amounts_to_intvals(rows['closing_balance']).to_numpy(),
+                      index=rows['account_id'])
+
+    lines = get_posted_lines(cxn)
+    deltas = compute_balance_deltas(cxn, lines, periods)
+    deltas = deltas[deltas['fiscal_period_id'].isin(open_periods['id'])]
+
+    extra = keys
+    keys = deltas[['account_id', 'fiscal_period_id']]
+    if extra is not None:
+        extra = extra[extra['fiscal_period_id'].isin(open_periods['id'])]
+        keys = keys.merge(extra[['account_id', 'fiscal_period_id']],
+                          how='outer')
+    if boundary is not None and len(open_periods):
+        # closing a period carries every nonzero balance forward into the
+        # next one, so rebuild those snapshot rows too
+        carried = DataFrame({
+            'account_id': base.index[base.to_numpy() != 0],
+            'fiscal_period_id': open_periods['id'].iloc[0],
+        })
+        keys = keys.merge(carried, how='outer')
+
+    out = keys.merge(deltas, how='left').fillna({'debit': 0, 'credit': 0})
+    out = out.merge(periods[['id', 'start_date']],
+                    left_on='fiscal_period_id', right_on='id')
+    out = out.sort_values(['account_id', 'start_date'], ignore_index=True)
+    out['debit'] = out['debit'].astype(int64)
+    out['credit'] = out['credit'].astype(int64)
+    net = out['debit'] - out['credit']
+    opening = (out['account_id'].map(base).fillna(0).astype(int64)
+               + net.groupby(out['account_id']).cumsum() - net)
+    return DataFrame({
+        'account_id': out['account_id'].astype(int64),
+        'fiscal_period_id': out['fiscal_period_id'].astype(int64),
+        'opening_balance': opening,
+        'debit_total': out['debit'],
+        'credit_total': out['credit'],
+        'closing_balance': opening + net,
+    })
+
+
+def write_account_balances(cxn: Connection, balances: DataFrame):
+    """
+    Replace the account_balances rows of all open periods with `balances`
+    (as returned by compute_account_balances).  Must be called inside the
+    caller's transaction.
+    """
+    cxn.execute("""
+    DELETE FROM account_balances WHERE fiscal_period_id IN (
+        SELECT id FROM fiscal_periods WHERE NOT is_closed
+    )
+    """)
+    cxn.executemany(f"""
+    INSERT INTO account_balances
+    (account_id, fiscal_period_id, {', '.join(BALANCE_COLUMNS)})
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, list(zip(
+        balances['account_id'].tolist(),
+        balances['fiscal_period_id'].tolist(),
+        *(_to_amounts(balances[c]) for c in BALANCE_COLUMNS),
+    )))
+
+
+@log_func_call
+def rebuild_account_balances(cxn: Connection):
+    "Recompute account_balances for all open periods from journal lines."
+    expected = compute_account_balances(cxn)
+    with cxn:
+        write_account_balances(cxn, expected)
+    get_logger().info(f"Rebuilt {len(expected)} account balance rows")
+
+
+@log_func_call
+def check_account_balances(cxn: Connection) -> DataFrame:
+    """
+    Compare account_balances for open periods against a full recompute.
+
+    Returns the mismatching (account_id, fiscal_period_id) rows with
+    expected_* and actual_* columns as scaled integers; empty if the table
+    is consistent.
+    """
+    actual = read_sql_query(f"""
+    SELECT ab.account_id, ab.fiscal_period_id, {', '.join(BALANCE_COLUMNS)}
+    FROM account_balances ab
+    JOIN fiscal_periods fp ON fp.id = ab.fiscal_period_id
+    WHERE NOT fp.is_closed
+    """, cxn)
+    for col in BALANCE_COLUMNS:
+        actual[col] = amounts_to_intvals(actual[col])
+
+    keys = ['account_id', 'fiscal_period_id']
+    expected = compute_account_balances(cxn, actual[keys])
+    merged = expected.merge(actual, on=keys, how='left',
+                            suffixes=('_expected', '_actual'))
+    # snapshot rows without activity are optional
+    bad = (merged['closing_balance_actual'].isna()
+           & ((merged['debit_total_expected'] != 0)
+              | (merged['credit_total_expected'] != 0)))
+    present = merged['closing_balance_actual'].notna()
+    for col in BALANCE_COLUMNS:
+        bad |= present & (merged[f'{col}_expected']
+                          != merged[f'{col}_actual'])
+
+    mismatches = merged[bad.to_numpy()].reset_index(drop=True)
+    if len(mismatches):
+        get_logger().warning(f"{len(mismatches)} account_balances rows are "
+                             "inconsistent with journal lines")
+    return mismatches
+
+
+# Balances of every account as of the end of period :period_id, taken from
+# its latest account_balances row; activity only counts if that row belongs
+# to the requested period
+_PERIOD_BALANCES_SQL = """
+SELECT account_id,
+    CASE WHEN fiscal_period_id = :period_id
+        THEN opening_balance ELSE closing_balance END AS opening_balance,
+    CASE WHEN fiscal_period_id = :period_id
+        THEN debit_total ELSE 0 END AS debit_total,
+    CASE WHEN fiscal_period_id = :period_id
+        THEN credit_total ELSE 0 END AS credit_total,
+    closing_balance
+FROM (
+    SELECT ab.*, ROW_NUMBER() OVER (
+        PARTITION BY ab.account_id ORDER BY fp.start_date DESC
+    ) AS rn
+    FROM account_balances ab
+    JOIN fiscal_periods fp ON fp.id = ab.fiscal_period_id
+    WHERE fp.start_date <= (
+        SELECT start_date FROM fiscal_periods WHERE id = :period_id
+    )
+) WHERE rn = 1
+"""
+
+
+@log_func_call
+def get_account_balances(cxn: Connection, fiscal_period_id: int) -> DataFrame:
+    """
+    Balances of every account as of the end of a fiscal period, read from
+    the latest account_balances row at or before that period.
+
+    Amounts are scaled integers; balances are debit-positive.
+    """
+    df = read_sql_query(_PERIOD_BALANCES_SQL, cxn,
+                        params={'period_id': fiscal_period_id})
+    for col in BALANCE_COLUMNS:
+        df[col] = amounts_to_intvals(df[col])
+    return df
+
+
+@log_func_call
+def get_account_rollup(cxn: Connection, fiscal_period_id: int) -> DataFrame:
+    """
+    Subtree totals for every node of the chart of accounts as of the end of
+    a fiscal period, in one grouped query over account_closure.
+
+    Each account's row sums its own balances and those of all its
+    descendants.  Amounts are Money columns; balances are debit-positive.
+    """
+    df = read_sql_query(f"""
+    WITH bal AS ({_PERIOD_BALANCES_SQL})
+    SELECT a.id AS account_id, a.code, a.name, a.account_type,
+           a.parent_account_id,
+           {', '.join(f'TOTAL(bal.{c}) AS {c}' for c in BALANCE_COLUMNS)}
+    FROM accounts a
+    JOIN account_closure c ON c.ancestor_id = a.id
+    LEFT JOIN bal ON bal.account_id = c.descendant_id
+    GROUP BY a.id
+    ORDER BY a.code
+    """, cxn, params={'period_id': fiscal_period_id})
+    df['parent_account_id'] = df['parent_account_id'].astype('Int64')
+    for col in BALANCE_COLUMNS:
+        df[col] = MoneyExtensionArray(amounts_to_intvals(df[col]).to_numpy())
+    return df
+
+
+@log_func_call
+def get_subtree_account_ids(cxn: Connection, account_id: int) -> list[int]:
+    "Ids of an account and all of its descendants."
+    return [r[0] for r in cxn.execute(
+        "SELECT descendant_id FROM account_closure WHERE ancestor_id = ? "
+        "ORDER BY depth, descendant_id", (account_id,)
+    )]
+
+
+@log_func_call
+def get_trial_balance(cxn: Connection, fiscal_period_id: int) -> DataFrame:
+    """
+    Trial balance as of the end of a fiscal period: one row per account
+    with a nonzero balance, split into Money debit and credit columns.
+    """
+    bal = get_account_balances(cxn, fiscal_period_id)
+    bal = bal[bal['closing_balance'] != 0]
+    accounts = read_sql_query(
+        "SELECT id AS account_id, code, name, account_type FROM accounts",
+        cxn
+    )
+    tb = accounts.merge(bal[['account_id', 'closing_balance']],
+                        on='account_id').sort_values('code',
+                                                     ignore_index=True)
+    closing = tb.pop('closing_balance').to_numpy(dtype=int64)
+    tb['debit'] = MoneyExtensionArray(closing.clip(0))
+    tb['credit'] = MoneyExtensionArray((-closing).clip(0))
+    return tb
@@ -222,3 +222,104 @@ def insert_default_accounts(cxn: Connection):
         (id, code, name, account_type, parent_account_id, description)
         VALUES (?, ?, ?, ?, ?, ?)
         """, (i, code, name, acc_type, parent_id, desc))
+
+
+@log_func_call
+def create_account_closure(cxn: Connection):
+    """
+    Create the account_closure table, which holds every (ancestor,
+    descendant) pair of the account tree including each account paired with
+    itself at depth 0, and the triggers that keep it in sync with
+    accounts.parent_account_id.
+    """
+    cxn.execute("""
+    CREATE TABLE IF NOT EXISTS account_closure (
+        ancestor_id INTEGER NOT NULL,
+        descendant_id INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id),
+        FOREIGN KEY (ancestor_id) REFERENCES accounts(id),
+        FOREIGN KEY (descendant_id) REFERENCES accounts(id)
+    ) WITHOUT ROWID
+    """)
+    cxn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_account_closure_descendant "
+        "ON account_closure(descendant_id)"
+    )
+
+    # New accounts inherit their parent's ancestors
+    cxn.execute("""
+    CREATE TRIGGER IF NOT EXISTS insert_account_closure
+    AFTER INSERT ON accounts
+    BEGIN
+        INSERT INTO account_closure (ancestor_id, descendant_id, depth)
+        SELECT NEW.id, NEW.id, 0
+        UNION ALL
+        SELECT ancestor_id, NEW.id, depth + 1 FROM account_closure
+        WHERE descendant_id = NEW.parent_account_id;
+    END
+    """)
+
+    # Reject reparenting an account under itself or its own subtree
+    cxn.execute("""
+    CREATE TRIGGER IF NOT EXISTS check_account_reparent
+    BEFORE UPDATE OF parent_account_id ON accounts
+    WHEN NEW.parent_account_id IN (
+        SELECT descendant_id FROM account_closure WHERE ancestor_id = NEW.id
+    )
+    BEGIN
+        SELECT RAISE(ABORT, 'account cannot be its own ancestor');
+    END
+    """)
+
+    # Move the whole subtree: drop links from the old ancestors, then link
+    # every node of the subtree to every ancestor of the new parent
+    cxn.execute("""
+    CREATE TRIGGER IF NOT EXISTS update_account_closure
+    AFTER UPDATE OF parent_account_id ON accounts
+    WHEN OLD.parent_account_id IS NOT NEW.parent_account_id
+    BEGIN
+        DELETE FROM account_closure
+        WHERE descendant_id IN (
+            SELECT descendant_id FROM account_closure
+            WHERE ancestor_id = NEW.id
+        )
+        AND ancestor_id IN (
+            SELECT ancestor_id FROM account_closure
+            WHERE descendant_id = NEW.id AND ancestor_id != NEW.id
+        );
+
+        INSERT INTO account_closure (ancestor_id, descendant_id, depth)
+        SELECT sup.ancestor_id, sub.descendant_id, sup.depth + sub.depth + 1
+        FROM account_closure sup, account_closure sub
+        WHERE sup.descendant_id = NEW.parent_account_id
+        AND sub.ancestor_id = NEW.id;
+    END
+    """)
+
+    cxn.execute("""
+    CREATE TRIGGER IF NOT EXISTS delete_account_closure
+    AFTER DELETE ON accounts
+    BEGIN
+        DELETE FROM account_closure
+        WHERE ancestor_id = OLD.id OR descendant_id = OLD.id;
+    END
+    """)
+
+    rebuild_account_closure(cxn)
+
+
+@log_func_call
+def rebuild_account_closure(cxn: Connection):
+    "Repopulate account_closure from accounts.parent_account_id."
+    cxn.execute("DELETE FROM account_closure")
+    cxn.execute("""
+    INSERT INTO account_closure (ancestor_id, descendant_id, depth)
+    WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+        SELECT id, id, 0 FROM accounts
+        UNION ALL
+        SELECT tree.ancestor_id, a.id, tree.depth + 1
+        FROM tree JOIN accounts a ON a.parent_account_id = tree.descendant_id
+    )
+    SELECT ancestor_id, descendant_id, depth FROM tree
+    """)
@@ -1,30 +1,158 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
 from pandas import Series
-from numpy import divmod as npdivmod
+from numpy import asarray, array2string, errstate, iinfo, int64, zeros
 
 from pyapp.utils.math import round_half_away
 
 
+_INT64_MAX = iinfo(int64).max
+# int64 products and sums below this magnitude (with float error to spare)
+# are safe
+_SAFE_PRODUCT = 2.0**62
+
+
+def div_half_away(num, den):
+    """
+    Integer division rounding halves away from zero, done without floats.
+
+    Works on plain ints as well as numpy integer arrays, without forming
+    intermediates larger than `num`.
+    """
+    if type(num) is int and type(den) is int:
+        quo, rem = divmod(abs(num), abs(den))
+        quo += 2*rem >= abs(den)
+        return -quo if (num < 0) != (den < 0) else quo
+    neg = (num < 0) ^ (den < 0)
+    num = abs(num)
+    den = abs(den)
+    quo = num // den
+    rem = num - quo*den
+    quo = quo + (rem >= den - rem)
+    return quo - 2*quo*neg
+
+
+def mul_intvals(a, b, den=1):
+    """
+    Elementwise a*b over int64 arrays (divided by `den`, rounding half
+    away), computed with exact Python ints where int64 would wrap around.
+    Raises OverflowError if a result does not fit in int64.
+    """
+    a = asarray(a, dtype=int64)
+    b = asarray(b, dtype=int64)
+    est = abs(a.astype(float))*abs(b.astype(float))
+    if est.size and est.max() >= _SAFE_PRODUCT:
+        out = a.astype(object)*b.astype(object)
+        if den != 1:
+            out = div_half_away(out, den)
+        return _exact_to_int64(out, 'product')
+    out = a*b
+    return out if den == 1 else div_half_away(out, den)
+
+
+def _exact_to_int64(values, what: str):
+    "Python int results as int64, raising OverflowError if one is too big."
+    try:
+        return asarray(values).astype(int64)
+    except OverflowError:
+        raise OverflowError(f"Fixed4 {what} out of range") from None
+
+
+def add_intvals(a, b, subtract: bool = False):
+    """
+    Elementwise a + b (or a - b) over int64 arrays, raising OverflowError
+    where int64 would wrap around.
+    """
+    a = asarray(a, dtype=int64)
+    b = asarray(b, dtype=int64)
+    with errstate(over='ignore'):
+        out = a - b if subtract else a + b
+    # wrapped iff the result's sign differs from a's and from (+/-)b's
+    wrapped = (a ^ out) & ((a ^ b) if subtract else (b ^ out))
+    if (wrapped < 0).any():
+        raise OverflowError(f"Fixed4 {'difference' if subtract else 'sum'} "
+                            "out of range")
+    return out
+
+
+def _sum_is_safe(intvals) -> bool:
+    "Whether every partial sum of `intvals` surely fits in int64."
+    return abs(asarray(intvals).astype(float)).sum() < _SAFE_PRODUCT
+
+
+def check_sum_range(intvals):
+    """
+    Raise OverflowError unless every partial (or grouped) sum of `intvals`
+    fits in int64, i.e. unless the sum of their magnitudes does.
+    """
+    if (not _sum_is_safe(intvals)
+            and sum(abs(x) for x in asarray(intvals).tolist()) > _INT64_MAX):
+        raise OverflowError("Fixed4 sum out of range")
+
+
+def checked_intvals(values):
+    "Round float scaled values to int64, raising OverflowError if too big."
+    values = asarray(values)
+    if values.size and not abs(values).max() < _INT64_MAX:
+        raise OverflowError("Fixed4 value out of range")
+    return round_half_away(values)
+
+
 class Fixed4:
     DIGITS = 4
     INTSCALAR = 10**DIGITS
     __slots__ = ('__intval',)
 
     def __init__(self,
-                 value: 'float | int | str | Series | Fixed4 | None' = None,
+                 value: 'float | int | str | Decimal | Series | Fixed4 | None'
+                 = None,
                  intval: int | None = None):
-        if value is not None and intval is not None:
+        """
+        Ints, strings and Decimals are scaled exactly without going through
+        float; other values are converted with float() and rounded half-away.
+        """
+        if value is None:
+            self.__intval = intval or 0
+            return
+
+        if intval is not None:
             raise TypeError("Cannot specify both 'value' and 'intval'")
 
-        if value is not None:
-            if isinstance(value, Fixed4):
-                intval = value.__intval
-            else:
-                value = (value.astype(float) if isinstance(value, Series)
-                         else float(value))
-                intval = round_half_away(value*self.INTSCALAR)
+        if isinstance(value, Fixed4):
+            intval = value.__intval
+        elif isinstance(value, int):
+            intval = value*self.INTSCALAR
+        elif isinstance(value, (str, Decimal)):
+            intval = self._decimal_intval(value)
+        else:
+            value = (value.astype(float) if isinstance(value, Series)
+                     else float(value))
+            intval = round_half_away(value*self.INTSCALAR)
 
         self.__intval = intval or 0
 
+    @classmethod
+    def _decimal_intval(cls, value: 'str | Decimal') -> int:
+        if isinstance(value, str):
+            # plain decimal strings are scaled by shifting the point
+            whole, _, frac = value.strip().partition('.')
+            digits = whole[1:] if whole[:1] in ('-', '+') else whole
+            if len(frac) <= cls.DIGITS and (digits + frac).isdecimal():
+                return int(whole + frac.ljust(cls.DIGITS, '0'))
+        try:
+            value = Decimal(value)
+        except InvalidOperation:
+            raise ValueError(f"Cannot convert {value!r} to "
+                             f"{cls.__name__}") from None
+        return int(value.scaleb(cls.DIGITS).to_integral_value(ROUND_HALF_UP))
+
+    @classmethod
+    def _from_intval(cls, intval: int):
+        "Build an instance from a scaled value, skipping argument checks."
+        obj = object.__new__(cls)
+        obj.__intval = intval
+        return obj
+
     @property
     def intval(self):
         return self.__intval
@@ -67,10 +195,10 @@ class Fixed4:
         return self.__class__(self)
 
     def __neg__(self):
-        return self.__class__(intval=-self.__intval)
+        return self._from_intval(-self.__intval)
 
     def _add_fixed4(self, other: 'Fixed4'):
-        return self.__class__(intval=self.__intval + other.__intval)
+        return self._from_intval(self.__intval + other.__intval)
 
     def __add__(self, other):
         """
@@ -78,39 +206,48 @@ class Fixed4:
         Fixed4 instance first and then operate on the floats.  Otherwise, we
         assume you want to continue working in fixed precision.
         """
+        if type(other) is Fixed4:
+            return self._add_fixed4(other)
         if isinstance(other, (int, float)) and other == 0:
             return self
+        if isinstance(other, Fixed4Array):
+            return NotImplemented
         if not isinstance(other, Fixed4):
             return self + self.__class__(other)
-        if not type(other) is Fixed4:
-            return NotImplemented
-        return self._add_fixed4(other)
+        return NotImplemented
 
     def __sub__(self, other):
         return self + -other
 
     def _mul_fixed4(self, other: 'Fixed4'):
         # M1 * M2 = M1x/1e4 * M2x/1e4 = M1x*M2x/1e8 = (M1x*M2x/1e4) / 1e4
-        x = self.__intval*other.__intval/self.INTSCALAR
-        return self.__class__(intval=round_half_away(x))
+        return self._from_intval(div_half_away(
+            self.__intval*other.__intval, self.INTSCALAR
+        ))
 
     def __mul__(self, other):
         """
         If you want to get a float value, you need to call float() on the
         Fixed4 instance first and then operate on the floats.  Otherwise, we
         assume you want to continue working in fixed precision.
+
+        Integer and Fixed4 operands are multiplied exactly in integers.
         """
-        if isinstance(other, (int, float)):
+        if isinstance(other, int):
+            return self._from_intval(self.__intval*other)
+        if type(other) is Fixed4:
+            return self._mul_fixed4(other)
+        if isinstance(other, float):
             if other == 0:
                 return self.__class__()
             if other == 1:
                 return self
 
-        if not isinstance(other, Fixed4):
-            return self.__class__(intval=round_half_away(self.__intval*other))
-        if not type(other) is Fixed4:
+        if isinstance(other, Fixed4Array):
             return NotImplemented
-        return self._mul_fixed4(other)
+        if not isinstance(other, Fixed4):
+            return self._from_intval(round_half_away(self.__intval*other))
+        return NotImplemented
 
     def _truediv_fixed4(self, other: 'Fixed4'):
         # M1 / M2 = M1x/10000 / M2x/10000
@@ -124,15 +261,19 @@ class Fixed4:
         assume you want to continue working in fixed precision.
 
         The exception is if you divide two Fixed4 instances, which will return
-        a float.
+        a float.  Integer divisors are handled exactly in integers.
         """
-        if isinstance(other, (int, float)) and other == 1:
+        if isinstance(other, int):
+            return self._from_intval(div_half_away(self.__intval, other))
+        if type(other) is Fixed4:
+            return self._truediv_fixed4(other)
+        if isinstance(other, float) and other == 1:
             return self
-        if not isinstance(other, Fixed4):
-            return self.__class__(intval=round_half_away(self.__intval/other))
-        if not type(other) is Fixed4:
+        if isinstance(other, Fixed4Array):
             return NotImplemented
-        return self._truediv_fixed4(other)
+        if not isinstance(other, Fixed4):
+            return self._from_intval(round_half_away(self.__intval/other))
+        return NotImplemented
 
     __radd__ = __add__
 
@@ -142,48 +283,80 @@ class Fixed4:
     __rmul__ = __mul__
 
     def __rtruediv__(self, other):
+        if isinstance(other, int):
+            scl = self.INTSCALAR
+            return self._from_intval(div_half_away(other*scl*scl,
+                                                   self.__intval))
         return self.__class__(other*self.INTSCALAR/self.__intval)
 
     def __abs__(self):
-        return self.__class__(intval=abs(self.__intval))
+        return self._from_intval(abs(self.__intval))
 
     def __eq__(self, other):
         if isinstance(other, Fixed4):
             return self.__intval == other.__intval
+        if isinstance(other, Fixed4Array):
+            return NotImplemented
         return other == 0 and not self.__intval
 
-    def __lt__(self, other):
+    def _cmp_intval(self, other):
+        """
+        Return the scaled value to order against, None to defer to an array
+        operand, or raise TypeError for operands we cannot order against.
+        """
+        if isinstance(other, Fixed4):
+            return other.__intval
         if isinstance(other, (int, float)) and other == 0:
-            return self.__intval < 0
-        if not isinstance(other, Fixed4):
-            raise TypeError('Cannot compare Fixed4 to non-Fixed4')
-        return self.__intval < other.__intval
+            return 0
+        if isinstance(other, Fixed4Array):
+            return None
+        raise TypeError('Cannot compare Fixed4 to non-Fixed4')
+
+    def __lt__(self, other):
+        intval = self._cmp_intval(other)
+        return NotImplemented if intval is None else self.__intval < intval
 
     def __gt__(self, other):
-        if isinstance(other, (int, float)) and other == 0:
-            return self.__intval > 0
-        if not isinstance(other, Fixed4):
-            raise TypeError('Cannot compare Fixed4 to non-Fixed4')
-        return self.__intval > other.__intval
+        intval = self._cmp_intval(other)
+        return NotImplemented if intval is None else self.__intval > intval
 
     def __le__(self, other):
-        return self == other or self < other
+        if type(other) is type(self):
+            return self.__intval <= other.__intval
+        intval = self._cmp_intval(other)
+        return NotImplemented if intval is None else self.__intval <= intval
 
     def __ge__(self, other):
-        return self == other or self > other
+        if type(other) is type(self):
+            return self.__intval >= other.__intval
+        intval = self._cmp_intval(other)
+        return NotImplemented if intval is None else self.__intval >= intval
 
     def __floordiv__(self, other):
+        if isinstance(other, Fixed4):
+            return self.__intval // other.__intval
+        if isinstance(other, int):
+            return self.__intval // (other*self.INTSCALAR)
+        if isinstance(other, Fixed4Array):
+            return NotImplemented
         return int(float(self) // other)
 
     def __mod__(self, other):
-        denom = (other.__intval if isinstance(other, Fixed4)
-                 else other*self.INTSCALAR)
-        return self.__class__(intval=round_half_away(self.__intval % denom))
+        if isinstance(other, Fixed4):
+            return self._from_intval(self.__intval % other.__intval)
+        if isinstance(other, int):
+            return self._from_intval(self.__intval % (other*self.INTSCALAR))
+        if isinstance(other, Fixed4Array):
+            return NotImplemented
+        denom = other*self.INTSCALAR
+        return self._from_intval(round_half_away(self.__intval % denom))
 
     def __divmod__(self, other):
         return self // other, self % other
 
     def __rfloordiv__(self, other):
+        if isinstance(other, int):
+            return other*self.INTSCALAR // self.__intval
         return int(other // float(self))
 
     def __rmod__(self, other):
@@ -193,24 +366,21 @@ class Fixed4:
         return other // self, other % self
 
     def __trunc__(self):
-        # x = floor(self)
-        # return x + (x < 0)
+        # round toward zero on the magnitude so exact negative integers are
+        # left alone
+        intval = self.__intval
         scl = self.INTSCALAR
-        flr = self.__intval // scl
-        return self.__class__(intval=(flr + (flr < 0))*scl)
+        return self._from_intval((abs(intval) // scl)*scl
+                                 * (1 - 2*(intval < 0)))
 
     def __floor__(self):
         # return self.__intval // self.INTSCALAR
         scl = self.INTSCALAR
-        return self.__class__(intval=(self.__intval // scl)*scl)
+        return self._from_intval((self.__intval // scl)*scl)
 
     def __ceil__(self):
-        # quo, rem = divmod(self.__intval, self.INTSCALAR)
-        # return quo + (rem > 0)
-        intval = self.__intval
         scl = self.INTSCALAR
-        quo, rem = npdivmod(intval, scl)
-        return self.__class__(intval=(quo + (rem > 0))*scl)
+        return self._from_intval(-(-self.__intval // scl)*scl)
 
     # these should really be handled as floats to reduce complexity here since
     # they will likely be rarely used
@@ -220,3 +390,282 @@ class Fixed4:
 
     # def __rpow__(self, other, modulo=None):
     #     return NotImplemented
+
+
+class Fixed4Array:
+    """
+    Columnar counterpart to Fixed4, backed by an int64 numpy buffer holding
+    the same scaled integer values as Fixed4.intval.
+
+    Arithmetic follows the Fixed4 rules (half-away rounding, fixed/fixed
+    division giving floats), but runs over the whole buffer at once.  Integer
+    operands and reductions are handled entirely in integer arithmetic.
+    """
+    SCALAR = Fixed4
+    DIGITS = Fixed4.DIGITS
+    INTSCALAR = Fixed4.INTSCALAR
+    __slots__ = ('__intvals',)
+    # defer to our reflected operators instead of broadcasting elementwise
+    __array_ufunc__ = None
+
+    def __init__(self, values=None, intvals=None):
+        if values is not None and intvals is not None:
+            raise TypeError("Cannot specify both 'values' and 'intvals'")
+
+        if values is not None:
+            intvals = self._to_intvals(values)
+
+        self.__intvals = (zeros(0, dtype=int64) if intvals is None
+                          else asarray(intvals, dtype=int64))
+
+    @classmethod
+    def _to_intvals(cls, values):
+        if isinstance(values, Fixed4Array):
+            return values.__intvals
+
+        values = asarray(values)
+        kind = values.dtype.kind
+        if kind in 'iub':
+            return mul_intvals(values, cls.INTSCALAR)
+        if kind == 'f':
+            return checked_intvals(values*cls.INTSCALAR)
+
+        # objects, strings, etc. go through the scalar constructor
+        scalar = cls.SCALAR
+        return asarray([scalar(v).intval for v in values.ravel()],
+                       dtype=int64).reshape(values.shape)
+
+    def _fixed_intvals(self, other):
+        "Return the scaled values of a same-typed operand, or None."
+        if type(other) is type(self):
+            return other.__intvals
+        if type(other) is self.SCALAR:
+            return other.intval
+
+    @property
+    def intvals(self):
+        return self.__intvals
+
+    def __len__(self):
+        return len(self.__intvals)
+
+    def __iter__(self):
+        scalar = self.SCALAR
+        for x in self.__intvals.tolist():
+            yield scalar(intval=x)
+
+    def __getitem__(self, key):
+        out = self.__intvals[key]
+        if out.ndim:
+            return self.__class__(intvals=out)
+        return self.SCALAR(intval=int(out))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(intvals={self.__intvals!r})"
+
+    def __str__(self):
+        return array2string(self.to_float(), separator=', ',
+                            formatter={'float_kind': lambda x: f"{x:.4f}"})
+
+    def __bool__(self):
+        raise ValueError(f"The truth value of a {self.__class__.__name__} "
+                         "is ambiguous")
+
+    def to_float(self):
+        return self.__intvals/self.INTSCALAR
+
+    def sum(self):
+        intvals = self.__intvals
+        if not _sum_is_safe(intvals):
+            # the scalar holds any int, so add exactly rather than wrap
+            return self.SCALAR(intval=sum(intvals.tolist()))
+        return self.SCALAR(intval=int(intvals.sum()))
+
+    def cumsum(self):
+        intvals = self.__intvals
+        if not _sum_is_safe(intvals):
+            return self.__class__(intvals=_exact_to_int64(
+                intvals.astype(object).cumsum(), 'sum'
+            ))
+        return self.__class__(intvals=intvals.cumsum())
+
+    def min(self):
+        return self.SCALAR(intval=int(self.__intvals.min()))
+
+    def max(self):
+        return self.SCALAR(intval=int(self.__intvals.max()))
+
+    def __round__(self, n: int = 0):
+        """
+        Round each value to a given number of decimal places.
+
+        This does NOT apply banker's rounding; returns half-away rounding as
+        an int64 array for n <= 0 and a float array otherwise.
+        """
+        n = n or 0
+        if n > self.DIGITS:
+            raise ValueError(f"Cannot round to more than {self.DIGITS} "
+                             "decimal places")
+        out = div_half_away(self.__intvals, 10**(self.DIGITS - n))
+        if n <= 0:
+            return out*10**-n
+        return out/10**n
+
+    def __pos__(self):
+        return self.__class__(self)
+
+    def __neg__(self):
+        return self.__class__(intvals=-self.__intvals)
+
+    def __abs__(self):
+        return self.__class__(intvals=abs(self.__intvals))
+
+    def __add__(self, other):
+        intvals = self._fixed_intvals(other)
+        if intvals is None:
+            if isinstance(other, (Fixed4, Fixed4Array)):
+                return NotImplemented
+            intvals = self._to_intvals(other)
+        return self.__class__(intvals=add_intvals(self.__intvals, intvals))
+
+    def __sub__(self, other):
+        intvals = self._fixed_intvals(other)
+        if intvals is None:
+            if isinstance(other, (Fixed4, Fixed4Array)):
+                return NotImplemented
+            intvals = self._to_intvals(other)
+        return self.__class__(intvals=add_intvals(self.__intvals, intvals,
+                                                  subtract=True))
+
+    def __mul__(self, other):
+        intvals = self._fixed_intvals(other)
+        if intvals is not None:
+            return self.__class__(intvals=mul_intvals(
+                self.__intvals, intvals, self.INTSCALAR
+            ))
+        if isinstance(other, (Fixed4, Fixed4Array)):
+            return NotImplemented
+
+        other = asarray(other)
+        if other.dtype.kind != 'f':
+            return self.__class__(intvals=mul_intvals(self.__intvals,
+                                                      other))
+        return self.__class__(intvals=checked_intvals(self.__intvals*other))
+
+    def __truediv__(self, other):
+        """
+        Dividing by another fixed value returns a float array, as for Fixed4.
+        Integer divisors are handled exactly.
+        """
+        intvals = self._fixed_intvals(other)
+        if intvals is not None:
+            return self.__intvals/intvals
+        if isinstance(other, (Fixed4, Fixed4Array)):
+            return NotImplemented
+
+        other = asarray(other)
+        if other.dtype.kind != 'f':
+            return self.__class__(intvals=div_half_away(self.__intvals,
+                                                        other))
+        return self.__class__(intvals=checked_intvals(self.__intvals/other))
+
+    __radd__ = __add__
+
+    def __rsub__(self, other):
+        return other + -self
+
+    __rmul__ = __mul__
+
+    def __rtruediv__(self, other):
+        intvals = self._fixed_intvals(other)
+        if intvals is not None:
+            return intvals/self.__intvals
+        return self.__class__(asarray(other)*self.INTSCALAR/self.__intvals)
+
+    def __floordiv__(self, other):
+        intvals = self._fixed_intvals(other)
+        if intvals is None:
+            if isinstance(other, (Fixed4, Fixed4Array)):
+                return NotImplemented
+            other = asarray(other)
+            if other.dtype.kind == 'f':
+                return (self.to_float() // other).astype(int64)
+            intvals = other*self.INTSCALAR
+        return self.__intvals // intvals
+
+    def __mod__(self, other):
+        intvals = self._fixed_intvals(other)
+        if intvals is None:
+            if isinstance(other, (Fixed4, Fixed4Array)):
+                return NotImplemented
+            intvals = asarray(other)*self.INTSCALAR
+        return self.__class__(intvals=round_half_away(self.__intvals
+                                                      % intvals))
+
+    def __divmod__(self, other):
+        return self // other, self % other
+
+    def __rfloordiv__(self, other):
+        intvals = self._fixed_intvals(other)
+        if intvals is None:
+            other = asarray(other)
+            if other.dtype.kind == 'f':
+                return (other // self.to_float()).astype(int64)
+            intvals = other*self.INTSCALAR
+        return intvals // self.__intvals
+
+    def __rmod__(self, other):
+        intvals = self._fixed_intvals(other)
+        if intvals is not None:
+            return self.__class__(intvals=intvals % self.__intvals)
+        return other % self.to_float()
+
+    def __rdivmod__(self, other):
+        return other // self, other % self
+
+    def __trunc__(self):
+        intvals = self.__intvals
+        scl = self.INTSCALAR
+        return self.__class__(intvals=(abs(intvals) // scl)*scl
+                              * (1 - 2*(intvals < 0)))
+
+    def __floor__(self):
+        scl = self.INTSCALAR
+        return self.__class__(intvals=(self.__intvals // scl)*scl)
+
+    def __ceil__(self):
+        scl = self.INTSCALAR
+        return self.__class__(intvals=-(-self.__intvals // scl)*scl)
+
+    def _cmp_intvals(self, other):
+        if isinstance(other, (int, float)) and other == 0:
+            return 0
+        intvals = self._fixed_intvals(other)
+        if intvals is None:
+            name = self.__class__.__name__
+            raise TypeError(f'Cannot compare {name} to non-{name}')
+        return intvals
+
+    def __eq__(self, other):
+        if isinstance(other, Fixed4):
+            return self.__intvals == other.intval
+        if isinstance(other, Fixed4Array):
+            return self.__intvals == other.__intvals
+        if isinstance(other, (int, float)) and other == 0:
+            return self.__intvals == 0
+        return zeros(len(self), dtype=bool)
+
+    def __ne__(self, other):
+        return ~(self == other)
+
+    def __lt__(self, other):
+        return self.__intvals < self._cmp_intvals(other)
+
+    def __gt__(self, other):
+        return self.__intvals > self._cmp_intvals(other)
+
+    def __le__(self, other):
+        return self.__intvals <= self._cmp_intvals(other)
+
+    def __ge__(self, other):
+        return self.__intvals >= self._cmp_intvals(other)
@@ -1,4 +1,6 @@
-from .fixed4 import Fixed4
+from numpy import array2string
+
+from .fixed4 import Fixed4, Fixed4Array
 
 
 class Money(Fixed4):
@@ -9,10 +11,10 @@ class Money(Fixed4):
         return f"${round(self, 2):.2f}"
 
     def __add__(self, other):
-        if isinstance(other, (int, float)) and other == 0:
-            return self
         if isinstance(other, Money):
             return self._add_fixed4(other)
+        if isinstance(other, (int, float)) and other == 0:
+            return self
         return NotImplemented
 
     def __mul__(self, other):
@@ -30,16 +32,39 @@ class Money(Fixed4):
     def __rtruediv__(self, other):
         return NotImplemented
 
-    def __lt__(self, other):
+    def _cmp_intval(self, other):
+        if isinstance(other, Money):
+            return other.intval
         if isinstance(other, (int, float)) and other == 0:
-            return self.intval < 0
-        if not isinstance(other, Money):
-            raise TypeError('Cannot compare Money to non-Money')
-        return self.intval < other.intval
+            return 0
+        if isinstance(other, Fixed4Array):
+            return None
+        raise TypeError('Cannot compare Money to non-Money')
 
-    def __gt__(self, other):
+
+class MoneyArray(Fixed4Array):
+    "Columnar counterpart to Money with the same operand restrictions."
+    SCALAR = Money
+    __slots__ = ()
+
+    def __str__(self):
+        return array2string(round(self, 2), separator=', ',
+                            formatter={'float_kind': lambda x: f"${x:.2f}"})
+
+    def __add__(self, other):
         if isinstance(other, (int, float)) and other == 0:
-            return self.intval > 0
-        if not isinstance(other, Money):
-            raise TypeError('Cannot compare Money to non-Money')
-        return self.intval > other.intval
+            return self
+        if isinstance(other, (Money, MoneyArray)):
+            return super().__add__(other)
+        return NotImplemented
+
+    def __mul__(self, other):
+        if isinstance(other, (Money, MoneyArray)):
+            raise TypeError("Cannot multiply two Money instances.")
+        return super().__mul__(other)
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+    def __rtruediv__(self, other):
+        return NotImplemented
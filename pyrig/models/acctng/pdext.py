@@ -0,0 +1,366 @@
+from numbers import Integral
+from sqlite3 import register_adapter
+
+from numpy import (
+    asarray, atleast_1d, ndarray, int64, zeros, errstate, nan, where, iinfo,
+    concatenate,
+)
+from pandas import (
+    NA, Series, Index, DataFrame, isna, api, unique, read_sql_query,
+)
+from pandas.api.extensions import (
+    ExtensionDtype, ExtensionArray, ExtensionScalarOpsMixin,
+    register_extension_dtype, take,
+)
+from pandas.api.types import pandas_dtype
+from pandas.arrays import BooleanArray, FloatingArray, IntegerArray
+
+from ...logging import log_func_call
+from .fixed4 import Fixed4, Fixed4Array, check_sum_range, checked_intvals
+from .money import Money, MoneyArray
+
+# sentinel used in place of masked values when factorizing
+_NA_SENTINEL = iinfo(int64).min
+
+# groupby/reduce operations whose result is in scaled units
+_FIXED_RESULT_OPS = ('sum', 'min', 'max', 'first', 'last', 'cumsum',
+                     'cummin', 'cummax', 'mean', 'median')
+# operations that add up the integer buffer, which must not wrap around
+_SUM_OPS = ('sum', 'cumsum', 'mean')
+
+# lets executemany bind scalars to the DECIMAL amount columns directly
+register_adapter(Fixed4, float)
+register_adapter(Money, float)
+
+
+@register_extension_dtype
+class Fixed4Dtype(ExtensionDtype):
+    "pandas dtype for columns of Fixed4 values."
+    name = 'fixed4'
+    type = Fixed4
+    na_value = NA
+    _is_numeric = True
+
+    @classmethod
+    def construct_array_type(cls):
+        return Fixed4ExtensionArray
+
+
+@register_extension_dtype
+class MoneyDtype(Fixed4Dtype):
+    "pandas dtype for columns of Money values."
+    name = 'money'
+    type = Money
+
+    @classmethod
+    def construct_array_type(cls):
+        return MoneyExtensionArray
+
+
+class Fixed4ExtensionArray(ExtensionScalarOpsMixin, ExtensionArray):
+    """
+    pandas ExtensionArray holding the scaled int64 values used by
+    Fixed4.intval, plus a mask for missing values.
+
+    Arithmetic is delegated to Fixed4Array, and grouped reductions run over
+    the integer buffer through pandas' masked integer kernels, so results
+    stay exact and never fall back to object columns.
+    """
+    ARRAY_TYPE = Fixed4Array
+    _dtype = Fixed4Dtype()
+
+    def __init__(self, intvals, mask=None, copy: bool = False):
+        intvals = asarray(intvals, dtype=int64)
+        mask = (zeros(len(intvals), dtype=bool) if mask is None
+                else asarray(mask, dtype=bool))
+        if copy:
+            intvals = intvals.copy()
+            mask = mask.copy()
+        self._data = intvals
+        self._mask = mask
+
+    @classmethod
+    def _from_sequence(cls, scalars, *, dtype=None, copy: bool = False):
+        if isinstance(scalars, Fixed4ExtensionArray):
+            return cls(scalars._data, scalars._mask, copy)
+        if isinstance(scalars, Fixed4Array):
+            return cls(scalars.intvals, copy=copy)
+
+        # a scalar (e.g. from __setitem__) is a one-element sequence
+        values = atleast_1d(asarray(scalars))
+        if values.dtype.kind in 'iub':
+            return cls(cls.ARRAY_TYPE(values).intvals)
+
+        mask = asarray(isna(values), dtype=bool)
+        if mask.any():
+            values = where(mask, 0, values)
+        return cls(cls.ARRAY_TYPE(values).intvals, mask)
+
+    @classmethod
+    def _from_sequence_of_strings(cls, strings, *, dtype=None,
+                                  copy: bool = False):
+        return cls._from_sequence(strings, dtype=dtype, copy=copy)
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls(values, values == _NA_SENTINEL)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        return cls(concatenate([a._data for a in to_concat]),
+                   concatenate([a._mask for a in to_concat]))
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes + self._mask.nbytes
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, item):
+        if isinstance(item, Integral):
+            if self._mask[item]:
+                return NA
+            return self.ARRAY_TYPE.SCALAR(intval=int(self._data[item]))
+
+        item = api.indexers.check_array_indexer(self, item)
+        return type(self)(self._data[item], self._mask[item])
+
+    def __setitem__(self, key, value):
+        key = api.indexers.check_array_indexer(self, key)
+        if isinstance(value, Fixed4):
+            self._data[key] = value.intval
+            self._mask[key] = False
+        elif value is None or value is NA:
+            self._mask[key] = True
+        else:
+            value = self._from_sequence(value)
+            # one value (e.g. an int or bool scalar) broadcasts to the key
+            one = len(value) == 1
+            self._data[key] = value._data[0] if one else value._data
+            self._mask[key] = value._mask[0] if one else value._mask
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is not None and asarray([], dtype=dtype).dtype.kind == 'f':
+            floats = self._data/self.ARRAY_TYPE.INTSCALAR
+            return where(self._mask, nan, floats)
+        scalar = self.ARRAY_TYPE.SCALAR
+        out = asarray([scalar(intval=x) for x in self._data.tolist()],
+                      dtype=object)
+        out[self._mask] = NA
+        return out
+
+    def _formatter(self, boxed: bool = False):
+        return str
+
+    def isna(self):
+        return self._mask.copy()
+
+    def copy(self):
+        return type(self)(self._data, self._mask, copy=True)
+
+    def take(self, indices, allow_fill: bool = False, fill_value=None):
+        if allow_fill and fill_value is not None and fill_value is not NA:
+            fill_value = self.ARRAY_TYPE.SCALAR(fill_value).intval
+            fill_mask = False
+        else:
+            fill_value = 0
+            fill_mask = True
+        data = take(self._data, indices, allow_fill=allow_fill,
+                    fill_value=fill_value)
+        mask = take(self._mask, indices, allow_fill=allow_fill,
+                    fill_value=fill_mask)
+        return type(self)(data, mask)
+
+    def astype(self, dtype, copy: bool = True):
+        dtype = pandas_dtype(dtype)
+        if isinstance(dtype, Fixed4Dtype):
+            cls = dtype.construct_array_type()
+            if cls is type(self) and not copy:
+                return self
+            return cls(self._data, self._mask, copy)
+        if dtype.kind == 'f':
+            floats = self._data/self.ARRAY_TYPE.INTSCALAR
+            if isinstance(dtype, ExtensionDtype):
+                return FloatingArray(floats, self._mask.copy())
+            return where(self._mask, nan, floats).astype(dtype)
+        return super().astype(dtype, copy)
+
+    def _values_for_argsort(self):
+        return self._data
+
+    def _values_for_factorize(self):
+        return where(self._mask, _NA_SENTINEL, self._data), _NA_SENTINEL
+
+    def unique(self):
+        values, _ = self._values_for_factorize()
+        return self._from_factorized(unique(values), self)
+
+    def value_counts(self, dropna: bool = True):
+        counts = self._as_integer_array().value_counts(dropna=dropna)
+        index = self._wrap_integer_result(counts.index.array)
+        return Series(counts.to_numpy(), index=Index(index), name='count')
+
+    def to_fixed4array(self):
+        "Return the values as a Fixed4Array/MoneyArray, with NA as zero."
+        return self.ARRAY_TYPE(intvals=where(self._mask, 0, self._data))
+
+    def _as_integer_array(self):
+        return IntegerArray(self._data, self._mask)
+
+    def _check_sum(self, name: str):
+        "Raise OverflowError if summing for `name` could wrap int64."
+        if name in _SUM_OPS:
+            check_sum_range(self._data[~self._mask])
+
+    def _wrap_integer_result(self, result):
+        "Convert a scaled IntegerArray/FloatingArray result back to fixed."
+        if isinstance(result, FloatingArray):
+            mask = result.isna()
+            vals = result.to_numpy(dtype=float, na_value=0)
+            intvals = self.ARRAY_TYPE(vals/self.ARRAY_TYPE.INTSCALAR).intvals
+            return type(self)(intvals, mask)
+        if isinstance(result, IntegerArray):
+            return type(self)(result.to_numpy(dtype=int64, na_value=0),
+                              result.isna())
+        return result
+
+    def _reduce(self, name: str, *, skipna: bool = True,
+                keepdims: bool = False, **kwargs):
+        if name not in _FIXED_RESULT_OPS:
+            raise TypeError(f"{self.dtype} does not support reduction "
+                            f"'{name}'")
+        self._check_sum(name)
+        result = self._as_integer_array()._reduce(
+            name, skipna=skipna, keepdims=True, **kwargs
+        )
+        result = self._wrap_integer_result(result)
+        return result if keepdims else result[0]
+
+    def _accumulate(self, name: str, *, skipna: bool = True, **kwargs):
+        if name not in _FIXED_RESULT_OPS:
+            raise TypeError(f"{self.dtype} does not support accumulation "
+                            f"'{name}'")
+        self._check_sum(name)
+        result = self._as_integer_array()._accumulate(name, skipna=skipna,
+                                                      **kwargs)
+        return self._wrap_integer_result(result)
+
+    def _groupby_op(self, *, how: str, has_dropped_na: bool,
+                    min_count: int, ngroups: int, ids, **kwargs):
+        if how in ('prod', 'var', 'std', 'sem', 'skew', 'kurt'):
+            raise TypeError(f"{self.dtype} does not support groupby "
+                            f"operation '{how}'")
+        self._check_sum(how)
+        result = self._as_integer_array()._groupby_op(
+            how=how, has_dropped_na=has_dropped_na, min_count=min_count,
+            ngroups=ngroups, ids=ids, **kwargs
+        )
+        if how in _FIXED_RESULT_OPS:
+            return self._wrap_integer_result(result)
+        return result
+
+    def __neg__(self):
+        return type(self)(-self._data, self._mask, copy=True)
+
+    def __pos__(self):
+        return self.copy()
+
+    def __abs__(self):
+        return type(self)(abs(self._data), self._mask, copy=True)
+
+    def _unbox_operand(self, other):
+        "Return (values, mask) for an operand of an arithmetic operation."
+        if isinstance(other, Fixed4ExtensionArray):
+            return other.to_fixed4array(), other._mask
+        if other is NA or other is None:
+            return 0, True
+        if isinstance(other, (list, ndarray, ExtensionArray)):
+            other = asarray(other)
+            if other.dtype.kind == 'O':
+                other = self._from_sequence(other)
+                return other.to_fixed4array(), other._mask
+        return other, False
+
+    @classmethod
+    def _create_method(cls, op, coerce_to_dtype: bool = True,
+                       result_dtype=None):
+        def _binop(self, other):
+            if isinstance(other, (Series, Index, DataFrame)):
+                return NotImplemented
+
+            rvalues, rmask = self._unbox_operand(other)
+            mask = self._mask | rmask
+            with errstate(all='ignore'):
+                result = op(self.to_fixed4array(), rvalues)
+            if result is NotImplemented:
+                return NotImplemented
+            if isinstance(result, tuple):
+                return tuple(self._box_result(r, mask) for r in result)
+            return self._box_result(result, mask)
+
+        return _binop
+
+    def _box_result(self, result, mask):
+        if isinstance(result, Fixed4Array):
+            cls = (MoneyExtensionArray if isinstance(result, MoneyArray)
+                   else Fixed4ExtensionArray)
+            return cls(result.intvals, mask.copy())
+        result = asarray(result)
+        kind = result.dtype.kind
+        if kind == 'b':
+            return BooleanArray(result & ~mask, mask.copy())
+        if kind == 'f':
+            return FloatingArray(where(mask, 0, result), mask.copy())
+        return IntegerArray(where(mask, 0, result).astype(int64),
+                            mask.copy())
+
+
+class MoneyExtensionArray(Fixed4ExtensionArray):
+    "pandas ExtensionArray of Money values."
+    ARRAY_TYPE = MoneyArray
+    _dtype = MoneyDtype()
+
+
+Fixed4ExtensionArray._add_arithmetic_ops()
+Fixed4ExtensionArray._add_comparison_ops()
+
+
+@log_func_call
+def fixed_to_sql(df: DataFrame, name: str, con, **kwargs):
+    """
+    DataFrame.to_sql storing fixed4/money columns as REAL columns of their
+    values, like the DECIMAL amount columns of the accounting tables, where
+    plain to_sql would write them as TEXT.  Each column is converted in one
+    step from its scaled integers, and NA is stored as NULL.  Read the
+    table back with read_sql_fixed.
+    """
+    out = df.copy(deep=False)
+    dtype = dict(kwargs.pop('dtype', None) or {})
+    for col, ser in df.items():
+        if isinstance(ser.dtype, Fixed4Dtype):
+            out[col] = ser.astype('Float64')
+            dtype.setdefault(col, 'REAL')
+    return out.to_sql(name, con, dtype=dtype or None, **kwargs)
+
+
+@log_func_call
+def read_sql_fixed(sql: str, con, fixed: dict[str, str], **kwargs
+                   ) -> DataFrame:
+    """
+    read_sql_query, converting the REAL columns named in `fixed` to their
+    'fixed4' or 'money' dtype.  Values are rounded half away to the fourth
+    decimal, so a fixed_to_sql round trip is exact.
+    """
+    df = read_sql_query(sql, con, **kwargs)
+    for col, dtype in fixed.items():
+        values = df[col].astype('Float64').array
+        cls = pandas_dtype(dtype).construct_array_type()
+        intvals = checked_intvals(values.to_numpy(dtype=float, na_value=0)
+                                  * cls.ARRAY_TYPE.INTSCALAR)
+        df[col] = cls(intvals, values.isna())
+    return df
@@ -0,0 +1,217 @@
+from contextlib import contextmanager
+from pathlib import Path
+from sqlite3 import Connection
+from typing import Iterator
+
+from ...logging import log_func_call, get_logger
+from .balances import (
+    compute_account_balances, get_account_balances, get_fiscal_periods,
+    write_account_balances,
+)
+from .money import MoneyArray
+
+ARCHIVE_TABLE = 'journal_entry_lines_archive'
+ARCHIVE_SCHEMA = 'pyrig_archive'
+# archive database files written by close_fiscal_period, kept in main
+ARCHIVE_DBS_TABLE = 'journal_line_archive_dbs'
+
+
+@log_func_call
+def create_line_archive(cxn: Connection, schema: str = 'main'):
+    """
+    Create the archive table for journal lines of closed fiscal periods in
+    the given database schema (main or an attached archive database).
+    """
+    cxn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema}.{ARCHIVE_TABLE} (
+        id INTEGER PRIMARY KEY,
+        journal_entry_id INTEGER NOT NULL,
+        account_id INTEGER NOT NULL,
+        debit_amount DECIMAL(15,2) DEFAULT 0.00,
+        credit_amount DECIMAL(15,2) DEFAULT 0.00,
+        description TEXT,
+        line_number INTEGER NOT NULL,
+        created_at TIMESTAMP,
+        fiscal_period_id INTEGER NOT NULL
+    )
+    """)
+    cxn.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_{ARCHIVE_TABLE}_period "
+        f"ON {ARCHIVE_TABLE}(fiscal_period_id)"
+    )
+    cxn.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_{ARCHIVE_TABLE}_entry "
+        f"ON {ARCHIVE_TABLE}(journal_entry_id)"
+    )
+
+
+def _register_archive_db(cxn: Connection, archive_db: str | Path):
+    cxn.execute(f"CREATE TABLE IF NOT EXISTS main.{ARCHIVE_DBS_TABLE} "
+                "(path TEXT PRIMARY KEY)")
+    cxn.execute(f"INSERT OR IGNORE INTO main.{ARCHIVE_DBS_TABLE} VALUES (?)",
+                (str(archive_db),))
+
+
+@log_func_call
+def get_archive_dbs(cxn: Connection) -> list[str]:
+    "Archive database files that close_fiscal_period has moved lines into."
+    if not cxn.execute("SELECT 1 FROM main.sqlite_master WHERE name = ?",
+                       (ARCHIVE_DBS_TABLE,)).fetchone():
+        return []
+    return [r[0] for r in cxn.execute(
+        f"SELECT path FROM main.{ARCHIVE_DBS_TABLE} ORDER BY path"
+    )]
+
+
+@contextmanager
+def attached_line_archives(cxn: Connection) -> Iterator[list[str]]:
+    """
+    Attach every archive database recorded by close_fiscal_period (unless
+    already attached) for the duration of the block, yielding the
+    schema-qualified archive tables, the main database's own included.
+    ATTACH is not allowed inside a transaction.
+    """
+    attached = {Path(r[2]).resolve(): r[1] for r in
+                cxn.execute("PRAGMA database_list") if r[2]}
+    tables, ours = [], []
+    try:
+        for i, path in enumerate(get_archive_dbs(cxn)):
+            schema = attached.get(Path(path).resolve())
+            if schema is None:
+                schema = f"{ARCHIVE_SCHEMA}_{i}"
+                cxn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+                ours.append(schema)
+            tables.append(f"{schema}.{ARCHIVE_TABLE}")
+        if cxn.execute("SELECT 1 FROM main.sqlite_master WHERE name = ?",
+                       (ARCHIVE_TABLE,)).fetchone():
+            tables.append(f"main.{ARCHIVE_TABLE}")
+        yield tables
+    finally:
+        for schema in ours:
+            cxn.execute(f"DETACH DATABASE {schema}")
+
+
+def _archive_lines(cxn: Connection, period, schema: str) -> int:
+    "Move the lines of posted entries dated within `period` to the archive."
+    create_line_archive(cxn, schema)
+    dates = (period['start_date'], period['end_date'])
+    in_period = ("SELECT id FROM journal_entries "
+                 "WHERE posted AND entry_date BETWEEN ? AND ?")
+    cur = cxn.execute(f"""
+    INSERT INTO {schema}.{ARCHIVE_TABLE}
+    (id, journal_entry_id, account_id, debit_amount, credit_amount,
+     description, line_number, created_at, fiscal_period_id)
+    SELECT id, journal_entry_id, account_id, debit_amount, credit_amount,
+           description, line_number, created_at, ?
+    FROM journal_entry_lines WHERE journal_entry_id IN ({in_period})
+    """, (int(period['id']),) + dates)
+    cxn.execute("DELETE FROM journal_entry_lines "
+                f"WHERE journal_entry_id IN ({in_period})", dates)
+    return cur.rowcount
+
+
+@log_func_call
+def close_fiscal_period(cxn: Connection, fiscal_period_id: int,
+                        archive: bool = False,
+                        archive_db: str | Path = None) -> int:
+    """
+    Close a fiscal period.
+
+    Balances of all open periods are recomputed from journal lines so the
+    closing snapshot is exact, every nonzero closing balance is carried
+    forward as an opening balance row of the next period, and the period is
+    flagged closed so no further entries can be posted into it.  Periods
+    must be closed in order, and a period holding unposted entries cannot
+    be closed, since they could never be posted afterwards.
+
+    With `archive`, the period's journal_entry_lines are moved into
+    journal_entry_lines_archive, either in the main database or, if
+    `archive_db` is given, in that attached database file, which is then
+    recorded so reports can find the lines (see attached_line_archives).
+    Closed-period balances are then served from the account_balances
+    snapshots alone.
+
+    Returns the number of archived lines.
+    """
+    log = get_logger()
+    periods = get_fiscal_periods(cxn)
+    match = periods.index[periods['id'] == fiscal_period_id]
+    if not len(match):
+        raise ValueError(f"Unknown fiscal period {fiscal_period_id}")
+    pos = match[0]
+    period = periods.loc[pos]
+    if period['is_closed']:
+        raise ValueError(f"Fiscal period {fiscal_period_id} is already "
+                         "closed")
+    if not periods['is_closed'].iloc[:pos].astype(bool).all():
+        raise ValueError("Earlier fiscal periods must be closed before "
+                         f"fiscal period {fiscal_period_id}")
+    unposted = [r[0] for r in cxn.execute(
+        "SELECT entry_number FROM journal_entries "
+        "WHERE NOT posted AND entry_date BETWEEN ? AND ? ORDER BY id",
+        (period['start_date'], period['end_date'])
+    )]
+    if unposted:
+        raise ValueError(f"Fiscal period {fiscal_period_id} has "
+                         f"{len(unposted)} unposted journal entries: "
+                         f"{', '.join(map(str, unposted[:10]))}")
+
+    schema = 'main'
+    if archive and archive_db is not None:
+        archive_db = Path(archive_db).resolve()
+        # ATTACH is not allowed inside a transaction
+        cxn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}",
+                    (str(archive_db),))
+        schema = ARCHIVE_SCHEMA
+
+    try:
+        with cxn:
+            write_account_balances(cxn, compute_account_balances(cxn))
+
+            if pos + 1 < len(periods):
+                next_id = int(periods.loc[pos + 1, 'id'])
+                bal = get_account_balances(cxn, fiscal_period_id)
+                bal = bal[bal['closing_balance'] != 0]
+                closing = (bal['closing_balance']
+                           / MoneyArray.INTSCALAR).tolist()
+                cxn.executemany("""
+                INSERT OR IGNORE INTO account_balances
+                (account_id, fiscal_period_id, opening_balance,
+                 closing_balance)
+                VALUES (?, ?, ?, ?)
+                """, [(a, next_id, c, c) for a, c in
+                      zip(bal['account_id'].tolist(), closing)])
+            else:
+                log.info("No fiscal period after period "
+                         f"{fiscal_period_id} to carry balances into")
+
+            cxn.execute("UPDATE fiscal_periods SET is_closed = 1 "
+                        "WHERE id = ?", (fiscal_period_id,))
+
+            narchived = _archive_lines(cxn, period, schema) if archive else 0
+            if schema != 'main':
+                _register_archive_db(cxn, archive_db)
+    finally:
+        if schema != 'main':
+            cxn.execute(f"DETACH DATABASE {ARCHIVE_SCHEMA}")
+
+    log.info(f"Closed fiscal period {fiscal_period_id}"
+             + (f", archived {narchived} journal lines" if archive else ''))
+    return narchived
+
+
+@log_func_call
+def get_closed_period_entries(cxn: Connection, entry_ids) -> list[int]:
+    "Ids among `entry_ids` whose entry_date falls in a closed fiscal period."
+    entry_ids = [int(i) for i in entry_ids]
+    found = []
+    for i in range(0, len(entry_ids), 500):
+        chunk = entry_ids[i:i + 500]
+        marks = ', '.join('?'*len(chunk))
+        found.extend(r[0] for r in cxn.execute(f"""
+        SELECT je.id FROM journal_entries je
+        JOIN fiscal_periods fp
+            ON je.entry_date BETWEEN fp.start_date AND fp.end_date
+        WHERE fp.is_closed AND je.id IN ({marks})
+        """, chunk))
+    return found
@@ -0,0 +1,439 @@
+from sqlite3 import Connection, IntegrityError
+from typing import Iterable, NamedTuple
+
+from numpy import arange, int64
+from pandas import DataFrame, Series, factorize, to_datetime
+
+from ...logging import log_func_call, get_logger
+from .balances import (
+    apply_balance_deltas, assign_fiscal_periods, compute_balance_deltas,
+    get_fiscal_periods, get_posted_lines,
+)
+from .money import MoneyArray
+from .pdext import Fixed4Dtype
+from .periods import get_closed_period_entries
+
+ENTRY_COLUMNS = (
+    'entry_number',
+    'entry_date',
+    'description',
+    'reference',
+    'source_document',
+    'created_by',
+)
+LINE_COLUMNS = (
+    'account_id',
+    'debit_amount',
+    'credit_amount',
+    'line_description',
+)
+
+
+class PostingFailure(NamedTuple):
+    index: int
+    entry_number: str | None
+    reason: str
+
+
+class PostingResult(NamedTuple):
+    entry_ids: list[int]
+    nlines: int
+    failures: list[PostingFailure]
+
+
+def _amount_intvals(col: Series):
+    "Scaled Money values of an amount column, with missing values as zero."
+    if isinstance(col.dtype, Fixed4Dtype):
+        return col.array.to_fixed4array().intvals
+    return MoneyArray(col.fillna(0).to_numpy()).intvals
+
+
+def _entries_from_dicts(entries: Iterable[dict]):
+    "Flatten entry dicts with nested 'lines' into entry and line frames."
+    headers = []
+    lines = []
+    for i, entry in enumerate(entries):
+        headers.append({k: entry.get(k) for k in ENTRY_COLUMNS})
+        for line in entry.get('lines', ()):
+            lines.append({
+                'entry': i,
+                'account_id': line.get('account_id'),
+                'debit_amount': line.get('debit_amount'),
+                'credit_amount': line.get('credit_amount'),
+                'line_description': line.get('description'),
+            })
+
+    lines = DataFrame(lines, columns=('entry',) + LINE_COLUMNS)
+    return DataFrame(headers, columns=ENTRY_COLUMNS), lines
+
+
+def _entries_from_frame(df: DataFrame):
+    """
+    Split a frame with one row per line into entry and line frames.  Rows
+    sharing an entry_number form one entry, in order of first appearance,
+    so every row needs one.
+    """
+    if 'entry_number' not in df or df['entry_number'].isna().any():
+        raise ValueError("Every journal line row needs an entry_number to "
+                         "group it into an entry")
+    df = df.reset_index(drop=True)
+    for col in ENTRY_COLUMNS + LINE_COLUMNS:
+        if col not in df:
+            df[col] = None
+
+    codes, _ = factorize(df['entry_number'])
+    first = ~Series(codes).duplicated().to_numpy()
+    headers = df.loc[first, list(ENTRY_COLUMNS)].reset_index(drop=True)
+    lines = df[list(LINE_COLUMNS)].copy()
+    lines.insert(0, 'entry', codes)
+    return headers, lines
+
+
+@log_func_call
+def normalize_journal_entries(entries: 'Iterable[dict] | DataFrame'):
+    """
+    Normalize a batch of journal entries into (headers, lines) frames.
+
+    Entries are either dicts holding the ENTRY_COLUMNS fields plus a 'lines'
+    list of dicts (account_id, debit_amount, credit_amount, description), or
+    a DataFrame with one row per line carrying ENTRY_COLUMNS and
+    LINE_COLUMNS (ValueError if a row lacks an entry_number).  The lines
+    frame gets the batch position of its entry in 'entry', a 1-based
+    'line_number', and the amounts as scaled integers.
+    """
+    if isinstance(entries, DataFrame):
+        headers, lines = _entries_from_frame(entries)
+    else:
+        headers, lines = _entries_from_dicts(entries)
+
+    dates = to_datetime(headers['entry_date'], errors='coerce')
+    headers['entry_date'] = dates.dt.strftime('%Y-%m-%d')
+
+    lines['debit_amount'] = _amount_intvals(lines['debit_amount'])
+    lines['credit_amount'] = _amount_intvals(lines['credit_amount'])
+    lines['line_number'] = lines.groupby('entry').cumcount() + 1
+    return headers, lines
+
+
+@log_func_call
+def validate_journal_entries(cxn: Connection, headers: DataFrame,
+                             lines: DataFrame,
+                             replacing: Iterable[str] = ()) -> dict[int, str]:
+    """
+    Validate normalized entries in a vectorized pass.
+
+    Returns a map of batch position to the first reason that entry is
+    rejected: bad header fields, bad line amounts, unknown accounts,
+    unbalanced debits/credits, duplicate entry numbers, or an entry_date in
+    a closed fiscal period.  Entry numbers in `replacing` may already exist,
+    as their entries are about to be replaced.
+    """
+    failures: dict[int, str] = {}
+
+    def reject(mask, reason: str):
+        for i in headers.index[mask]:
+            failures.setdefault(int(i), reason)
+
+    def reject_lines(mask, reason: str):
+        for i in lines.loc[mask, 'entry'].unique():
+            failures.setdefault(int(i), reason)
+
+    reject(headers['entry_date'].isna().to_numpy(), 'invalid entry_date')
+    reject(headers['description'].isna().to_numpy(), 'missing description')
+
+    debit = lines['debit_amount']
+    credit = lines['credit_amount']
+    one_sided = ((debit > 0) & (credit == 0)) | ((credit > 0) & (debit == 0))
+    reject_lines(~one_sided, 'line must have exactly one positive '
+                             'debit or credit amount')
+
+    account_ids = {r[0] for r in cxn.execute("SELECT id FROM accounts")}
+    reject_lines(~lines['account_id'].isin(account_ids), 'unknown account')
+
+    nlines = lines.groupby('entry').size().reindex(headers.index,
+                                                   fill_value=0)
+    reject((nlines == 0).to_numpy(), 'entry has no lines')
+
+    sums = lines.groupby('entry')[['debit_amount', 'credit_amount']].sum()
+    unbalanced = sums.index[sums['debit_amount'] != sums['credit_amount']]
+    reject(headers.index.isin(unbalanced), 'debits do not equal credits')
+
+    numbers = headers['entry_number']
+    reject((numbers.notna() & numbers.duplicated(keep=False)).to_numpy(),
+           'duplicate entry_number in batch')
+    existing = set()
+    batch_numbers = numbers.dropna().unique().tolist()
+    for i in range(0, len(batch_numbers), 500):
+        chunk = batch_numbers[i:i + 500]
+        marks = ', '.join('?'*len(chunk))
+        existing.update(r[0] for r in cxn.execute(
+            "SELECT entry_number FROM journal_entries "
+            f"WHERE entry_number IN ({marks})", chunk
+        ))
+    existing.difference_update(replacing)
+    reject(numbers.isin(existing).to_numpy(), 'entry_number already exists')
+
+    periods = get_fiscal_periods(cxn)
+    closed = periods.loc[periods['is_closed'].astype(bool), 'id']
+    if len(closed):
+        period_ids = assign_fiscal_periods(cxn, headers['entry_date'],
+                                           periods)
+        reject(period_ids.isin(closed).fillna(False).to_numpy(dtype=bool),
+               'fiscal period is closed')
+
+    return failures
+
+
+def _header_rows(headers: DataFrame, ids, posted: bool):
+    cols = [headers[c].astype(object).where(headers[c].notna(), None)
+            for c in ENTRY_COLUMNS]
+    return list(zip(ids.tolist(), *(c.tolist() for c in cols),
+                    [int(posted)]*len(headers)))
+
+
+def _line_rows(lines: DataFrame, entry_ids):
+    scl = MoneyArray.INTSCALAR
+    desc = lines['line_description'].astype(object)
+    return list(zip(
+        entry_ids.tolist(),
+        lines['account_id'].astype(int64).tolist(),
+        (lines['debit_amount']/scl).tolist(),
+        (lines['credit_amount']/scl).tolist(),
+        desc.where(desc.notna(), None).tolist(),
+        lines['line_number'].tolist(),
+    ))
+
+
+def _insert_rows(cxn: Connection, header_rows: list, line_rows: list):
+    cxn.executemany("""
+    INSERT INTO journal_entries
+    (id, entry_number, entry_date, description, reference, source_document,
+     created_by, posted)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, header_rows)
+    cxn.executemany("""
+    INSERT INTO journal_entry_lines
+    (journal_entry_id, account_id, debit_amount, credit_amount, description,
+     line_number)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, line_rows)
+
+
+def _begin_write(cxn: Connection):
+    """
+    Take the database write lock now, so the entry ids read next cannot be
+    claimed by another connection before they are inserted.
+    """
+    if cxn.in_transaction:
+        # a write statement upgrades the caller's transaction to a writer
+        cxn.execute("UPDATE journal_entries SET id = id WHERE 0")
+    else:
+        cxn.execute("BEGIN IMMEDIATE")
+
+
+def _closed_entries_error(closed: list[int]) -> ValueError:
+    return ValueError(f"Journal entries {closed} are in closed fiscal "
+                      "periods")
+
+
+@log_func_call
+def post_journal_entries(cxn: Connection,
+                         entries: 'Iterable[dict] | DataFrame',
+                         posted: bool = True, replace: dict[str, int] = None,
+                         delete: Iterable[int] = ()) -> PostingResult:
+    """
+    Insert a batch of journal entries and their lines in one transaction.
+
+    Entries are validated first (see validate_journal_entries); rejected
+    entries are reported in the result and the rest of the batch is still
+    written.  Headers and lines are written with executemany.  If the
+    database itself rejects the batch, the entries are retried one at a time
+    under savepoints so only the offending entries fail.  Posted entries
+    update account_balances in the same transaction.  Entry ids are assigned
+    under the write lock, so concurrent posters never collide.
+
+    `replace` maps entry numbers of the batch to the ids of existing entries
+    they supersede: each old entry is deleted together with the insert of
+    its replacement, and kept if the replacement is rejected (as it is when
+    the old entry is in a closed fiscal period).  The entries in `delete`
+    are deleted in the same transaction; ValueError if any is in a closed
+    fiscal period.
+    """
+    log = get_logger()
+    replace = dict(replace or {})
+    delete = list(dict.fromkeys(int(i) for i in delete))
+    headers, lines = normalize_journal_entries(entries)
+    failures = validate_journal_entries(cxn, headers, lines, replace)
+
+    closed = set(get_closed_period_entries(cxn, [*replace.values(),
+                                                 *delete]))
+    if closed.intersection(delete):
+        raise _closed_entries_error(sorted(closed.intersection(delete)))
+    numbers = headers['entry_number']
+    old = numbers.map(replace)
+    for i in headers.index[old.isin(list(closed)).to_numpy()]:
+        failures.setdefault(int(i), 'replaced entry is in a closed fiscal '
+                                    'period')
+
+    headers = headers[~headers.index.isin(list(failures))]
+    lines = lines[lines['entry'].isin(headers.index)]
+    old = old[headers.index].dropna().astype(int64)
+
+    with cxn:
+        _begin_write(cxn)
+        start = cxn.execute("SELECT COALESCE(MAX(id), 0) + 1 "
+                            "FROM journal_entries").fetchone()[0]
+        ids = Series(arange(start, start + len(headers)), index=headers.index)
+        line_entry_ids = ids.loc[lines['entry']].to_numpy()
+
+        _delete_entries(cxn, delete)
+        cxn.execute("SAVEPOINT post_journal_entries")
+        try:
+            _delete_entries(cxn, old.tolist())
+            _insert_rows(cxn, _header_rows(headers, ids, posted),
+                         _line_rows(lines, line_entry_ids))
+        except IntegrityError as e:
+            cxn.execute("ROLLBACK TO post_journal_entries")
+            log.warning(f"Batch insert failed ({e}), retrying entries "
+                        "one at a time")
+            entry_lines = lines.groupby('entry').indices
+            for i in ids.index:
+                sel = entry_lines[i]
+                try:
+                    cxn.execute("SAVEPOINT post_journal_entry")
+                    if i in old.index:
+                        _delete_entries(cxn, [old[i]])
+                    _insert_rows(
+                        cxn, _header_rows(headers.loc[[i]], ids.loc[[i]],
+                                          posted),
+                        _line_rows(lines.iloc[sel], line_entry_ids[sel]),
+                    )
+                    cxn.execute("RELEASE post_journal_entry")
+                except IntegrityError as e:
+                    cxn.execute("ROLLBACK TO post_journal_entry")
+                    cxn.execute("RELEASE post_journal_entry")
+                    failures[int(i)] = str(e)
+
+        if posted:
+            ok = lines[~lines['entry'].isin(list(failures))]
+            ok = ok.assign(entry_date=headers.loc[ok['entry'],
+                                                  'entry_date'].to_numpy())
+            apply_balance_deltas(cxn, compute_balance_deltas(cxn, ok))
+        cxn.execute("RELEASE post_journal_entries")
+
+    ok_ids = ids[~ids.index.isin(list(failures))].tolist()
+    result = PostingResult(
+        ok_ids,
+        int((~lines['entry'].isin(list(failures))).sum()),
+        [PostingFailure(i, numbers[i], reason)
+         for i, reason in sorted(failures.items())],
+    )
+    if result.failures:
+        log.warning(f"{len(result.failures)} journal entries rejected")
+    log.info(f"Posted {len(result.entry_ids)} journal entries "
+             f"({result.nlines} lines)")
+    return result
+
+
+@log_func_call
+def set_journal_entries_posted(cxn: Connection, entry_ids: Iterable[int],
+                               posted: bool = True) -> int:
+    """
+    Post or unpost existing journal entries, keeping account_balances in
+    step.  Entries already in the requested state are left alone.  Returns
+    the number of entries changed.  Raises ValueError if any entry is dated
+    in a closed fiscal period.
+    """
+    entry_ids = list(dict.fromkeys(int(i) for i in entry_ids))
+    if not entry_ids:
+        return 0
+
+    closed = get_closed_period_entries(cxn, entry_ids)
+    if closed:
+        raise ValueError(f"Journal entries {closed} are in closed fiscal "
+                         "periods")
+
+    with cxn:
+        cxn.execute("CREATE TEMP TABLE IF NOT EXISTS _posting_ids "
+                    "(id INTEGER PRIMARY KEY)")
+        cxn.execute("DELETE FROM _posting_ids")
+        cxn.executemany("INSERT INTO _posting_ids VALUES (?)",
+                        [(i,) for i in entry_ids])
+        cxn.execute("DELETE FROM _posting_ids WHERE id NOT IN "
+                    "(SELECT id FROM journal_entries WHERE posted != ?)",
+                    (int(posted),))
+        changed = cxn.execute("SELECT COUNT(*) FROM _posting_ids"
+                              ).fetchone()[0]
+        if changed:
+            if not posted:
+                lines = get_posted_lines(
+                    cxn, "je.id IN (SELECT id FROM _posting_ids)"
+                )
+                apply_balance_deltas(cxn, compute_balance_deltas(cxn, lines),
+                                     -1)
+            cxn.execute(
+                "UPDATE journal_entries SET posted = ?, "
+                "updated_at = CURRENT_TIMESTAMP "
+                "WHERE id IN (SELECT id FROM _posting_ids)", (int(posted),)
+            )
+            if posted:
+                lines = get_posted_lines(
+                    cxn, "je.id IN (SELECT id FROM _posting_ids)"
+                )
+                apply_balance_deltas(cxn, compute_balance_deltas(cxn, lines))
+        cxn.execute("DELETE FROM _posting_ids")
+
+    get_logger().info(f"{'Posted' if posted else 'Unposted'} "
+                      f"{changed} journal entries")
+    return changed
+
+
+def unpost_journal_entries(cxn: Connection, entry_ids: Iterable[int]) -> int:
+    "Unpost existing journal entries; see set_journal_entries_posted."
+    return set_journal_entries_posted(cxn, entry_ids, False)
+
+
+def _delete_entries(cxn: Connection, entry_ids: list[int]) -> int:
+    """
+    Delete journal entries and their lines inside the caller's transaction,
+    reversing posted ones out of account_balances first.
+    """
+    if not entry_ids:
+        return 0
+    cxn.execute("CREATE TEMP TABLE IF NOT EXISTS _posting_ids "
+                "(id INTEGER PRIMARY KEY)")
+    cxn.execute("DELETE FROM _posting_ids")
+    cxn.executemany("INSERT INTO _posting_ids VALUES (?)",
+                    [(i,) for i in entry_ids])
+    lines = get_posted_lines(cxn, "je.id IN (SELECT id FROM _posting_ids)")
+    apply_balance_deltas(cxn, compute_balance_deltas(cxn, lines), -1)
+    cxn.execute("DELETE FROM journal_entry_lines WHERE journal_entry_id "
+                "IN (SELECT id FROM _posting_ids)")
+    deleted = cxn.execute("DELETE FROM journal_entries "
+                          "WHERE id IN (SELECT id FROM _posting_ids)"
+                          ).rowcount
+    cxn.execute("DELETE FROM _posting_ids")
+    return deleted
+
+
+@log_func_call
+def delete_journal_entries(cxn: Connection, entry_ids: Iterable[int]) -> int:
+    """
+    Delete journal entries and their lines in one transaction, reversing
+    posted ones out of account_balances first.  Returns the number of
+    entries deleted.  Raises ValueError if any entry is dated in a closed
+    fiscal period.
+    """
+    entry_ids = list(dict.fromkeys(int(i) for i in entry_ids))
+    if not entry_ids:
+        return 0
+
+    closed = get_closed_period_entries(cxn, entry_ids)
+    if closed:
+        raise _closed_entries_error(closed)
+
+    with cxn:
+        deleted = _delete_entries(cxn, entry_ids)
+
+    get_logger().info(f"Deleted {deleted} journal entries")
+    return deleted
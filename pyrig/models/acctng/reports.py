@@ -0,0 +1,383 @@
+from contextlib import nullcontext
+from csv import writer as csv_writer
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import islice
+from pathlib import Path
+from sqlite3 import Connection
+from typing import Iterable, Iterator, NamedTuple, get_args, get_type_hints
+
+from pandas import DataFrame, Series, read_sql_query
+
+from ...logging import log_func_call, get_logger
+from .balances import get_account_balances, amounts_to_intvals
+from .fixed4 import Fixed4
+from .money import Money
+from .periods import attached_line_archives
+
+# sign that makes an account type's normal balance positive
+NORMAL_SIGN = {
+    'ASSET': 1,
+    'EXPENSE': 1,
+    'LIABILITY': -1,
+    'EQUITY': -1,
+    'REVENUE': -1,
+}
+
+
+class ReportRow(NamedTuple):
+    section: str
+    account_id: int | None
+    code: str | None
+    name: str
+    depth: int
+    amount: Money
+
+
+class TrialBalanceRow(NamedTuple):
+    account_id: int | None
+    code: str | None
+    name: str
+    account_type: str | None
+    debit: Money
+    credit: Money
+
+
+def _iso(value) -> str | None:
+    if value is None:
+        return None
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _resolve_range(cxn: Connection, fiscal_period_id: int = None,
+                   start_date=None, end_date=None):
+    "Return (start, end) ISO dates, taken from a fiscal period if given."
+    if fiscal_period_id is not None:
+        row = cxn.execute("SELECT start_date, end_date FROM fiscal_periods "
+                          "WHERE id = ?", (fiscal_period_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Unknown fiscal period {fiscal_period_id}")
+        return row
+    if end_date is None:
+        end_date = date.today()
+    return _iso(start_date), _iso(end_date)
+
+
+@log_func_call
+def get_balances_as_of(cxn: Connection, as_of) -> Series:
+    """
+    Balance of every account at the end of the `as_of` date, as scaled
+    integers indexed by account_id (debit-positive).
+
+    Starts from the account_balances snapshot of the latest fiscal period
+    ending on or before the date and adds the posted lines dated after it,
+    so only the lines of a partial period are ever read.  Lines archived by
+    close_fiscal_period (in the main database or an archive database file)
+    are included when the range reaches into a closed period.  Lines dated
+    outside every fiscal period, which no snapshot holds, are always added.
+    """
+    as_of = _iso(as_of)
+    snap = cxn.execute(
+        "SELECT id, end_date FROM fiscal_periods WHERE end_date <= ? "
+        "ORDER BY end_date DESC LIMIT 1", (as_of,)
+    ).fetchone()
+    if snap is None:
+        base = Series(dtype='int64')
+        since = ''
+    else:
+        bal = get_account_balances(cxn, snap[0])
+        base = Series(bal['closing_balance'].to_numpy(),
+                      index=bal['account_id'])
+        since = snap[1]
+
+    archived = cxn.execute(
+        "SELECT 1 FROM fiscal_periods WHERE is_closed AND end_date > ?",
+        (since,)
+    ).fetchone()
+    # only attach archive files when closed periods' lines are needed
+    with (attached_line_archives(cxn) if archived
+          else nullcontext([])) as archives:
+        lines = 'journal_entry_lines'
+        if archived and archives:
+            cols = 'journal_entry_id, account_id, debit_amount, credit_amount'
+            lines = '(' + ' UNION ALL '.join(
+                f"SELECT {cols} FROM {t}"
+                for t in ['journal_entry_lines', *archives]
+            ) + ')'
+
+        delta = read_sql_query(f"""
+        SELECT jel.account_id,
+               TOTAL(jel.debit_amount) - TOTAL(jel.credit_amount) AS net
+        FROM journal_entries je
+        JOIN {lines} jel ON jel.journal_entry_id = je.id
+        WHERE je.posted AND je.entry_date <= ? AND (
+            je.entry_date > ? OR NOT EXISTS (
+                SELECT 1 FROM fiscal_periods fp
+                WHERE je.entry_date BETWEEN fp.start_date AND fp.end_date
+            )
+        )
+        GROUP BY jel.account_id
+        """, cxn, params=(as_of, since))
+    delta = Series(amounts_to_intvals(delta['net']).to_numpy(),
+                   index=delta['account_id'])
+    return base.add(delta, fill_value=0).astype('int64')
+
+
+def _account_tree(cxn: Connection) -> tuple[DataFrame, DataFrame]:
+    """
+    Accounts in chart-of-accounts order with their depth, plus the closure
+    pairs restricted to ancestors and descendants of the same account type
+    so subtree totals never mix types.
+    """
+    accounts = read_sql_query(
+        "SELECT id AS account_id, code, name, account_type FROM accounts",
+        cxn
+    )
+    closure = read_sql_query("""
+    SELECT c.ancestor_id, c.descendant_id, c.depth
+    FROM account_closure c
+    JOIN accounts a ON a.id = c.ancestor_id
+    JOIN accounts d ON d.id = c.descendant_id
+    WHERE a.account_type = d.account_type
+    """, cxn)
+
+    codes = accounts.set_index('account_id')['code']
+    paths = (closure.assign(code=closure['ancestor_id'].map(codes))
+             .sort_values(['descendant_id', 'depth'],
+                          ascending=[True, False])
+             .groupby('descendant_id')['code'].agg('/'.join))
+    depth = closure.groupby('descendant_id')['depth'].max()
+    accounts['depth'] = accounts['account_id'].map(depth).fillna(0)
+    accounts['depth'] = accounts['depth'].astype(int)
+    accounts['path'] = accounts['account_id'].map(paths).fillna(
+        accounts['code']
+    )
+    accounts = accounts.sort_values('path', ignore_index=True)
+    return accounts, closure
+
+
+def _subtree_totals(closure: DataFrame, balances: Series) -> Series:
+    "Sum of each account's own balance and its same-type descendants'."
+    own = closure['descendant_id'].map(balances).fillna(0).astype('int64')
+    return own.groupby(closure['ancestor_id']).sum()
+
+
+def _section_rows(section: str, accounts: DataFrame, totals: Series,
+                  include_zero: bool) -> Iterator[ReportRow]:
+    sign = NORMAL_SIGN[section]
+    rows = accounts[accounts['account_type'] == section]
+    amounts = rows['account_id'].map(totals).fillna(0).astype('int64')*sign
+    for (account_id, code, name, depth), amount in zip(
+        rows[['account_id', 'code', 'name', 'depth']].itertuples(
+            index=False, name=None
+        ),
+        amounts.tolist(),
+    ):
+        if amount or include_zero:
+            yield ReportRow(section, account_id, code, name, depth,
+                            Money(intval=amount))
+
+
+def _section_total(section: str, accounts: DataFrame,
+                   balances: Series) -> int:
+    ids = accounts.loc[accounts['account_type'] == section, 'account_id']
+    return int(balances.reindex(ids, fill_value=0).sum())*NORMAL_SIGN[section]
+
+
+@log_func_call
+def iter_trial_balance(cxn: Connection, as_of=None,
+                       fiscal_period_id: int = None,
+                       include_zero: bool = False
+                       ) -> Iterator[TrialBalanceRow]:
+    """
+    Yield trial balance rows, one per account, as of a date or the end of a
+    fiscal period, followed by a totals row with account_id None.
+    """
+    _, as_of = _resolve_range(cxn, fiscal_period_id, None, as_of)
+    balances = get_balances_as_of(cxn, as_of)
+    accounts, _ = _account_tree(cxn)
+    amounts = accounts['account_id'].map(balances).fillna(0).astype('int64')
+
+    debits = credits = 0
+    for (account_id, code, name, acc_type), amount in zip(
+        accounts[['account_id', 'code', 'name', 'account_type']].itertuples(
+            index=False, name=None
+        ),
+        amounts.tolist(),
+    ):
+        if amount or include_zero:
+            debit, credit = max(amount, 0), max(-amount, 0)
+            debits += debit
+            credits += credit
+            yield TrialBalanceRow(account_id, code, name, acc_type,
+                                  Money(intval=debit), Money(intval=credit))
+
+    yield TrialBalanceRow(None, None, 'Total', None, Money(intval=debits),
+                          Money(intval=credits))
+
+
+@log_func_call
+def iter_income_statement(cxn: Connection, start_date=None, end_date=None,
+                          fiscal_period_id: int = None,
+                          include_zero: bool = False
+                          ) -> Iterator[ReportRow]:
+    """
+    Yield income statement rows for a date range or fiscal period: revenue
+    then expense accounts in chart order with subtree totals (normal balance
+    positive), a total row per section, and a final net income row.
+    """
+    start, end = _resolve_range(cxn, fiscal_period_id, start_date, end_date)
+    activity = get_balances_as_of(cxn, end)
+    if start is not None:
+        before = date.fromisoformat(start) - timedelta(days=1)
+        activity = activity.sub(get_balances_as_of(cxn, before),
+                                fill_value=0).astype('int64')
+
+    accounts, closure = _account_tree(cxn)
+    totals = _subtree_totals(closure, activity)
+    net = 0
+    for section in ('REVENUE', 'EXPENSE'):
+        yield from _section_rows(section, accounts, totals, include_zero)
+        total = _section_total(section, accounts, activity)
+        net += total if section == 'REVENUE' else -total
+        yield ReportRow(section, None, None, f"Total {section.title()}", 0,
+                        Money(intval=total))
+
+    yield ReportRow('NET INCOME', None, None, 'Net Income', 0,
+                    Money(intval=net))
+
+
+@log_func_call
+def iter_balance_sheet(cxn: Connection, as_of=None,
+                       fiscal_period_id: int = None,
+                       include_zero: bool = False) -> Iterator[ReportRow]:
+    """
+    Yield balance sheet rows as of a date or the end of a fiscal period:
+    asset, liability and equity accounts in chart order with subtree totals
+    (normal balance positive) and section totals.  Revenue and expense not
+    yet closed into equity are reported as a Current Earnings equity row.
+    """
+    _, as_of = _resolve_range(cxn, fiscal_period_id, None, as_of)
+    balances = get_balances_as_of(cxn, as_of)
+    accounts, closure = _account_tree(cxn)
+    totals = _subtree_totals(closure, balances)
+
+    liab_equity = 0
+    for section in ('ASSET', 'LIABILITY', 'EQUITY'):
+        yield from _section_rows(section, accounts, totals, include_zero)
+        total = _section_total(section, accounts, balances)
+        if section == 'EQUITY':
+            earnings = (_section_total('REVENUE', accounts, balances)
+                        - _section_total('EXPENSE', accounts, balances))
+            yield ReportRow(section, None, None, 'Current Earnings', 1,
+                            Money(intval=earnings))
+            total += earnings
+        if section != 'ASSET':
+            liab_equity += total
+        yield ReportRow(section, None, None, f"Total {section.title()}", 0,
+                        Money(intval=total))
+
+    yield ReportRow('TOTAL', None, None, 'Total Liabilities and Equity', 0,
+                    Money(intval=liab_equity))
+
+
+def _chunks(rows: Iterable, chunksize: int) -> Iterator[list]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunksize)):
+        yield chunk
+
+
+def _plain(value):
+    "Export value: Fixed4/Money become exact Decimals."
+    if isinstance(value, Fixed4):
+        return Decimal(value.intval).scaleb(-Fixed4.DIGITS)
+    return value
+
+
+def _export_csv(chunks: Iterator[list], path: Path, fields) -> int:
+    nrows = 0
+    with open(path, 'w', newline='') as f:
+        out = csv_writer(f)
+        out.writerow(fields)
+        for chunk in chunks:
+            out.writerows([[_plain(v) for v in row] for row in chunk])
+            nrows += len(chunk)
+    return nrows
+
+
+def _arrow_type(pa, hint):
+    for t in get_args(hint) or (hint,):
+        if isinstance(t, type) and issubclass(t, Fixed4):
+            return pa.decimal128(19, Fixed4.DIGITS)
+        if t is int:
+            return pa.int64()
+        if t is str:
+            return pa.string()
+    return None
+
+
+def _export_parquet(chunks: Iterator[list], path: Path, fields,
+                    rowtype) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet export requires pyarrow "
+                          "(pip install pyrig[parquet])") from e
+
+    hints = get_type_hints(rowtype) if rowtype is not None else {}
+    types = [_arrow_type(pa, hints.get(f)) for f in fields]
+    nrows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            columns = zip(*chunk)
+            table = pa.Table.from_arrays(
+                [pa.array([_plain(v) for v in col], type=t)
+                 for col, t in zip(columns, types)],
+                names=list(fields),
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            nrows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return nrows
+
+
+@log_func_call
+def export_report(rows: Iterable[NamedTuple], path: str | Path,
+                  chunksize: int = 10000, fmt: str = None) -> int:
+    """
+    Write report rows (e.g. from iter_balance_sheet) to CSV or Parquet,
+    consuming them `chunksize` at a time.  The format defaults to the file
+    suffix; Parquet needs the optional pyarrow dependency and gets one row
+    group per chunk.  Returns the number of rows written.
+    """
+    path = Path(path)
+    fmt = (fmt or path.suffix.lstrip('.')).lower()
+    chunks = _chunks(rows, chunksize)
+    first = next(chunks, [])
+    rowtype = type(first[0]) if first else None
+    fields = getattr(rowtype, '_fields', None)
+    if fields is None:
+        fields = [f'col{i}' for i in range(len(first[0]))] if first else []
+
+    def all_chunks():
+        if first:
+            yield first
+        yield from chunks
+
+    if fmt == 'csv':
+        nrows = _export_csv(all_chunks(), path, fields)
+    elif fmt == 'parquet':
+        nrows = _export_parquet(all_chunks(), path, fields, rowtype)
+    else:
+        raise ValueError(f"Unsupported report format '{fmt}'")
+
+    get_logger().info(f"Exported {nrows} report rows to {path}")
+    return nrows
@@ -0,0 +1,304 @@
+from contextlib import closing
+from json import dumps, loads
+from pathlib import Path
+from sqlite3 import Connection
+from typing import Iterable, NamedTuple
+
+from pyapp.utils.sqlite import get_tables
+from pyapp.utils.tqdm import FileSetTqdm
+
+from ...logging import log_func_call, get_logger
+from ..db import get_pyrig_connection, get_pyrig_db_path, pyrig_db
+from .db import (
+    MODEL_FIELD_NAME, OMIT_TABLES, connect_avcad_db, get_avcad_db_dir,
+    scan_avcad_dbs,
+)
+
+AVCAD_CATALOG_FILE = 'avcad_catalog.db'
+# bump to rebuild existing catalogs after a schema change
+AVCAD_CATALOG_VERSION = 1
+
+
+class CatalogHit(NamedTuple):
+    manufacturer: str
+    category: str
+    model: str
+    # the row's other non-null columns
+    fields: dict
+
+
+@log_func_call
+def get_avcad_catalog_path() -> Path:
+    "Path of the catalog index, next to pyrig_data.db."
+    return Path(get_pyrig_db_path()).with_name(AVCAD_CATALOG_FILE)
+
+
+@log_func_call
+def create_catalog_tables(cxn: Connection):
+    """Create the catalog index tables, rebuilding outdated ones."""
+    if cxn.execute("PRAGMA user_version").fetchone()[0] not in (
+        0, AVCAD_CATALOG_VERSION
+    ):
+        get_logger().info("Rebuilding outdated AVCAD catalog")
+        for name in ('catalog_fts', 'catalog_models', 'catalog_files'):
+            cxn.execute(f"DROP TABLE IF EXISTS {name}")
+
+    # One row per indexed manufacturer file, with the stat it was indexed at
+    cxn.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_files (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        nmodels INTEGER NOT NULL,
+        indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    cxn.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_models (
+        id INTEGER PRIMARY KEY,
+        file_id INTEGER NOT NULL,
+        manufacturer TEXT NOT NULL,
+        category TEXT NOT NULL,
+        model TEXT NOT NULL,
+        fields TEXT NOT NULL,
+        FOREIGN KEY (file_id) REFERENCES catalog_files(id)
+    )
+    """)
+    cxn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_catalog_models_file "
+        "ON catalog_models(file_id)"
+    )
+    cxn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_catalog_models_model "
+        "ON catalog_models(model COLLATE NOCASE)"
+    )
+
+    # Full text index over catalog_models, kept in step by triggers
+    cxn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS catalog_fts USING fts5(
+        manufacturer, category, model, fields,
+        content='catalog_models', content_rowid='id',
+        prefix='2 3'
+    )
+    """)
+    cxn.execute("""
+    CREATE TRIGGER IF NOT EXISTS catalog_models_insert
+    AFTER INSERT ON catalog_models
+    BEGIN
+        INSERT INTO catalog_fts (rowid, manufacturer, category, model, fields)
+        VALUES (NEW.id, NEW.manufacturer, NEW.category, NEW.model,
+                NEW.fields);
+    END
+    """)
+    cxn.execute("""
+    CREATE TRIGGER IF NOT EXISTS catalog_models_delete
+    AFTER DELETE ON catalog_models
+    BEGIN
+        INSERT INTO catalog_fts (catalog_fts, rowid, manufacturer, category,
+                                 model, fields)
+        VALUES ('delete', OLD.id, OLD.manufacturer, OLD.category, OLD.model,
+                OLD.fields);
+    END
+    """)
+    cxn.execute(f"PRAGMA user_version = {AVCAD_CATALOG_VERSION}")
+
+
+@log_func_call
+def read_avcad_models(dbpath: Path) -> list[tuple[str, str, str]]:
+    """
+    Read every model row of a manufacturer database as (category, model,
+    fields JSON) tuples.  Tables without a Model column are skipped.
+    """
+    rows = []
+    with closing(connect_avcad_db(dbpath)) as db:
+        for tbl in sorted(t for t in get_tables(db) if t not in OMIT_TABLES):
+            cur = db.execute(f'SELECT * FROM "{tbl}"')
+            cols = [d[0] for d in cur.description]
+            if MODEL_FIELD_NAME not in cols:
+                continue
+            imodel = cols.index(MODEL_FIELD_NAME)
+            for row in cur:
+                if row[imodel] is None:
+                    continue
+                fields = {c: v for c, v in zip(cols, row)
+                          if v is not None and c != MODEL_FIELD_NAME}
+                rows.append((tbl, str(row[imodel]),
+                             dumps(fields, default=str)))
+    return rows
+
+
+def _try_read_avcad_models(dbpath: Path):
+    "read_avcad_models for the scan pool, returning errors instead."
+    try:
+        return read_avcad_models(dbpath), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _stat_files(db_dir: Path,
+                names: Iterable[str] = None) -> dict[str, tuple[int, int]]:
+    stats = {}
+    files = (db_dir.glob('*.xml') if names is None
+             else (db_dir/n for n in names))
+    for f in files:
+        try:
+            st = f.stat()
+        except FileNotFoundError:
+            continue
+        stats[f.name] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+
+@log_func_call
+def get_stale_files(cxn: Connection, db_dir: Path,
+                    names: Iterable[str] = None):
+    """
+    Compare the manufacturer files on disk (only `names`, if given) with
+    the catalog.  Returns (changed, removed): names of new or modified
+    files (by mtime and size) with their stats, and ids of catalogued files
+    no longer present.
+    """
+    names = None if names is None else set(names)
+    on_disk = _stat_files(db_dir, names)
+    indexed = {name: (fid, (mtime, size)) for fid, name, mtime, size in
+               cxn.execute("SELECT id, name, mtime_ns, size "
+                           "FROM catalog_files")
+               if names is None or name in names}
+    changed = {name: st for name, st in on_disk.items()
+               if indexed.get(name, (None, None))[1] != st}
+    removed = [fid for name, (fid, _) in indexed.items()
+               if name not in on_disk]
+    return changed, removed
+
+
+def _remove_file(cxn: Connection, file_id: int):
+    cxn.execute("DELETE FROM catalog_models WHERE file_id = ?", (file_id,))
+    cxn.execute("DELETE FROM catalog_files WHERE id = ?", (file_id,))
+
+
+def _store_file(cxn: Connection, name: str, stat: tuple[int, int],
+                models: list[tuple[str, str, str]]):
+    "Replace the catalog entries of one file."
+    row = cxn.execute("SELECT id FROM catalog_files WHERE name = ?",
+                      (name,)).fetchone()
+    if row:
+        _remove_file(cxn, row[0])
+    file_id = cxn.execute(
+        "INSERT INTO catalog_files (name, mtime_ns, size, nmodels) "
+        "VALUES (?, ?, ?, ?)", (name, *stat, len(models))
+    ).lastrowid
+    manuf = Path(name).stem
+    cxn.executemany(
+        "INSERT INTO catalog_models (file_id, manufacturer, category, model, "
+        "fields) VALUES (?, ?, ?, ?, ?)",
+        [(file_id, manuf, *m) for m in models]
+    )
+
+
+@log_func_call
+def index_avcad_catalog(db_dir: Path = None, catalog: str | Path = None,
+                        max_workers: int = None,
+                        names: Iterable[str] = None) -> dict[str, int]:
+    """
+    Bring the catalog index up to date with the manufacturer databases in
+    `db_dir` (or just the files `names`, e.g. from a watcher).  Only files
+    whose mtime or size changed since they were last indexed are read, in
+    parallel on up to `max_workers` threads; each is replaced in its own
+    transaction, so an interrupted run keeps what it finished.  Returns
+    counts of the files indexed, removed and unchanged.
+    """
+    log = get_logger()
+    db_dir = Path(db_dir or get_avcad_db_dir())
+
+    with pyrig_db(catalog or get_avcad_catalog_path()) as cxn:
+        create_catalog_tables(cxn)
+        changed, removed = get_stale_files(cxn, db_dir, names)
+        for file_id in removed:
+            _remove_file(cxn, file_id)
+        cxn.commit()
+
+        indexed = 0
+        for name, (models, error) in scan_avcad_dbs(
+            _try_read_avcad_models, set(changed), db_dir, max_workers,
+        ):
+            if error:
+                log.warning(f"Skipping unreadable AVCAD database {name}: "
+                            f"{error}")
+                continue
+            _store_file(cxn, name, changed[name], models)
+            cxn.commit()
+            indexed += 1
+        total = cxn.execute("SELECT COUNT(*) FROM catalog_files"
+                            ).fetchone()[0]
+
+    counts = {'indexed': indexed, 'removed': len(removed),
+              'unchanged': total - indexed}
+    log.info("AVCAD catalog: " + ', '.join(f'{n} {k}'
+                                           for k, n in counts.items()))
+    return counts
+
+
+def _fts_query(text: str) -> str:
+    "Match every whitespace separated term as a prefix, in any column."
+    terms = (t.replace('"', '""') for t in text.split())
+    return ' '.join(f'"{t}"*' for t in terms)
+
+
+@log_func_call
+def search_avcad_models(text: str, limit: int = 50,
+                        manufacturer: str = None, category: str = None,
+                        catalog: str | Path = None) -> list[CatalogHit]:
+    """
+    Full text search of the catalog for models matching all terms of
+    `text` (as prefixes, in any of manufacturer, category, model or the
+    other columns), best matches first, optionally within one manufacturer
+    or category.
+    """
+    query = _fts_query(text)
+    if not query:
+        return []
+    where = ["catalog_fts MATCH ?"]
+    params = [query]
+    for col, value in (('manufacturer', manufacturer),
+                       ('category', category)):
+        if value is not None:
+            where.append(f"m.{col} = ?")
+            params.append(value)
+
+    cxn = get_pyrig_connection(catalog or get_avcad_catalog_path())
+    rows = cxn.execute(f"""
+    SELECT m.manufacturer, m.category, m.model, m.fields
+    FROM catalog_fts
+    JOIN catalog_models m ON m.id = catalog_fts.rowid
+    WHERE {' AND '.join(where)}
+    ORDER BY bm25(catalog_fts, 2.0, 2.0, 10.0, 1.0)
+    LIMIT ?
+    """, (*params, limit)).fetchall()
+    return [CatalogHit(m, c, model, loads(f)) for m, c, model, f in rows]
+
+
+@log_func_call
+def find_avcad_model(model: str,
+                     catalog: str | Path = None) -> list[CatalogHit]:
+    "Exact (case-insensitive) model lookup across all manufacturers."
+    cxn = get_pyrig_connection(catalog or get_avcad_catalog_path())
+    rows = cxn.execute(
+        "SELECT manufacturer, category, model, fields FROM catalog_models "
+        "WHERE model = ? COLLATE NOCASE ORDER BY manufacturer, category",
+        (model,)
+    ).fetchall()
+    return [CatalogHit(m, c, name, loads(f)) for m, c, name, f in rows]
+
+
+@log_func_call
+def print_model_search(text: str):
+    "Refresh the catalog and print the models matching `text`."
+    index_avcad_catalog()
+    hits = search_avcad_models(text)
+    log = get_logger()
+    log.info(f"{len(hits)} AVCAD models matching '{text}'")
+    for hit in hits:
+        FileSetTqdm.write(f"{hit.manufacturer} / {hit.category} / "
+                          f"{hit.model}")
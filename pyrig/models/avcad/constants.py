@@ -1,3 +1,5 @@
 CXNS_REGEX = r'((.[^:]+)(:)(\d+)(_)((^$)|([^(]*))?([(])(.[^\\]*)?([\\])?)'
 CFG_AVCAD_DB_KEY = 'avcad_db_dir'
 CFG_AVCAD_LAYERS_KEY = 'avcad_layers_file'
+# watch the SharedLibrary while the GUI runs (also with --watch-avcad)
+CFG_AVCAD_WATCH_KEY = 'avcad_watch'
@@ -0,0 +1,75 @@
+from functools import lru_cache
+from re import compile as re_compile
+from typing import Iterable, NamedTuple
+
+from numpy import arange
+from pandas import DataFrame, MultiIndex, Series, factorize
+
+from ...logging import log_func_call
+from .constants import CXNS_REGEX
+
+# compiled once for every parse
+CXNS_PATTERN = re_compile(CXNS_REGEX)
+# CXNS_REGEX groups (1-based) of the connector fields
+_NAME, _INDEX, _TYPE, _DESC = 2, 4, 6, 10
+CONNECTOR_COLUMNS = ('name', 'index', 'type', 'description')
+
+
+class Connector(NamedTuple):
+    name: str
+    index: int
+    type: str
+    description: str
+
+
+def _description(text: str | None) -> str:
+    return (text or '').removesuffix(')')
+
+
+@lru_cache(maxsize=64*1024)
+def parse_cxns(text: str) -> tuple[Connector, ...]:
+    """
+    Parse an AVCAD connection list such as
+    'Input:1_XLR(Left)\\Input:2_XLR(Right)\\' into its connectors.
+    Results are memoized, since libraries repeat the same lists a lot.
+    """
+    return tuple(
+        Connector(m[_NAME], int(m[_INDEX]), m[_TYPE] or '',
+                  _description(m[_DESC]))
+        for m in CXNS_PATTERN.finditer(text)
+    )
+
+
+@log_func_call
+def parse_cxns_column(values: 'Series | Iterable[str]') -> DataFrame:
+    """
+    Parse a column of connection lists into one row per connector, indexed
+    by (original index label, match) like Series.str.extractall, with
+    CONNECTOR_COLUMNS as typed columns.
+
+    Each distinct string is parsed once, by pandas' vectorized
+    str.extractall over the unique values, and the results are expanded
+    back to every row holding it.  Missing values yield no connectors.
+    """
+    if not isinstance(values, Series):
+        values = Series(list(values), dtype=object)
+    codes, uniques = factorize(values)
+    groups = Series(uniques, dtype='string').str.extractall(CXNS_PATTERN)
+
+    parsed = DataFrame({
+        'name': groups[_NAME - 1],
+        'index': groups[_INDEX - 1].astype('int64'),
+        'type': groups[_TYPE - 1].fillna(''),
+        'description': groups[_DESC - 1].fillna('').str.removesuffix(')'),
+    }).reset_index(names=['unique', 'match'])
+
+    rows = DataFrame({'row': arange(len(values)), 'unique': codes})
+    out = rows.merge(parsed, on='unique').sort_values(['row', 'match'],
+                                                      kind='stable')
+    out.index = MultiIndex.from_arrays(
+        [values.index[out['row'].to_numpy()], out['match'].to_numpy()],
+        names=[values.index.name, 'match'],
+    )
+    return out[list(CONNECTOR_COLUMNS)].astype({
+        'name': 'string', 'type': 'string', 'description': 'string',
+    })
@@ -1,5 +1,9 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
-from sqlite3 import connect
+from sqlite3 import Connection, connect
+from typing import Callable, Iterator
+from urllib.parse import quote
 
 from pyapp.utils.sqlite import get_tables, execute_select
 from pyapp.utils.tqdm import FileSetTqdm
@@ -8,7 +12,7 @@ from pyapp.utils.filemeta import FileSet
 from ...logging import log_func_call, DEBUG, get_logger, INFO
 from ...app import PyRigApp
 
-from .constants import CFG_AVCAD_DB_KEY  # , CXNS_REGEX
+from .constants import CFG_AVCAD_DB_KEY
 
 OMIT_TABLES = (
     'sqlite_sequence',
@@ -19,10 +23,80 @@ OMIT_TABLES = (
 MODEL_FIELD_NAME = "Model"
 
 
+def avcad_db_uri(dbpath: Path, immutable: bool = True) -> str:
+    """
+    Read-only URI for a manufacturer database; `immutable` also skips all
+    locking and change detection, so it only suits short-lived handles.  The
+    path is percent-encoded under an empty authority, which SQLite requires:
+    a UNC share becomes file:////server/share/... (Path.as_uri would give
+    file://server/share/..., which SQLite rejects).
+    """
+    path = Path(dbpath).absolute().as_posix()
+    if not path.startswith('/'):
+        # a drive letter: file:///C:/...
+        path = '/' + path
+    uri = f"file://{quote(path)}?mode=ro"
+    return uri + '&immutable=1' if immutable else uri
+
+
+@log_func_call
+def connect_avcad_db(dbpath: Path, immutable: bool = True,
+                     check_same_thread: bool = True) -> Connection:
+    """
+    Open a manufacturer database read-only.  If `immutable`, no lock or
+    journal files are touched (cheap on network shares), but the library
+    must not be written while the connection is open; long-lived handles
+    should pass immutable=False so they see changes made on disk.
+    """
+    return connect(avcad_db_uri(dbpath, immutable), uri=True,
+                   check_same_thread=check_same_thread)
+
+
 @log_func_call
 def get_avcad_tables(dbpath: Path) -> set[str]:
-    with connect(dbpath) as db:
-        return sorted(set(t for t in get_tables(db) if t not in OMIT_TABLES))
+    "Model tables of a manufacturer database, via the shared AvcadReader."
+    from .reader import get_avcad_reader
+    return get_avcad_reader().tables(dbpath)
+
+
+def read_avcad_db_models(dbpath: Path) -> dict[str, list]:
+    "Sorted models of each table of a manufacturer database."
+    with closing(connect_avcad_db(dbpath)) as db:
+        return {
+            tbl: sorted((row[0] for row in execute_select(db, tbl,
+                                                          MODEL_FIELD_NAME)),
+                        key=str)
+            for tbl in sorted(t for t in get_tables(db)
+                              if t not in OMIT_TABLES)
+        }
+
+
+@log_func_call
+def scan_avcad_dbs(func: Callable[[Path], object], fileset: FileSet = None,
+                   db_dir: Path = None, max_workers: int = None,
+                   processes: bool = False) -> Iterator[tuple[Path, object]]:
+    """
+    Apply `func` to the path of every manufacturer database in `fileset`
+    (all of them by default) on a pool of `max_workers`, yielding
+    (relative path, result) in the progress bar's file order no matter
+    which worker finishes first.
+
+    Threads suit I/O-bound scans (sqlite releases the GIL while reading);
+    with `processes`, `func` must be picklable and work is spread over
+    cores.  One FileSetTqdm bar tracks the whole pool.  Errors raised by
+    `func` propagate when their file is reached.
+    """
+    db_dir = Path(db_dir or get_avcad_db_dir())
+    fileset = get_db_fileset() if fileset is None else fileset
+    pool_cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    pool = pool_cls(max_workers)
+    try:
+        futures = {f: pool.submit(func, db_dir/f) for f in fileset}
+        with FileSetTqdm(fileset, leave=False) as tq:
+            for f in tq:
+                yield f, futures[f].result()
+    finally:
+        pool.shutdown(cancel_futures=True)
 
 
 @log_func_call
@@ -64,17 +138,13 @@ def get_db_file(manuf: str) -> Path:
 
 
 @log_func_call
-def print_all_models():
-    db_dir = get_avcad_db_dir()
-    with FileSetTqdm(get_db_fileset(), leave=False) as tq:
-        for f in tq:
-            dbp = db_dir/f
-            manuf = f.stem
-            tq.write(f"* {manuf}")
-            for tbl in get_avcad_tables(dbp):
-                tq.write(f"  * {tbl}")
-                with connect(dbp) as db:
-                    for row in sorted(execute_select(db, tbl,
-                                                     MODEL_FIELD_NAME),
-                                      key=lambda x: str(x)):
-                        tq.write(f"    * {row[0]}")
+def print_all_models(max_workers: int = None, processes: bool = False):
+    "Print every model of every manufacturer, reading files in parallel."
+    for f, tables in scan_avcad_dbs(read_avcad_db_models,
+                                    max_workers=max_workers,
+                                    processes=processes):
+        FileSetTqdm.write(f"* {Path(f).stem}")
+        for tbl, models in tables.items():
+            FileSetTqdm.write(f"  * {tbl}")
+            for model in models:
+                FileSetTqdm.write(f"    * {model}")
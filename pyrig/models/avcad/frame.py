@@ -0,0 +1,162 @@
+from contextlib import closing
+from hashlib import sha256
+from importlib.util import find_spec
+from json import dumps, loads
+from pathlib import Path
+
+from pandas import DataFrame, concat, read_parquet, read_pickle, read_sql_query
+
+from ...logging import log_func_call, get_logger
+from ..db import get_pyrig_db_path
+from .db import OMIT_TABLES, connect_avcad_db, get_avcad_db_dir, scan_avcad_dbs
+
+AVCAD_FRAME_CACHE_DIR = 'avcad_frames'
+FRAME_KEY_COLUMNS = ('manufacturer', 'category')
+_MANIFEST = 'manifest.json'
+
+
+@log_func_call
+def get_avcad_frame_cache_dir() -> Path:
+    "Directory of the per-file DataFrame cache, next to pyrig_data.db."
+    return Path(get_pyrig_db_path()).with_name(AVCAD_FRAME_CACHE_DIR)
+
+
+def _file_hash(path: Path) -> str:
+    h = sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024*1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _normalize(df: DataFrame) -> DataFrame:
+    """
+    Give every column a nullable typed dtype; columns mixing types across
+    tables become strings.
+    """
+    df = df.convert_dtypes()
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].astype('string')
+    return df
+
+
+@log_func_call
+def read_avcad_frame(dbpath: Path) -> DataFrame:
+    """
+    All rows of the model tables of one manufacturer database as a frame
+    with manufacturer and category (table) columns first.
+    """
+    dbpath = Path(dbpath)
+    frames = []
+    with closing(connect_avcad_db(dbpath)) as db:
+        tables = sorted(r[0] for r in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ) if r[0] not in OMIT_TABLES)
+        for tbl in tables:
+            df = read_sql_query(f'SELECT * FROM "{tbl}"', db)
+            df.insert(0, 'category', tbl)
+            frames.append(df)
+    df = (concat(frames, ignore_index=True) if frames
+          else DataFrame(columns=['category']))
+    df.insert(0, 'manufacturer', dbpath.stem)
+    return _normalize(df)
+
+
+class _FrameCache:
+    "Per-file frames on disk, with the stat and hash they were read at."
+    def __init__(self, cache_dir: Path):
+        self.dir = Path(cache_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.fmt = 'parquet' if find_spec('pyarrow') else 'pickle'
+        try:
+            self.manifest = loads((self.dir/_MANIFEST).read_text())
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def _path(self, name: str) -> Path:
+        return self.dir/f"{Path(name).stem}.{self.fmt}"
+
+    def lookup(self, name: str, path: Path) -> DataFrame | None:
+        """
+        The cached frame of a file, if still valid: unchanged mtime and
+        size, or else unchanged content hash.
+        """
+        entry = self.manifest.get(name)
+        if not entry or entry.get('fmt') != self.fmt:
+            return None
+        st = path.stat()
+        if (entry['mtime_ns'], entry['size']) != (st.st_mtime_ns,
+                                                  st.st_size):
+            if entry['sha256'] != _file_hash(path):
+                return None
+            entry.update(mtime_ns=st.st_mtime_ns, size=st.st_size)
+        try:
+            if self.fmt == 'parquet':
+                return read_parquet(self._path(name))
+            return read_pickle(self._path(name))
+        except (OSError, ValueError) as e:
+            get_logger().warning(f"Discarding AVCAD frame cache of {name}: "
+                                 f"{e}")
+            return None
+
+    def store(self, name: str, path: Path, df: DataFrame):
+        st = path.stat()
+        if self.fmt == 'parquet':
+            df.to_parquet(self._path(name), index=False)
+        else:
+            df.to_pickle(self._path(name))
+        self.manifest[name] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size,
+                               'sha256': _file_hash(path), 'fmt': self.fmt}
+
+    def prune(self, names: set[str]):
+        "Forget files no longer in the library."
+        for name in set(self.manifest) - names:
+            self._path(name).unlink(missing_ok=True)
+            del self.manifest[name]
+
+    def save(self):
+        tmp = self.dir/f"{_MANIFEST}.tmp"
+        tmp.write_text(dumps(self.manifest, indent=1, sort_keys=True))
+        tmp.replace(self.dir/_MANIFEST)
+
+
+@log_func_call
+def load_avcad_models(db_dir: Path = None, cache_dir: Path = None,
+                      max_workers: int = None) -> DataFrame:
+    """
+    The whole AVCAD library as one frame: every non-omitted table of every
+    manufacturer database, with manufacturer and category as categorical
+    columns and the other columns as nullable typed columns.
+
+    Each file's frame is cached (as Parquet when pyarrow is installed,
+    otherwise as a pickle) and reused while the file's mtime and size, or
+    failing those its SHA-256, are unchanged.  Stale files are re-read in
+    parallel.
+    """
+    log = get_logger()
+    db_dir = Path(db_dir or get_avcad_db_dir())
+    cache = _FrameCache(cache_dir or get_avcad_frame_cache_dir())
+    names = {f.name for f in db_dir.glob('*.xml')}
+    cache.prune(names)
+
+    frames = {}
+    for name in names:
+        df = cache.lookup(name, db_dir/name)
+        if df is not None:
+            frames[name] = df
+    stale = names - set(frames)
+    for name, df in scan_avcad_dbs(read_avcad_frame, stale, db_dir,
+                                   max_workers):
+        cache.store(name, db_dir/name, df)
+        frames[name] = df
+    cache.save()
+    log.info(f"Loaded {len(names)} AVCAD databases "
+             f"({len(stale)} read, {len(names) - len(stale)} cached)")
+
+    if not frames:
+        return DataFrame(columns=list(FRAME_KEY_COLUMNS))
+    df = _normalize(concat([frames[n] for n in sorted(frames)],
+                           ignore_index=True))
+    for col in FRAME_KEY_COLUMNS:
+        df[col] = df[col].astype('category')
+    return df
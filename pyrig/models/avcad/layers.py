@@ -0,0 +1,236 @@
+from mmap import ACCESS_READ, mmap
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+from ...app import PyRigApp
+from ...logging import log_func_call, get_logger
+from .constants import CFG_AVCAD_LAYERS_KEY
+
+# files at least this large are memory-mapped rather than read whole
+LAYERS_MMAP_THRESHOLD = 1024*1024
+# field separators, in order of preference; the first one in a line is used
+_DELIMITERS = ('\t', '|', ';', ',')
+# ';' is a delimiter, so it does not start comments
+_COMMENTS = ('#', '//')
+_FALSE = frozenset(('0', 'false', 'no', 'off', 'hidden', 'hide'))
+
+
+class Layer(NamedTuple):
+    name: str
+    # 0xRRGGBB, or None if the file gives no (valid) color
+    color: int | None
+    visible: bool
+    # position in the file, i.e. drawing order
+    order: int
+
+
+def _decode(line: bytes) -> str:
+    try:
+        return line.decode('utf-8')
+    except UnicodeDecodeError:
+        # AVCAD writes its settings on Windows
+        return line.decode('cp1252', errors='replace')
+
+
+def _split(line: str) -> list[str]:
+    for delim in _DELIMITERS:
+        if delim in line:
+            return [f.strip() for f in line.split(delim)]
+    return [line]
+
+
+def _color(text: str) -> int | None:
+    "'#RRGGBB', '0xRRGGBB', 'R G B' (or 'R,G,B') or a decimal RGB value."
+    text = text.strip()
+    try:
+        if text.startswith('#'):
+            return int(text[1:], 16)
+        if text.lower().startswith('0x'):
+            return int(text, 16)
+        rgb = text.replace(',', ' ').split()
+        if len(rgb) == 3:
+            r, g, b = (int(c) for c in rgb)
+            if all(0 <= c <= 255 for c in (r, g, b)):
+                return r << 16 | g << 8 | b
+            return None
+        return int(text)
+    except ValueError:
+        return None
+
+
+def _visible(text: str) -> bool:
+    "Visibility flag; layers are visible unless the file says otherwise."
+    return text.strip().lower() not in _FALSE
+
+
+@log_func_call
+def parse_layers(lines: Iterable[bytes]) -> list[Layer]:
+    """
+    Parse the lines of an AVCAD layers file, one layer per line as
+    `name <sep> color <sep> visible` separated by tabs (or '|', ';' or
+    ','), where color and visibility may be omitted.  Blank lines and
+    comments starting with '#' or '//' are skipped; a layer listed twice
+    keeps its first position.
+    """
+    layers = {}
+    for n, raw in enumerate(lines):
+        line = _decode(raw.rstrip(b'\r\n'))
+        if n == 0:
+            line = line.removeprefix('\ufeff')
+        if not line.strip() or line.lstrip().startswith(_COMMENTS):
+            continue
+        fields = _split(line)
+        name = fields[0]
+        if not name:
+            continue
+        color = _color(fields[1]) if len(fields) > 1 else None
+        visible = _visible(fields[2]) if len(fields) > 2 else True
+        order = layers[name].order if name in layers else len(layers)
+        layers[name] = Layer(name, color, visible, order)
+    return sorted(layers.values(), key=lambda layer: layer.order)
+
+
+def _iter_lines(path: Path, size: int) -> Iterator[bytes]:
+    "Lines of a file, memory-mapped if it is large."
+    with open(path, 'rb') as f:
+        if size < LAYERS_MMAP_THRESHOLD:
+            yield from f.read().splitlines()
+            return
+        with mmap(f.fileno(), 0, access=ACCESS_READ) as mm:
+            yield from iter(mm.readline, b'')
+
+
+class AvcadLayers:
+    """
+    The layers of an AVCAD layers file, keyed by name for constant time
+    lookups while rendering.  Visibility can be changed in memory (e.g. from
+    the GUI) without touching or re-reading the file; `reset` restores the
+    file's visibility.
+    """
+    def __init__(self, layers: Iterable[Layer] = (), path: Path = None):
+        self.path = path
+        self.layers: dict[str, Layer] = {layer.name: layer
+                                         for layer in layers}
+        self._visible = {name: layer.visible
+                         for name, layer in self.layers.items()}
+
+    def __len__(self) -> int:
+        return len(self.layers)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.layers
+
+    def __getitem__(self, name: str) -> Layer:
+        return self.layers[name]
+
+    def __iter__(self) -> Iterator[Layer]:
+        "Layers in file (drawing) order."
+        return iter(self.layers.values())
+
+    def get(self, name: str, default: Layer = None) -> Layer | None:
+        return self.layers.get(name, default)
+
+    def color(self, name: str) -> int | None:
+        layer = self.layers.get(name)
+        return None if layer is None else layer.color
+
+    def order(self, name: str) -> int:
+        "Drawing order of a layer; unknown layers go on top."
+        layer = self.layers.get(name)
+        return len(self.layers) if layer is None else layer.order
+
+    def is_visible(self, name: str) -> bool:
+        "Current visibility of a layer; unknown layers are visible."
+        return self._visible.get(name, True)
+
+    def set_visible(self, name: str, visible: bool = True):
+        if name not in self.layers:
+            raise KeyError(f"Unknown AVCAD layer: {name}")
+        self._visible[name] = bool(visible)
+
+    def toggle(self, name: str) -> bool:
+        "Flip a layer's visibility, returning the new state."
+        self.set_visible(name, not self.is_visible(name))
+        return self._visible[name]
+
+    def reset(self):
+        "Restore the visibility given by the file."
+        self._visible = {name: layer.visible
+                         for name, layer in self.layers.items()}
+
+
+# parsed layers files with the (mtime, size) they were read at
+_cache: dict[Path, tuple[tuple[int, int], AvcadLayers]] = {}
+_cache_lock = Lock()
+# called with the path of a layers file that changed on disk
+_listeners: list[Callable[[Path], None]] = []
+
+
+@log_func_call
+def get_avcad_layers_path() -> Path | None:
+    path = PyRigApp.get(CFG_AVCAD_LAYERS_KEY)
+    return Path(path) if path else None
+
+
+@log_func_call
+def load_avcad_layers(path: Path = None) -> AvcadLayers:
+    """
+    The parsed layers file (the configured one by default).  The file is
+    only re-read when its mtime or size has changed, so callers get the
+    same AvcadLayers, with any visibility changes made to it, until then.
+    A missing file gives no layers.
+    """
+    path = Path(path) if path else get_avcad_layers_path()
+    if path is None:
+        return AvcadLayers()
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        get_logger().warning(f"AVCAD layers file not found: {path}")
+        return AvcadLayers(path=path)
+    stat = (st.st_mtime_ns, st.st_size)
+
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+        layers = AvcadLayers(parse_layers(_iter_lines(path, st.st_size)),
+                             path)
+        _cache[path] = (stat, layers)
+    get_logger().info(f"Loaded {len(layers)} AVCAD layers from {path}")
+    return layers
+
+
+def forget_avcad_layers(path: Path = None):
+    "Drop one cached layers file (or all)."
+    with _cache_lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(Path(path), None)
+
+
+def add_layers_listener(func: Callable[[Path], None]):
+    "Call `func(path)` whenever a layers file changes, e.g. to redraw."
+    _listeners.append(func)
+
+
+def remove_layers_listener(func: Callable[[Path], None]):
+    if func in _listeners:
+        _listeners.remove(func)
+
+
+@log_func_call
+def avcad_layers_changed(path: Path):
+    """
+    Forget a layers file that changed on disk and tell the listeners.  They
+    run on the caller's thread (the watcher's), so GUI code must hand the
+    reload over to its own thread.
+    """
+    forget_avcad_layers(path)
+    for func in list(_listeners):
+        try:
+            func(Path(path))
+        except Exception as e:
+            get_logger().exception(f"AVCAD layers listener failed: {e}")
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from pathlib import Path
+from sqlite3 import Connection, Error
+from threading import RLock
+
+from pyapp.utils.sqlite import get_tables
+
+from ...logging import log_func_call, get_logger
+from .db import (
+    MODEL_FIELD_NAME, OMIT_TABLES, connect_avcad_db, get_avcad_db_dir,
+)
+
+# open manufacturer databases kept by a reader, bounding its descriptors
+AVCAD_MAX_OPEN = 64
+
+
+class AvcadReader:
+    """
+    Reads manufacturer databases through an LRU of at most `max_open`
+    read-only connections, so each file is opened once however many tables
+    and queries are served from it.  The connections are long-lived, so they
+    are not opened immutable and always read the file's current contents.
+    Table lists and column names are cached per file until `invalidate` is
+    called for it (e.g. when the library changes on disk).
+
+    Files are named by manufacturer (resolved in `db_dir`) or by path.  A
+    reader may be shared by threads (e.g. invalidated from a file watcher);
+    its queries are serialized.
+    """
+    def __init__(self, db_dir: Path = None, max_open: int = AVCAD_MAX_OPEN):
+        self.db_dir = Path(db_dir or get_avcad_db_dir())
+        self.max_open = max_open
+        self.opens = 0
+        self._cxns: OrderedDict[Path, Connection] = OrderedDict()
+        self._tables: dict[Path, list[str]] = {}
+        self._columns: dict[tuple[Path, str], tuple[str, ...]] = {}
+        self._lock = RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def path(self, manuf: str | Path) -> Path:
+        "Database path of a manufacturer name or path."
+        if isinstance(manuf, Path) or str(manuf).endswith('.xml'):
+            return self.db_dir/manuf
+        return self.db_dir/f"{manuf}.xml"
+
+    def connection(self, manuf: str | Path) -> Connection:
+        "The open connection to a file, opening it (and evicting) if needed."
+        path = self.path(manuf)
+        with self._lock:
+            cxn = self._cxns.get(path)
+            if cxn is not None:
+                self._cxns.move_to_end(path)
+                return cxn
+            while len(self._cxns) >= self.max_open:
+                _, old = self._cxns.popitem(last=False)
+                old.close()
+            cxn = connect_avcad_db(path, immutable=False,
+                                   check_same_thread=False)
+            self.opens += 1
+            self._cxns[path] = cxn
+            return cxn
+
+    def tables(self, manuf: str | Path) -> list[str]:
+        "Sorted model tables of a file, without OMIT_TABLES."
+        path = self.path(manuf)
+        with self._lock:
+            tables = self._tables.get(path)
+            if tables is None:
+                tables = sorted(set(t for t in get_tables(
+                    self.connection(path)
+                ) if t not in OMIT_TABLES))
+                self._tables[path] = tables
+            return tables
+
+    def columns(self, manuf: str | Path, table: str) -> tuple[str, ...]:
+        "Column names of a table."
+        key = (self.path(manuf), table)
+        with self._lock:
+            cols = self._columns.get(key)
+            if cols is None:
+                cols = tuple(r[1] for r in self.connection(key[0]).execute(
+                    f'PRAGMA table_info("{table}")'
+                ))
+                self._columns[key] = cols
+            return cols
+
+    def select(self, manuf: str | Path, table: str, fields='*',
+               where: str = None, params=()) -> list[tuple]:
+        "Rows of a table, like pyapp.utils.sqlite.execute_select."
+        if not isinstance(fields, str):
+            fields = ', '.join(f'"{f}"' for f in fields)
+        sql = f'SELECT {fields} FROM "{table}"'
+        if where:
+            sql += f' WHERE {where}'
+        with self._lock:
+            return self.connection(manuf).execute(sql, params).fetchall()
+
+    def models(self, manuf: str | Path, table: str) -> list:
+        "Sorted models of a table; empty if it has no Model column."
+        if MODEL_FIELD_NAME not in self.columns(manuf, table):
+            return []
+        return sorted((r[0] for r in self.select(manuf, table,
+                                                 (MODEL_FIELD_NAME,))),
+                      key=str)
+
+    def invalidate(self, manuf: str | Path = None):
+        """
+        Close and forget one file (or all), e.g. after it changed.  The
+        caches are dropped even if closing a connection fails.
+        """
+        with self._lock:
+            if manuf is None:
+                cxns = list(self._cxns.values())
+                self._cxns.clear()
+                self._tables = {}
+                self._columns = {}
+            else:
+                path = self.path(manuf)
+                cxns = [c for c in (self._cxns.pop(path, None),) if c]
+                self._tables.pop(path, None)
+                self._columns = {k: v for k, v in self._columns.items()
+                                 if k[0] != path}
+            for cxn in cxns:
+                try:
+                    cxn.close()
+                except Error as e:
+                    get_logger().warning(f"Error closing AVCAD database: "
+                                         f"{e}")
+
+    @log_func_call
+    def close(self):
+        self.invalidate()
+        get_logger().debug(f"AVCAD reader closed after {self.opens} opens")
+
+
+_reader: AvcadReader = None
+
+
+def get_avcad_reader() -> AvcadReader:
+    "Shared reader for the configured library, recreated if it moves."
+    global _reader
+    db_dir = Path(get_avcad_db_dir())
+    if _reader is None or _reader.db_dir != db_dir:
+        if _reader is not None:
+            _reader.close()
+        _reader = AvcadReader(db_dir)
+    return _reader
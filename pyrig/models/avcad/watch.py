@@ -0,0 +1,273 @@
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from os import close as os_close, fsencode, read as os_read, strerror
+from pathlib import Path
+from select import select
+from struct import calcsize, unpack_from
+from sys import platform
+from threading import Event, Thread
+from typing import Callable, Iterable, NamedTuple
+
+from ...app import PyRigApp
+from ...logging import log_func_call, get_logger
+from .constants import CFG_AVCAD_LAYERS_KEY
+from .db import get_avcad_db_dir
+
+# inotify(7) event masks
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_IN_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE)
+_IN_EVENT = 'iIII'
+_IN_EVENT_SIZE = calcsize(_IN_EVENT)
+
+WATCH_ADDED = 'added'
+WATCH_CHANGED = 'changed'
+WATCH_REMOVED = 'removed'
+
+
+class WatchEvent(NamedTuple):
+    kind: str
+    path: Path
+
+
+class Inotify:
+    """
+    Minimal ctypes binding of Linux inotify watching directories for
+    created, written, moved and deleted entries.  `read` returns the paths
+    touched, or None if the kernel queue overflowed and everything must be
+    rescanned.
+    """
+    def __init__(self, dirs: Iterable[Path]):
+        self._libc = CDLL(find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(get_errno(), strerror(get_errno()))
+        self._dirs = {}
+        for d in dirs:
+            wd = self._libc.inotify_add_watch(self.fd, fsencode(d), _IN_MASK)
+            if wd < 0:
+                self.close()
+                raise OSError(get_errno(), strerror(get_errno()), str(d))
+            self._dirs[wd] = Path(d)
+
+    @staticmethod
+    def available() -> bool:
+        if not platform.startswith('linux'):
+            return False
+        libc = find_library('c')
+        return bool(libc) and hasattr(CDLL(libc), 'inotify_init1')
+
+    def read(self, timeout: float) -> set[Path] | None:
+        "Paths touched within `timeout` seconds (empty if none)."
+        paths = set()
+        if not select([self.fd], [], [], timeout)[0]:
+            return paths
+        while True:
+            try:
+                buf = os_read(self.fd, 64*1024)
+            except BlockingIOError:
+                return paths
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, n = unpack_from(_IN_EVENT, buf, pos)
+                pos += _IN_EVENT_SIZE
+                name = buf[pos:pos + n].rstrip(b'\0').decode(errors='replace')
+                pos += n
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if wd in self._dirs and name:
+                    paths.add(self._dirs[wd]/name)
+
+    def close(self):
+        if self.fd >= 0:
+            os_close(self.fd)
+            self.fd = -1
+
+
+def _stat(path: Path) -> tuple[int, int] | None:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@log_func_call
+def refresh_avcad_caches(events: list[WatchEvent]):
+    """
+    Bring the AVCAD caches up to date for the files in `events`.  Changed
+    manufacturer files have their pooled reader handles dropped and only
+    they are re-indexed in the catalog (if one has been built); the
+    DataFrame cache revalidates itself on its next load.  A changed layers
+    file is dropped from the layers cache, so it is parsed again on its
+    next load, and the layers listeners (e.g. the GUI) are told.
+    """
+    from .catalog import get_avcad_catalog_path, index_avcad_catalog
+    from .layers import avcad_layers_changed
+    from .reader import get_avcad_reader
+
+    for e in events:
+        if e.path.suffix != '.xml':
+            avcad_layers_changed(e.path)
+    names = {e.path.name for e in events if e.path.suffix == '.xml'}
+    if not names:
+        return
+    reader = get_avcad_reader()
+    for name in names:
+        reader.invalidate(name)
+    if get_avcad_catalog_path().exists():
+        index_avcad_catalog(names=names)
+
+
+class LibraryWatcher:
+    """
+    Watches the AVCAD SharedLibrary for added, changed and removed `*.xml`
+    manufacturer databases and the layers file, and passes each settled
+    batch of changes to `on_change` (refresh_avcad_caches by default).
+
+    Uses inotify on Linux, falling back to polling stats every `interval`
+    seconds elsewhere (or with `use_inotify=False`, e.g. for network shares
+    where inotify misses remote writes).  Either way, changes are confirmed
+    against a snapshot of (mtime, size) so only real changes are reported.
+    Call `check` from a timer, or `start` a background thread.
+    """
+    def __init__(self, db_dir: Path = None, layers_file: Path = None,
+                 on_change: Callable[[list[WatchEvent]], None] = None,
+                 interval: float = 5.0, settle: float = 0.5,
+                 use_inotify: bool = None):
+        self.db_dir = Path(db_dir or get_avcad_db_dir())
+        layers_file = layers_file or PyRigApp.get(CFG_AVCAD_LAYERS_KEY)
+        self.layers_file = Path(layers_file) if layers_file else None
+        self.on_change = on_change or refresh_avcad_caches
+        self.interval = interval
+        self.settle = settle
+        self._stop = Event()
+        self._thread = None
+        self._snapshot = self._scan()
+
+        if use_inotify is None:
+            use_inotify = Inotify.available()
+        self._inotify = None
+        if use_inotify:
+            dirs = {self.db_dir}
+            if self.layers_file:
+                dirs.add(self.layers_file.parent)
+            try:
+                self._inotify = Inotify(d for d in dirs if d.is_dir())
+            except OSError as e:
+                get_logger().warning(f"inotify unavailable ({e}), polling "
+                                     "the AVCAD library instead")
+
+    @property
+    def polling(self) -> bool:
+        return self._inotify is None
+
+    def _watched(self, path: Path) -> bool:
+        if path.parent == self.db_dir and path.suffix == '.xml':
+            return True
+        return path == self.layers_file
+
+    def _scan(self, paths: Iterable[Path] = None) -> dict[Path, tuple]:
+        if paths is None:
+            paths = list(self.db_dir.glob('*.xml'))
+            if self.layers_file:
+                paths.append(self.layers_file)
+        stats = {}
+        for path in paths:
+            st = _stat(path)
+            if st is not None:
+                stats[path] = st
+        return stats
+
+    def _diff(self, paths: set[Path] = None) -> list[WatchEvent]:
+        "Events for `paths` (all watched files if None) since the snapshot."
+        if paths is None:
+            current = self._scan()
+            paths = set(current) | set(self._snapshot)
+        else:
+            paths = {p for p in paths if self._watched(p)}
+            current = self._scan(paths)
+        events = []
+        for path in sorted(paths):
+            old, new = self._snapshot.get(path), current.get(path)
+            if old == new:
+                continue
+            kind = (WATCH_ADDED if old is None else
+                    WATCH_REMOVED if new is None else WATCH_CHANGED)
+            events.append(WatchEvent(kind, path))
+            if new is None:
+                self._snapshot.pop(path, None)
+            else:
+                self._snapshot[path] = new
+        return events
+
+    def _dispatch(self, events: list[WatchEvent]):
+        if not events:
+            return
+        get_logger().info("AVCAD library changed: " + ', '.join(
+            f'{e.path.name} {e.kind}' for e in events
+        ))
+        try:
+            self.on_change(events)
+        except Exception as e:
+            get_logger().exception(f"Refreshing after AVCAD changes failed: "
+                                   f"{e}")
+
+    def check(self, timeout: float = 0) -> list[WatchEvent]:
+        """
+        Collect and dispatch pending changes, waiting up to `timeout`
+        seconds for inotify events.  Returns the events.
+        """
+        if self.polling:
+            events = self._diff()
+        else:
+            paths = self._inotify.read(timeout)
+            # let writers finish, coalescing bursts of events
+            while paths:
+                more = self._inotify.read(self.settle)
+                if not more:
+                    if more is None:
+                        paths = None
+                    break
+                paths |= more
+            if paths is None:
+                # the kernel queue overflowed, rescan everything
+                events = self._diff()
+            else:
+                events = self._diff(paths) if paths else []
+        self._dispatch(events)
+        return events
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.polling:
+                self._stop.wait(self.interval)
+                if self._stop.is_set():
+                    break
+            self.check(self.interval)
+
+    @log_func_call
+    def start(self):
+        "Watch on a daemon thread until `stop`."
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='avcad-watch',
+                              daemon=True)
+        self._thread.start()
+
+    @log_func_call
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
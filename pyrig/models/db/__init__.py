@@ -1,11 +1,18 @@
+from contextlib import closing
 from pathlib import Path
-from sqlite3 import connect
+from sqlite3 import Connection, connect
 
 from pyapp.utils.sqlite import get_tables
 
 from ...app import PyRigApp
 from ...logging import log_func_call, get_logger
-from .migrations import init_pyrig_db, check_schema_version
+from .connection import (  # noqa: F401
+    close_pyrig_connections, get_pyrig_connection, pyrig_db,
+)
+from .migrations import (
+    PACKAGE_SCHEMA_VERSION, check_schema_version, dry_run_migrations,
+    get_user_version, init_pyrig_db,
+)
 
 
 @log_func_call
@@ -17,22 +24,61 @@ def get_pyrig_db_path() -> Path:
 
 
 @log_func_call
-def check_pyrig_db(create_if_missing: bool = False):
-    "Check PyRig database, creating or migrating as needed."
-    dbpath = get_pyrig_db_path()
+def check_pyrig_db(create_if_missing: bool = False, dry_run: bool = False):
+    """
+    Check PyRig database, creating or migrating as needed.  With `dry_run`,
+    the database is opened read-only and initialization and pending
+    migrations are applied to an in-memory copy only.
+    """
+    dbpath = Path(get_pyrig_db_path())
+
+    if not dry_run:
+        with pyrig_db(dbpath) as cxn:
+            _check_pyrig_db(cxn, create_if_missing, dry_run)
+        return
+
+    # a missing database is dry-run as an empty one rather than created
+    uri = (f'{dbpath.absolute().as_uri()}?mode=ro' if dbpath.exists()
+           else ':memory:')
+    with closing(connect(uri, uri=True)) as cxn:
+        _check_pyrig_db(cxn, create_if_missing, dry_run)
+
+
+def _check_pyrig_db(cxn: Connection, create_if_missing: bool,
+                    dry_run: bool):
     log = get_logger()
 
-    # Database exists, check/migrate
-    with connect(dbpath) as cxn:
-        tables = get_tables(cxn)
+    # user_version mirrors settings.schema_version, so an up-to-date
+    # database costs a single header read
+    if get_user_version(cxn) == PACKAGE_SCHEMA_VERSION:
+        log.debug("Database schema is up to date")
+        return
 
-        if 'settings' not in tables:
-            if not create_if_missing:
-                log.warning("Settings table not found "
-                            "and create_if_missing is False")
-                return
+    init = 'settings' not in get_tables(cxn)
 
+    if init:
+        if not create_if_missing:
+            log.warning("Settings table not found "
+                        "and create_if_missing is False")
+            return
+
+        if not dry_run:
             log.info("Settings table not found, initializing database")
             init_pyrig_db(cxn)
 
+    if dry_run:
+        dry_run_migrations(cxn, init)
+    else:
         check_schema_version(cxn)
+
+
+@log_func_call
+def rebuild_pyrig_balances():
+    "Recompute account balances in the PyRig database from journal lines."
+    from ..acctng.balances import (
+        check_account_balances, rebuild_account_balances,
+    )
+
+    with pyrig_db() as cxn:
+        rebuild_account_balances(cxn)
+        check_account_balances(cxn)
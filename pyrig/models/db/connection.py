@@ -0,0 +1,128 @@
+from atexit import register as atexit_register
+from contextlib import contextmanager
+from pathlib import Path
+from sqlite3 import connect, Connection
+from threading import Lock, local
+from weakref import finalize
+
+from ...logging import log_func_call, get_logger
+
+# applied to every connection handed out by the manager
+PYRIG_DB_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('foreign_keys', 'ON'),
+    ('cache_size', -64*1024),  # KiB when negative: 64 MiB page cache
+    ('mmap_size', 256*1024*1024),
+    ('temp_store', 'MEMORY'),
+)
+# seconds to wait on a locked database before raising
+PYRIG_DB_TIMEOUT = 30.0
+# per-connection LRU of prepared statements
+PYRIG_DB_CACHED_STATEMENTS = 512
+
+_local = local()
+_lock = Lock()
+_open: set[Connection] = set()
+_generation = 0
+
+
+class _ThreadOwner:
+    "Lives in a thread's local data, so it is freed when the thread exits."
+
+
+def _release_connections(cxns: dict[str, Connection]):
+    "Close the pooled connections of a thread that has exited."
+    with _lock:
+        cxns = [c for c in cxns.values() if c in _open]
+        _open.difference_update(cxns)
+    for cxn in cxns:
+        try:
+            cxn.close()
+        except Exception as e:
+            get_logger().warning(f"Error closing connection: {e}")
+
+
+@log_func_call
+def configure_connection(cxn: Connection):
+    "Apply PYRIG_DB_PRAGMAS to a connection outside of any transaction."
+    for name, value in PYRIG_DB_PRAGMAS:
+        cxn.execute(f"PRAGMA {name} = {value}")
+
+
+@log_func_call
+def open_pyrig_connection(dbpath: str | Path = None) -> Connection:
+    """
+    Open a new, configured connection to the PyRig database (or `dbpath`).
+    Prefer get_pyrig_connection, which pools connections per thread.
+    """
+    if dbpath is None:
+        from . import get_pyrig_db_path
+        dbpath = get_pyrig_db_path()
+
+    cxn = connect(dbpath, timeout=PYRIG_DB_TIMEOUT,
+                  cached_statements=PYRIG_DB_CACHED_STATEMENTS,
+                  check_same_thread=False)
+    configure_connection(cxn)
+    return cxn
+
+
+def get_pyrig_connection(dbpath: str | Path = None) -> Connection:
+    """
+    Return this thread's pooled connection to the PyRig database (or
+    `dbpath`), opening and configuring it on first use.
+
+    Each thread gets its own connection, so with WAL enabled readers never
+    block the writer and a background thread can write while the GUI reads.
+    Reusing the connection also reuses its prepared statement cache.  A
+    thread's connections are closed when it exits.
+    """
+    if dbpath is None:
+        from . import get_pyrig_db_path
+        dbpath = get_pyrig_db_path()
+    key = str(dbpath)
+
+    if getattr(_local, 'generation', None) != _generation:
+        _local.cxns = {}
+        _local.owner = _ThreadOwner()
+        finalize(_local.owner, _release_connections, _local.cxns)
+        _local.generation = _generation
+
+    cxn = _local.cxns.get(key)
+    if cxn is None:
+        cxn = open_pyrig_connection(dbpath)
+        _local.cxns[key] = cxn
+        with _lock:
+            _open.add(cxn)
+    return cxn
+
+
+@contextmanager
+def pyrig_db(dbpath: str | Path = None):
+    """
+    Context manager around this thread's pooled connection: commits on
+    success and rolls back on error, like `with sqlite3.connect(...)`, but
+    leaves the connection open for reuse.
+    """
+    cxn = get_pyrig_connection(dbpath)
+    with cxn:
+        yield cxn
+
+
+@log_func_call
+def close_pyrig_connections():
+    "Close every pooled connection, in all threads."
+    global _generation
+    with _lock:
+        for cxn in _open:
+            try:
+                cxn.close()
+            except Exception as e:
+                get_logger().warning(f"Error closing connection: {e}")
+        n = len(_open)
+        _open.clear()
+        _generation += 1
+    get_logger().debug(f"Closed {n} pooled database connections")
+
+
+atexit_register(close_pyrig_connections)
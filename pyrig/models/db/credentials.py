@@ -0,0 +1,188 @@
+from base64 import urlsafe_b64encode
+from os import (
+    O_CREAT, O_EXCL, O_WRONLY, close as os_close, open as os_open,
+    write as os_write,
+)
+from pathlib import Path
+from secrets import token_bytes
+from sqlite3 import Connection
+from threading import Lock
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from ...logging import log_func_call, get_logger
+from .connection import pyrig_db
+
+CREDENTIAL_KEY_FILE = 'pyrig.key'
+# prefix of encrypted setting values; anything else is legacy plaintext
+ENCRYPTED_PREFIX = 'fernet:'
+
+
+@log_func_call
+def get_credential_key_path() -> Path:
+    "Path of the local key file, next to pyrig_data.db."
+    from . import get_pyrig_db_path
+    return Path(get_pyrig_db_path()).with_name(CREDENTIAL_KEY_FILE)
+
+
+@log_func_call
+def load_credential_key(path: str | Path = None,
+                        create: bool = True) -> bytes:
+    """
+    Read the local 32 byte key used to encrypt stored credentials, creating
+    it (readable by the owner only) on first use unless `create` is false,
+    in which case a missing key raises FileNotFoundError.
+    """
+    path = Path(path or get_credential_key_path())
+    if create and not path.exists():
+        try:
+            fd = os_open(path, O_CREAT | O_EXCL | O_WRONLY, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            try:
+                os_write(fd, token_bytes(32))
+            finally:
+                os_close(fd)
+            get_logger().info(f"Created credential key {path}")
+    key = path.read_bytes()
+    if len(key) != 32:
+        raise ValueError(f"Credential key {path} is corrupt")
+    return key
+
+
+def encrypt_secret(key: bytes, secret: str) -> str:
+    "Encrypt and authenticate a secret with Fernet under `key`."
+    token = Fernet(urlsafe_b64encode(key)).encrypt(secret.encode())
+    return ENCRYPTED_PREFIX + token.decode()
+
+
+def decrypt_secret(key: bytes, value: str) -> str:
+    "Decrypt an encrypt_secret value; ValueError if it fails to verify."
+    if not value.startswith(ENCRYPTED_PREFIX):
+        raise ValueError("Malformed encrypted credential")
+    try:
+        data = Fernet(urlsafe_b64encode(key)).decrypt(
+            value[len(ENCRYPTED_PREFIX):].encode()
+        )
+    except InvalidToken:
+        raise ValueError("Encrypted credential failed to verify; "
+                         "wrong key?") from None
+    return data.decode()
+
+
+class CredentialStore:
+    """
+    Secrets kept encrypted in the settings table, resolved once per process.
+
+    `get` answers from an in-process cache and only opens the database when
+    the cache is cold or the caller's local value (e.g. from config)
+    disagrees with it.  The stored value wins over a differing local one.
+    When saving, a local value with nothing stored is saved and legacy
+    plaintext settings are encrypted in place; otherwise `get` only reads,
+    never creating the database or the key file.  By default `get` saves
+    only into a database that already exists.
+    """
+    def __init__(self, dbpath: str | Path = None,
+                 key_path: str | Path = None):
+        self.dbpath = dbpath
+        self.key_path = key_path
+        self._key = None
+        self._cache = {}
+        self._lock = Lock()
+
+    def _load_key(self, create: bool = True) -> bytes:
+        if self._key is None:
+            try:
+                self._key = load_credential_key(self.key_path, create)
+            except FileNotFoundError as e:
+                raise ValueError(f"Credential key {e.filename} is "
+                                 "missing") from None
+        return self._key
+
+    @property
+    def key(self) -> bytes:
+        return self._load_key()
+
+    def _read(self, cxn: Connection, name: str,
+              save: bool = True) -> str | None:
+        row = cxn.execute("SELECT value FROM settings WHERE name = ?",
+                          (name,)).fetchone()
+        if not row:
+            return None
+        if not row[0].startswith(ENCRYPTED_PREFIX):
+            if save:
+                get_logger().info(f"Encrypting plaintext setting '{name}'")
+                self._write(cxn, name, row[0])
+            return row[0]
+        return decrypt_secret(self._load_key(create=False), row[0])
+
+    def _write(self, cxn: Connection, name: str, secret: str):
+        cxn.execute("INSERT OR REPLACE INTO settings (name, value) "
+                    "VALUES (?, ?)", (name, encrypt_secret(self.key, secret)))
+
+    def _exists(self) -> bool:
+        from . import get_pyrig_db_path
+        return Path(self.dbpath or get_pyrig_db_path()).exists()
+
+    @log_func_call
+    def get(self, name: str, local: str = None,
+            save: bool = None) -> str | None:
+        """
+        Resolve a secret, preferring the stored value over `local`, saving
+        if `save` (None: if the database exists).  Raises sqlite3.Error if
+        the settings table cannot be read (or written, when saving) and
+        ValueError if the stored value fails to decrypt.
+        """
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is not None and local in (None, cached):
+                return cached
+
+            log = get_logger()
+            stored = None
+            exists = save or self._exists()
+            if save is None:
+                save = exists
+            if exists:
+                with pyrig_db(self.dbpath) as cxn:
+                    stored = self._read(cxn, name, save)
+                    if stored is None and local and save:
+                        self._write(cxn, name, local)
+                        log.info(f"Stored '{name}' in database settings")
+                        stored = local
+                    elif stored and local and stored != local:
+                        log.warning(f"'{name}' in database differs from "
+                                    "local config. Using database value.")
+            if stored is None:
+                # nothing stored and not saving: not cached, so a later
+                # saving get still stores the local value
+                return local
+            self._cache[name] = stored
+            return stored
+
+    @log_func_call
+    def set(self, name: str, secret: str):
+        "Store a secret encrypted and cache it."
+        with self._lock, pyrig_db(self.dbpath) as cxn:
+            self._write(cxn, name, secret)
+            self._cache[name] = secret
+
+    def forget(self, name: str = None):
+        "Drop cached secrets so the next get reads the database again."
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(name, None)
+
+
+_store: CredentialStore = None
+
+
+def get_credential_store() -> CredentialStore:
+    "Shared store for the PyRig database."
+    global _store
+    if _store is None:
+        _store = CredentialStore()
+    return _store
@@ -1,5 +1,9 @@
-from sqlite3 import Connection
+from contextlib import contextmanager
+from json import dumps, loads
+from sqlite3 import Connection, connect
 from importlib import import_module
+from time import perf_counter
+from typing import NamedTuple
 
 from packaging.version import Version
 
@@ -10,9 +14,7 @@ from ....version import __version__ as PYRIG_VERSION
 from .schema_map import PKG_VERSION_TO_SCHEMA
 
 
-@log_func_call
-def get_package_schema_version():
-    "Get the expected database schema version for the current package version."
+def _package_schema_version():
     current_ver = Version(PYRIG_VERSION)
     for i in reversed(range(len(PKG_VERSION_TO_SCHEMA))):
         if current_ver >= Version(PKG_VERSION_TO_SCHEMA[i]):
@@ -20,6 +22,25 @@ def get_package_schema_version():
     return len(PKG_VERSION_TO_SCHEMA)
 
 
+# resolved once at import, it cannot change while the package is loaded
+PACKAGE_SCHEMA_VERSION = _package_schema_version()
+
+
+def get_package_schema_version():
+    "Get the expected database schema version for the current package version."
+    return PACKAGE_SCHEMA_VERSION
+
+
+def get_user_version(cxn: Connection) -> int:
+    "Read the schema version mirrored in the database header."
+    return cxn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def set_user_version(cxn: Connection, version: int):
+    "Mirror the schema version into the database header (user_version)."
+    cxn.execute(f"PRAGMA user_version = {int(version)}")
+
+
 @log_func_call
 def get_current_schema_version(cxn: Connection) -> int:
     "Get the current schema version from the settings table."
@@ -30,36 +51,153 @@ def get_current_schema_version(cxn: Connection) -> int:
     return 0
 
 
+class MigrationTiming(NamedTuple):
+    version: int
+    seconds: float
+    chunks: int
+
+
 @log_func_call
 def set_schema_version(cxn: Connection, version: int):
-    "Set the schema version in the settings table."
-    with cxn:
-        cxn.execute("INSERT OR REPLACE INTO settings (name, value) "
-                    "VALUES (?, ?)", ("schema_version", str(version)))
+    """
+    Set the schema version in the settings table and the db header, as part
+    of the caller's transaction.
+    """
+    cxn.execute("INSERT OR REPLACE INTO settings (name, value) "
+                "VALUES (?, ?)", ("schema_version", str(version)))
+    set_user_version(cxn, version)
+
+
+@contextmanager
+def savepoint(cxn: Connection, name: str):
+    "Run a block in a SAVEPOINT, rolling it back if the block raises."
+    cxn.execute(f"SAVEPOINT {name}")
+    try:
+        yield cxn
+    except BaseException:
+        cxn.execute(f"ROLLBACK TO {name}")
+        cxn.execute(f"RELEASE {name}")
+        raise
+    cxn.execute(f"RELEASE {name}")
+
+
+def _checkpoint_key(version: int):
+    return f"migration_v{version}_checkpoint"
+
+
+def get_migration_checkpoint(cxn: Connection, version: int):
+    """
+    Return (started, checkpoint) for a chunked migration: whether its schema
+    step has been committed, and the checkpoint its last chunk returned.
+    """
+    result = execute_select(cxn, 'settings', 'value',
+                            f"name = '{_checkpoint_key(version)}'"
+                            ).fetchone()
+    if result is None:
+        return False, None
+    return True, loads(result[0])
+
+
+def _set_migration_checkpoint(cxn: Connection, version: int, checkpoint):
+    cxn.execute("INSERT OR REPLACE INTO settings (name, value) "
+                "VALUES (?, ?)", (_checkpoint_key(version), dumps(checkpoint)))
+
+
+def _apply_chunked(cxn: Connection, version: int, module) -> int:
+    """
+    Run a chunked migration: an optional `migrate(cxn)` schema step, then
+    `migrate_chunk(cxn, checkpoint)` until it returns None.  Each chunk and
+    its checkpoint (stored in settings as JSON) commit together, so an
+    interrupted migration resumes after the last committed chunk.
+    """
+    log = get_logger()
+    name = f"migrate_v{version}"
+    started, checkpoint = get_migration_checkpoint(cxn, version)
+    if started:
+        log.info(f"Resuming migration to schema version {version} from "
+                 f"checkpoint {checkpoint!r}")
+    else:
+        with savepoint(cxn, name):
+            migrate = getattr(module, 'migrate', None)
+            if callable(migrate):
+                migrate(cxn)
+            _set_migration_checkpoint(cxn, version, None)
+
+    nchunks = 0
+    while True:
+        with savepoint(cxn, name):
+            checkpoint = module.migrate_chunk(cxn, checkpoint)
+            if checkpoint is None:
+                cxn.execute("DELETE FROM settings WHERE name = ?",
+                            (_checkpoint_key(version),))
+                set_schema_version(cxn, version)
+            else:
+                _set_migration_checkpoint(cxn, version, checkpoint)
+        nchunks += 1
+        if checkpoint is None:
+            return nchunks
+        log.debug(f"Schema version {version}: chunk {nchunks} done, "
+                  f"checkpoint {checkpoint!r}")
 
 
 @log_func_call
-def apply_migrations(cxn: Connection, from_version: int, to_version: int):
-    "Apply migrations from one schema version to another."
+def apply_migrations(cxn: Connection, from_version: int,
+                     to_version: int) -> list[MigrationTiming]:
+    """
+    Apply migrations from one schema version to another.
+
+    Each `v{N}` module's `migrate(cxn)` runs in one SAVEPOINT together with
+    its schema version bump, so a failed step leaves no partial changes.
+    Modules that define `migrate_chunk(cxn, checkpoint)` are run in
+    resumable chunks instead (see _apply_chunked).  Migration modules must
+    not commit themselves.  Returns the timing of each step.
+    """
     log = get_logger()
+    timings = []
     if from_version >= to_version:
         log.debug(f"No migrations needed (current: {from_version}, "
                   f"target: {to_version})")
-        return
+        return timings
 
     for version in range(from_version + 1, to_version + 1):
         # log.info(f"Applying migration to schema version {version}")
         migration_module = import_module(f".v{version}", package=__name__)
-        migrate = getattr(migration_module, 'migrate', None)
-        if callable(migrate):
-            migrate(cxn)
-            set_schema_version(cxn, version)
-            log.info(f"Successfully migrated to schema version {version}")
+        t0 = perf_counter()
+        if callable(getattr(migration_module, 'migrate_chunk', None)):
+            nchunks = _apply_chunked(cxn, version, migration_module)
+        else:
+            with savepoint(cxn, f"migrate_v{version}"):
+                migrate = getattr(migration_module, 'migrate', None)
+                if callable(migrate):
+                    migrate(cxn)
+                set_schema_version(cxn, version)
+            nchunks = 1
+        timings.append(MigrationTiming(version, perf_counter() - t0,
+                                       nchunks))
+        log.info(f"Successfully migrated to schema version {version}")
 
+    log_migration_timings(timings)
+    return timings
 
-def check_schema_version(cxn: Connection):
-    "Check the database schema version and apply migrations if needed."
+
+def log_migration_timings(timings: list[MigrationTiming]):
+    "Log a per-step timing report of applied migrations."
     log = get_logger()
+    for t in timings:
+        log.info(f"  schema v{t.version}: {t.seconds:.3f} s"
+                 + (f" ({t.chunks} chunks)" if t.chunks > 1 else ''))
+    if timings:
+        total = sum(t.seconds for t in timings)
+        log.info(f"  total: {total:.3f} s")
+
+
+def check_schema_version(cxn: Connection) -> list[MigrationTiming]:
+    """
+    Check the database schema version and apply migrations if needed.
+    Returns the timings of the applied migrations.
+    """
+    log = get_logger()
+    timings = []
 
     current_schema = get_current_schema_version(cxn)
     log.debug(f"Current schema version: {current_schema}")
@@ -70,13 +208,41 @@ def check_schema_version(cxn: Connection):
     if current_schema < target_schema:
         log.info("Database schema upgrade needed: "
                  f"{current_schema} > {target_schema}")
-        apply_migrations(cxn, current_schema, target_schema)
+        timings = apply_migrations(cxn, current_schema, target_schema)
 
     elif current_schema > target_schema:
         log.warning("Database schema is newer than package expects: "
                     f"{current_schema} > {target_schema}. "
                     "This may cause compatibility issues.")
 
+    else:
+        # databases from before user_version was kept in step with settings
+        set_user_version(cxn, current_schema)
+
+    return timings
+
+
+@log_func_call
+def dry_run_migrations(cxn: Connection,
+                       init: bool = False) -> list[MigrationTiming]:
+    """
+    Apply pending migrations to an in-memory copy of the database made with
+    the sqlite backup API, leaving the database itself untouched.  With
+    `init`, the copy is initialized first.  Returns the timings measured on
+    the copy.
+    """
+    log = get_logger()
+    log.info("Dry run: migrating an in-memory copy of the database")
+    mem = connect(':memory:')
+    try:
+        cxn.backup(mem)
+        if init:
+            init_pyrig_db(mem)
+        with mem:
+            return check_schema_version(mem)
+    finally:
+        mem.close()
+
 
 @log_func_call
 def init_pyrig_db(cxn: Connection):
@@ -2,4 +2,7 @@
 # the schema version is implied by the index in the tuple + 1
 PKG_VERSION_TO_SCHEMA = (
     "0.1.0",
+    "0.1.0",
+    "0.1.0",
+    "0.1.0",
 )
@@ -0,0 +1,10 @@
+from sqlite3 import Connection
+
+from ....logging import log_func_call
+from ...acctng.db import create_account_closure
+
+
+@log_func_call
+def migrate(cxn: Connection):
+    # Precomputed ancestor/descendant pairs for account rollups
+    create_account_closure(cxn)
@@ -0,0 +1,10 @@
+from sqlite3 import Connection
+
+from ....logging import log_func_call
+from ...ynab.db import create_ynab_tables
+
+
+@log_func_call
+def migrate(cxn: Connection):
+    # Local mirror of YNAB data for delta sync
+    create_ynab_tables(cxn)
@@ -0,0 +1,10 @@
+from sqlite3 import Connection
+
+from ....logging import log_func_call
+from ...ynab.db import create_ynab_ledger_map
+
+
+@log_func_call
+def migrate(cxn: Connection):
+    # Maps YNAB accounts, categories and payees onto ledger accounts
+    create_ynab_ledger_map(cxn)
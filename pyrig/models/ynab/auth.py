@@ -1,15 +1,44 @@
 from pathlib import Path
-from sqlite3 import connect, Connection
-
-from pyapp.utils.sqlite import execute_select
+from sqlite3 import Error
 
 from ...app import PyRigApp
 from ...logging import log_func_call, get_logger
-from ..db import get_pyrig_db_path
+from ..db.credentials import get_credential_store
+
+YNAB_TOKEN_SETTING = 'ynab_token'
+
+
+def _get_local_ynab_token():
+    "Token from local config, else from the token file."
+    token = PyRigApp.get('local.ynab_token', None)
+    if token is None:
+        token = get_ynab_token_from_file()
+    return token
+
+
+def _resolve_ynab_token(save: bool = None):
+    local = _get_local_ynab_token()
+    try:
+        token = get_credential_store().get(YNAB_TOKEN_SETTING, local, save)
+    except (Error, ValueError) as e:
+        get_logger().warning(f"Cannot read the stored YNAB token ({e}); "
+                             "using local config")
+        token = local
+    if token is not None:
+        PyRigApp.set('local.ynab_token', token)
+    return token
 
 
 def get_ynab_token():
-    return PyRigApp.get('local.ynab_token', None)
+    """
+    YNAB token, resolved through the credential store on first use and
+    answered from memory afterwards.  If the database exists, a plaintext
+    setting is encrypted in place and a config or token file token is
+    stored (encrypted) then; the database is never created.  A database,
+    key or settings table that cannot be used falls back to the config or
+    token file token.
+    """
+    return _resolve_ynab_token()
 
 
 @log_func_call
@@ -21,56 +50,34 @@ def get_ynab_token_from_file():
         return token
 
 
-def get_ynab_token_from_db(cxn: Connection):
-    result = execute_select(cxn, 'settings', 'value',
-                            "name = 'ynab_token'").fetchone()
-    if result:
-        return result[0]
-
-
-def set_ynab_db_token(cxn: Connection, token: str):
-    cxn.execute("INSERT OR REPLACE INTO settings (name, value) "
-                "VALUES (?, ?)", ("ynab_token", token))
-    get_logger().info("Stored YNAB token in database settings")
-
-
 @log_func_call
 def load_ynab_token():
     """
-    Load YNAB token from database settings, local config, or token file.
+    Resolve the YNAB token through the credential store.
 
     Priority order:
     1. Database setting 'ynab_token' (with warning if differs from config)
     2. PyRigApp['local.ynab_token']
     3. File at PyRigApp['local.ynab_token_file']
 
-    The final token is stored back into PyRigApp['local.ynab_token'].
+    The setting is kept encrypted with the local credential key.  The final
+    token is stored back into PyRigApp['local.ynab_token'], and the store
+    caches it, so the database is only read again if config changes.
+    Clients call get_ynab_token, which does the same once the database
+    exists, so calling this up front is only needed to create it.
     """
     log = get_logger()
+    token = _resolve_ynab_token(save=True)
+    if token is None:
+        log.warning("No YNAB token found in database, config, or "
+                    "token file")
+        return
+
+    log.debug("YNAB token loaded successfully")
+    return token
+
 
-    local_token = get_ynab_token()
-    if local_token is None:
-        local_token = get_ynab_token_from_file()
-
-    with connect(get_pyrig_db_path()) as cxn:
-        db_token = get_ynab_token_from_db(cxn)
-        if local_token:
-            if db_token:
-                if db_token != local_token:
-                    log.warning("YNAB token in database differs from local "
-                                "config. Using database value.")
-
-            else:
-                # Only local token exists - store it in database
-                db_token = local_token
-                set_ynab_db_token(cxn, db_token)
-
-        elif not db_token:
-            # No token found anywhere
-            log.warning("No YNAB token found in database, config, or "
-                        "token file")
-            return
-
-        # Set the final token in PyRigApp
-        PyRigApp.set('local.ynab_token', db_token)
-        log.debug("YNAB token loaded successfully")
+def set_ynab_token(token: str):
+    "Store a new YNAB token (encrypted) and use it for this run."
+    get_credential_store().set(YNAB_TOKEN_SETTING, token)
+    PyRigApp.set('local.ynab_token', token)
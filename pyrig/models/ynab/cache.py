@@ -0,0 +1,192 @@
+from fnmatch import fnmatchcase
+from hashlib import sha256
+from json import dumps, loads
+from pathlib import Path
+from threading import Lock
+from time import time
+from urllib.parse import urlencode
+
+from ...logging import log_func_call, get_logger
+
+YNAB_CACHE_FILE = 'pyrig_cache.db'
+# seconds a cached response is fresh, by API path pattern; paths matching
+# none of these (e.g. transactions) are not cached.  Only reference lookups
+# use the cache: syncs bypass it so they always see the server's data
+YNAB_CACHE_TTLS = {
+    'user': 24*3600,
+    'budgets': 3600,
+    'budgets/*/settings': 3600,
+    'budgets/*/categories': 600,
+    'budgets/*/payees': 600,
+    'budgets/*/payee_locations': 600,
+    'budgets/*/accounts': 300,
+    'budgets/*/months': 300,
+}
+YNAB_CACHE_MAX_BYTES = 64*1024*1024
+# delta requests always go to the server
+_UNCACHED_PARAMS = ('last_knowledge_of_server',)
+
+
+@log_func_call
+def get_ynab_cache_path() -> Path:
+    "Path of the response cache database, next to pyrig_data.db."
+    from ..db import get_pyrig_db_path
+    return Path(get_pyrig_db_path()).with_name(YNAB_CACHE_FILE)
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of YNAB GET responses (the JSON 'data' member).
+
+    Entries expire after the TTL of the first YNAB_CACHE_TTLS pattern
+    matching their path.  Expired entries that carried an ETag are
+    revalidated with If-None-Match rather than dropped.  The total body size
+    is bounded by `max_bytes`, evicting the least recently used entries.
+    `stats` counts hits, misses, revalidations, stores and evictions.
+    """
+    def __init__(self, path: str | Path = None, ttls: dict = None,
+                 max_bytes: int = YNAB_CACHE_MAX_BYTES):
+        from ..db.connection import open_pyrig_connection
+        self.path = path or get_ynab_cache_path()
+        self.ttls = YNAB_CACHE_TTLS if ttls is None else ttls
+        self.max_bytes = max_bytes
+        self.stats = dict.fromkeys(
+            ('hits', 'misses', 'revalidated', 'stores', 'evictions'), 0
+        )
+        self._lock = Lock()
+        self._cxn = open_pyrig_connection(self.path)
+        with self._cxn:
+            self._cxn.execute("""
+            CREATE TABLE IF NOT EXISTS ynab_responses (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                etag TEXT,
+                body TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """)
+            self._cxn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ynab_responses_accessed "
+                "ON ynab_responses(accessed_at)"
+            )
+
+    def close(self):
+        self._cxn.close()
+
+    def ttl(self, path: str, params: dict = None) -> float:
+        "Freshness lifetime for a request; 0 if it must not be cached."
+        if params and any(p in params for p in _UNCACHED_PARAMS):
+            return 0
+        path = path.strip('/')
+        for pattern, ttl in self.ttls.items():
+            if fnmatchcase(path, pattern):
+                return ttl
+        return 0
+
+    @staticmethod
+    def key(scope: str, path: str, params: dict = None) -> str:
+        "Cache key of a request; `scope` separates tokens sharing a cache."
+        query = urlencode(sorted((params or {}).items()))
+        scope = sha256(scope.encode()).hexdigest()[:16]
+        return f"{scope}:{path.strip('/')}?{query}"
+
+    def _count(self, stat: str, n: int = 1):
+        self.stats[stat] += n
+
+    def lookup(self, key: str) -> tuple[object, str | None, bool] | None:
+        """
+        Return (data, etag, fresh) for a cached key, or None.  Stale entries
+        are returned only if they have an ETag to revalidate with.
+        """
+        with self._lock:
+            row = self._cxn.execute(
+                "SELECT body, etag, expires_at FROM ynab_responses "
+                "WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            body, etag, expires_at = row
+            fresh = expires_at > time()
+            if not fresh and not etag:
+                self._count('misses')
+                return None
+            if fresh:
+                self._count('hits')
+            with self._cxn:
+                self._cxn.execute("UPDATE ynab_responses SET accessed_at = ? "
+                                  "WHERE key = ?", (time(), key))
+        return loads(body), etag, fresh
+
+    def refresh(self, key: str, ttl: float):
+        "Mark a revalidated (304 Not Modified) entry fresh again."
+        now = time()
+        with self._lock, self._cxn:
+            self._cxn.execute("UPDATE ynab_responses SET expires_at = ?, "
+                              "accessed_at = ? WHERE key = ?",
+                              (now + ttl, now, key))
+            self._count('revalidated')
+
+    def store(self, key: str, path: str, data, ttl: float,
+              etag: str = None):
+        "Cache a response, then evict LRU entries beyond max_bytes."
+        body = dumps(data, separators=(',', ':'))
+        now = time()
+        with self._lock, self._cxn:
+            self._cxn.execute("""
+            INSERT OR REPLACE INTO ynab_responses
+            (key, path, etag, body, size, expires_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (key, path.strip('/'), etag, body, len(body), now + ttl,
+                  now))
+            self._count('stores')
+            evicted = self._cxn.execute("""
+            DELETE FROM ynab_responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (
+                        ORDER BY accessed_at DESC, key
+                    ) AS running
+                    FROM ynab_responses
+                ) WHERE running > ?
+            )
+            """, (self.max_bytes,)).rowcount
+            self._count('evictions', evicted)
+
+    @log_func_call
+    def invalidate(self, prefix: str = '') -> int:
+        """
+        Drop entries whose path starts with `prefix` (everything by default),
+        e.g. 'budgets/<id>' after writing to that budget.
+        """
+        prefix = prefix.strip('/')
+        with self._lock, self._cxn:
+            if prefix:
+                n = self._cxn.execute(
+                    "DELETE FROM ynab_responses WHERE path = ? "
+                    "OR substr(path, 1, ?) = ?",
+                    (prefix, len(prefix) + 1, prefix + '/')
+                ).rowcount
+            else:
+                n = self._cxn.execute("DELETE FROM ynab_responses").rowcount
+        get_logger().debug(f"Invalidated {n} cached YNAB responses "
+                           f"under '{prefix}'")
+        return n
+
+    def size(self) -> int:
+        "Total cached body size in bytes."
+        with self._lock:
+            return self._cxn.execute("SELECT COALESCE(SUM(size), 0) "
+                                     "FROM ynab_responses").fetchone()[0]
+
+
+_cache: ResponseCache = None
+
+
+def get_ynab_cache() -> ResponseCache:
+    "Shared response cache in pyrig_cache.db."
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
@@ -1,21 +1,271 @@
-from requests import get as reqget
+from bisect import bisect_right
+from collections import deque
+from email.utils import parsedate_to_datetime
+from math import isfinite
+from threading import Lock
+from time import monotonic, sleep, time
 
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from urllib3.exceptions import NewConnectionError
+
+from ...logging import log_func_call, get_logger
 from .auth import get_ynab_token
 from .budget import get_ynab_budget
+from .cache import ResponseCache, get_ynab_cache
+from .stream import JsonArrayStream
 
 YNAB_API_BASE = "https://api.ynab.com/v1"
+# YNAB allows 200 requests per access token in any rolling hour
+YNAB_HOURLY_LIMIT = 200
+YNAB_RETRY_STATUS = (429, 500, 502, 503, 504)
+# methods safe to resend after a 5xx or a failure mid-request; others are
+# only retried on 429 or when the connection was never established
+YNAB_IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+
+class YnabRateLimitError(RuntimeError):
+    "Raised when the hourly YNAB request budget is exhausted."
+    def __init__(self, retry_after: float):
+        super().__init__("YNAB hourly request budget exhausted, retry in "
+                         f"{retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+def _failed_to_connect(exc: Exception) -> bool:
+    "True if `exc` was raised before the request reached the server."
+    if isinstance(exc, ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0] if exc.args else None, 'reason', None)
+    return isinstance(reason, NewConnectionError)
 
 
-def get_ynab_req_headers():
+def get_ynab_req_headers(token: str = None):
     return {
-        'Authorization': f'Bearer {get_ynab_token()}',
+        'Authorization': f'Bearer {token or get_ynab_token()}',
         # 'Accept': 'application/json'
     }
 
 
+class YnabClient:
+    """
+    YNAB API client holding a pooled keep-alive requests.Session.
+
+    Requests get a (connect, read) timeout and are retried with exponential
+    backoff on connection errors and 429/5xx responses, honoring
+    Retry-After; POST and PATCH are only retried on 429 or failure to
+    connect, so a write is never sent twice.  The client counts requests
+    in a rolling hour (synced with YNAB's X-Rate-Limit header) so callers
+    can check `remaining` and `reset_in` to schedule work; a request with
+    no budget left raises YnabRateLimitError instead of being sent.  A
+    client may be shared by worker threads.
+
+    With a ResponseCache, `get` serves reference data from it within its
+    TTL, and successful writes invalidate the cached responses of the
+    budget they touched.
+    """
+    def __init__(self, token: str = None, base_url: str = YNAB_API_BASE,
+                 timeout: tuple[float, float] = (5.0, 30.0),
+                 max_retries: int = 5, backoff: float = 0.5,
+                 max_backoff: float = 60.0,
+                 hourly_limit: int = YNAB_HOURLY_LIMIT,
+                 pool_maxsize: int = 8, cache: ResponseCache = None):
+        self.token = token or get_ynab_token()
+        self.cache = cache
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hourly_limit = hourly_limit
+        self._sleep = sleep
+        self._lock = Lock()
+        self._sent = deque()
+        self._server_used = None
+
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(get_ynab_req_headers(self.token))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _prune(self):
+        cutoff = monotonic() - 3600
+        while self._sent and self._sent[0] <= cutoff:
+            self._sent.popleft()
+        if self._server_used and self._server_used[1] <= cutoff:
+            self._server_used = None
+
+    @property
+    def used(self) -> int:
+        "Requests counted against the current rolling hour."
+        self._prune()
+        if not self._server_used:
+            return len(self._sent)
+        # the server's count plus what we have sent since it reported
+        server, when = self._server_used
+        since = len(self._sent) - bisect_right(self._sent, when)
+        return max(len(self._sent), server + since)
+
+    @property
+    def remaining(self) -> int:
+        "Requests left in the current rolling hour."
+        return max(self.hourly_limit - self.used, 0)
+
+    @property
+    def reset_in(self) -> float:
+        "Seconds until the oldest counted request leaves the window."
+        self._prune()
+        if not self._sent:
+            return 0.0
+        return max(self._sent[0] + 3600 - monotonic(), 0.0)
+
+    def _record(self, response):
+        "Sync the budget with YNAB's X-Rate-Limit: used/limit header."
+        header = response.headers.get('X-Rate-Limit')
+        if not header:
+            return
+        try:
+            used, limit = (int(x) for x in header.split('/'))
+        except ValueError:
+            return
+        self.hourly_limit = limit
+        self._server_used = (used, monotonic())
+
+    def _retry_delay(self, attempt: int, response=None) -> float:
+        """
+        Seconds to wait before retrying: the server's Retry-After (seconds
+        or an HTTP date) if it is usable, else exponential backoff.
+        """
+        retry_after = response is not None and response.headers.get(
+            'Retry-After'
+        )
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    when = parsedate_to_datetime(retry_after).timestamp()
+                except (TypeError, ValueError, OverflowError):
+                    delay = None
+                else:
+                    delay = max(when - time(), 0.0)
+            if delay is not None and isfinite(delay) and delay >= 0:
+                return min(delay, self.max_backoff)
+            get_logger().warning("Ignoring malformed Retry-After header "
+                                 f"{retry_after!r}")
+        return min(self.backoff*2**attempt, self.max_backoff)
+
+    @log_func_call
+    def request(self, method: str, api_url: str, **kwargs):
+        "Send a request with timeout and retries; return the Response."
+        log = get_logger()
+        url = f'{self.base_url}/{api_url.lstrip("/")}'
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method.upper() in YNAB_IDEMPOTENT_METHODS
+        retry_status = YNAB_RETRY_STATUS if idempotent else (429,)
+
+        for attempt in range(self.max_retries + 1):
+            with self._lock:
+                if not self.remaining:
+                    raise YnabRateLimitError(self.reset_in)
+                self._sent.append(monotonic())
+
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                if (attempt == self.max_retries
+                        or not (idempotent or _failed_to_connect(e))):
+                    raise
+                delay = self._retry_delay(attempt)
+                log.warning(f"YNAB request failed ({e}), retrying in "
+                            f"{delay:.1f} s")
+                self._sleep(delay)
+                continue
+
+            with self._lock:
+                self._record(response)
+            if (response.status_code not in retry_status
+                    or attempt == self.max_retries):
+                break
+
+            delay = self._retry_delay(attempt, response)
+            log.warning(f"YNAB returned {response.status_code}, retrying in "
+                        f"{delay:.1f} s")
+            self._sleep(delay)
+
+        response.raise_for_status()
+        if method != 'GET' and self.cache is not None:
+            self.cache.invalidate('/'.join(api_url.strip('/').split('/')[:2]))
+        return response
+
+    def get(self, api_url: str, use_cache: bool = True, **kwargs):
+        "GET an API path and return the 'data' member of the response."
+        cache = self.cache if use_cache else None
+        params = kwargs.get('params')
+        ttl = cache.ttl(api_url, params) if cache is not None else 0
+        if not ttl:
+            return self.request('GET', api_url, **kwargs).json()['data']
+
+        key = cache.key(self.token, api_url, params)
+        cached = cache.lookup(key)
+        if cached is not None:
+            data, etag, fresh = cached
+            if fresh:
+                return data
+            kwargs['headers'] = {**kwargs.get('headers', {}),
+                                 'If-None-Match': etag}
+        response = self.request('GET', api_url, **kwargs)
+        if cached is not None and response.status_code == 304:
+            cache.refresh(key, ttl)
+            return data
+        data = response.json()['data']
+        cache.store(key, api_url, data, ttl, response.headers.get('ETag'))
+        return data
+
+    def stream(self, api_url: str, key: str, chunk_size: int = 64*1024,
+               **kwargs) -> JsonArrayStream:
+        """
+        GET an API path and incrementally parse the `data.<key>` array of the
+        response, without loading the whole body.  Other scalar members of
+        `data` (e.g. server_knowledge) are in the stream's `extras` once it
+        is exhausted.
+        """
+        response = self.request('GET', api_url, stream=True, **kwargs)
+
+        def chunks():
+            with response:
+                yield from response.iter_content(chunk_size)
+
+        return JsonArrayStream(chunks(), ('data', key))
+
+
+_client: YnabClient = None
+
+
+def get_ynab_client() -> YnabClient:
+    "Shared client for the configured token, recreated if the token changes."
+    global _client
+    token = get_ynab_token()
+    if _client is None or _client.token != token:
+        if _client is not None:
+            _client.close()
+        _client = YnabClient(token, cache=get_ynab_cache())
+    return _client
+
+
 def ynab_base_get(api_url: str):
-    return reqget(f'{YNAB_API_BASE}/{api_url}',
-                  headers={'Authorization': f'Bearer {get_ynab_token()}'}).json()['data']  # noqa: E501
+    return get_ynab_client().get(api_url)
 
 
 def ynab_get(api_url: str, budget_id: str = None):
@@ -0,0 +1,136 @@
+from sqlite3 import Connection
+
+from ...logging import log_func_call
+
+
+@log_func_call
+def create_ynab_tables(cxn: Connection):
+    """Create tables mirroring YNAB budgets and their delta sync state."""
+
+    # Server knowledge per budget and endpoint for delta requests
+    cxn.execute("""
+    CREATE TABLE IF NOT EXISTS ynab_sync_state (
+        budget_id TEXT NOT NULL,
+        endpoint TEXT NOT NULL,
+        server_knowledge INTEGER NOT NULL,
+        synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (budget_id, endpoint)
+    )
+    """)
+
+    cxn.execute("""
+    CREATE TABLE IF NOT EXISTS ynab_budgets (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        last_modified_on TEXT,
+        first_month TEXT,
+        last_month TEXT,
+        currency_iso TEXT,
+        data TEXT NOT NULL
+    )
+    """)
+
+    # Amounts are YNAB milliunits
+    cxn.execute("""
+    CREATE TABLE IF NOT EXISTS ynab_accounts (
+        id TEXT PRIMARY KEY,
+        budget_id TEXT NOT NULL,
+        name TEXT,
+        type TEXT,
+        on_budget BOOLEAN,
+        closed BOOLEAN,
+        balance INTEGER,
+        deleted BOOLEAN NOT NULL DEFAULT 0,
+        data TEXT NOT NULL
+    )
+    """)
+
+    cxn.execute("""
+    CREATE TABLE IF NOT EXISTS ynab_categories (
+        id TEXT PRIMARY KEY,
+        budget_id TEXT NOT NULL,
+        category_group_id TEXT,
+        category_group_name TEXT,
+        name TEXT,
+        hidden BOOLEAN,
+        budgeted INTEGER,
+        activity INTEGER,
+        balance INTEGER,
+        deleted BOOLEAN NOT NULL DEFAULT 0,
+        data TEXT NOT NULL
+    )
+    """)
+
+    cxn.execute("""
+    CREATE TABLE IF NOT EXISTS ynab_payees (
+        id TEXT PRIMARY KEY,
+        budget_id TEXT NOT NULL,
+        name TEXT,
+        transfer_account_id TEXT,
+        deleted BOOLEAN NOT NULL DEFAULT 0,
+        data TEXT NOT NULL
+    )
+    """)
+
+    cxn.execute("""
+    CREATE TABLE IF NOT EXISTS ynab_transactions (
+        id TEXT PRIMARY KEY,
+        budget_id TEXT NOT NULL,
+        date TEXT,
+        amount INTEGER,
+        memo TEXT,
+        cleared TEXT,
+        approved BOOLEAN,
+        account_id TEXT,
+        payee_id TEXT,
+        category_id TEXT,
+        transfer_account_id TEXT,
+        import_id TEXT,
+        deleted BOOLEAN NOT NULL DEFAULT 0,
+        data TEXT NOT NULL
+    )
+    """)
+
+    cxn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ynab_accounts_budget "
+        "ON ynab_accounts(budget_id)"
+    )
+    cxn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ynab_categories_budget "
+        "ON ynab_categories(budget_id)"
+    )
+    cxn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ynab_payees_budget "
+        "ON ynab_payees(budget_id)"
+    )
+    cxn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ynab_transactions_budget_date "
+        "ON ynab_transactions(budget_id, date)"
+    )
+    cxn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ynab_transactions_account "
+        "ON ynab_transactions(account_id)"
+    )
+
+
+@log_func_call
+def create_ynab_ledger_map(cxn: Connection):
+    """Create the YNAB to chart of accounts mapping used by the importer."""
+
+    # Ledger account for each YNAB account, category or payee
+    cxn.execute("""
+    CREATE TABLE IF NOT EXISTS ynab_account_map (
+        budget_id TEXT NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('account', 'category', 'payee')),
+        ynab_id TEXT NOT NULL,
+        account_id INTEGER NOT NULL,
+        PRIMARY KEY (budget_id, kind, ynab_id),
+        FOREIGN KEY (account_id) REFERENCES accounts(id)
+    ) WITHOUT ROWID
+    """)
+
+    # Imported entries are found by their YNAB transaction id
+    cxn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_journal_entries_reference "
+        "ON journal_entries(reference)"
+    )
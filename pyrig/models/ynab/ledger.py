@@ -0,0 +1,365 @@
+from json import loads
+from sqlite3 import Connection
+from typing import Iterable, NamedTuple
+
+from numpy import int64, where
+from pandas import DataFrame, Series, concat
+
+from ...logging import log_func_call, get_logger
+from ..acctng.balances import amounts_to_intvals
+from ..acctng.money import Money
+from ..acctng.pdext import MoneyExtensionArray
+from ..acctng.periods import get_closed_period_entries
+from ..acctng.posting import delete_journal_entries, post_journal_entries
+from .stream import _MILLIUNIT_SCALE, iter_batches
+
+# journal_entries.source_document of imported YNAB transactions
+YNAB_SOURCE = 'ynab'
+MAP_KINDS = ('account', 'category', 'payee')
+_PART_COLUMNS = ('txn', 'split', 'date', 'account_id', 'payee_id',
+                 'category_id', 'transfer_account_id', 'transfer_id',
+                 'description', 'milliunits')
+# line description marking the ledger side of a YNAB transfer
+_TRANSFER_MARK = 'YNAB transfer '
+# entry numbers are this plus the YNAB transaction id
+_ENTRY_PREFIX = 'YNAB-'
+
+
+class ImportResult(NamedTuple):
+    entry_ids: list[int]
+    nlines: int
+    # YNAB transaction id and reason for each transaction with nothing to
+    # post: already imported unchanged, or of zero amount
+    skipped: list[tuple[str, str]]
+    # YNAB transaction id and reason for each transaction not imported
+    failures: list[tuple[str, str]]
+    # YNAB transaction ids whose entries were deleted, or replaced because
+    # the transaction changed
+    removed: list[str]
+
+
+@log_func_call
+def get_account_map(cxn: Connection, budget_id: str) -> dict[str, dict]:
+    "Ledger account id per YNAB id, for each kind in MAP_KINDS."
+    maps = {kind: {} for kind in MAP_KINDS}
+    for kind, ynab_id, account_id in cxn.execute(
+        "SELECT kind, ynab_id, account_id FROM ynab_account_map "
+        "WHERE budget_id = ?", (budget_id,)
+    ):
+        maps[kind][ynab_id] = account_id
+    return maps
+
+
+@log_func_call
+def set_account_map(cxn: Connection, budget_id: str, kind: str,
+                    mapping: dict[str, int]):
+    "Map YNAB ids of one kind onto ledger account ids, replacing old ones."
+    if kind not in MAP_KINDS:
+        raise ValueError(f"Unknown YNAB mapping kind {kind!r}")
+    with cxn:
+        cxn.executemany("""
+        INSERT INTO ynab_account_map (budget_id, kind, ynab_id, account_id)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(budget_id, kind, ynab_id) DO UPDATE SET
+            account_id = excluded.account_id
+        """, [(budget_id, kind, k, v) for k, v in mapping.items()])
+
+
+def _milliunits(v) -> int:
+    return v.intval//_MILLIUNIT_SCALE if isinstance(v, Money) else v
+
+
+def _transaction_parts(transactions: Iterable[dict]
+                       ) -> tuple[DataFrame, list[str]]:
+    """
+    One row per categorized part of each live transaction: the transaction
+    itself, or its subtransactions if it is split.  Also returns the ids of
+    deleted transactions.
+    """
+    rows = []
+    deleted = []
+    for t in transactions:
+        if t.get('deleted'):
+            deleted.append(t['id'])
+            continue
+        desc = t.get('payee_name') or t.get('memo') or 'YNAB transaction'
+        subs = [s for s in t.get('subtransactions') or ()
+                if not s.get('deleted')]
+        for p in subs or (t,):
+            rows.append((
+                t['id'], bool(subs), t.get('date'), t.get('account_id'),
+                p.get('payee_id') or t.get('payee_id'), p.get('category_id'),
+                p.get('transfer_account_id'), p.get('transfer_transaction_id'),
+                desc, _milliunits(p.get('amount') or 0),
+            ))
+    return DataFrame(rows, columns=_PART_COLUMNS), deleted
+
+
+def _imported_entries(cxn: Connection, ids: list[str]) -> dict[str, int]:
+    "Journal entry id of each already imported YNAB transaction id."
+    found = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        found.update(cxn.execute(
+            "SELECT reference, id FROM journal_entries "
+            "WHERE source_document = ? "
+            f"AND reference IN ({', '.join('?'*len(chunk))})",
+            [YNAB_SOURCE, *chunk],
+        ))
+    return found
+
+
+def _booked_transfers(cxn: Connection, ids: list[str]) -> set[str]:
+    "Ids among `ids` whose transfer is booked by the other side's entry."
+    found = set()
+    for i in range(0, len(ids), 500):
+        marks = [_TRANSFER_MARK + t for t in ids[i:i + 500]]
+        found.update(r[0][len(_TRANSFER_MARK):] for r in cxn.execute(
+            "SELECT jel.description FROM journal_entry_lines jel "
+            "JOIN journal_entries je ON je.id = jel.journal_entry_id "
+            f"WHERE je.source_document = ? AND jel.description IN "
+            f"({', '.join('?'*len(marks))})", [YNAB_SOURCE, *marks],
+        ))
+    return found
+
+
+def _transfer_duplicates(cxn: Connection, parts: DataFrame,
+                         imported: dict[str, int]) -> tuple[Series, set]:
+    """
+    YNAB reports a transfer from both accounts; find the side not to book.
+    A split books its transfer parts itself, so a whole transaction paired
+    with a split's part is always the duplicate, as is one whose other side
+    is already booked.  Otherwise an imported side is kept, and of two new
+    ones the smaller id.  Sides are paired by transfer_transaction_id,
+    falling back to keeping the outflow when YNAB gives none.
+
+    Returns the mask of duplicate parts and the ids of transactions booked
+    by their other side (whose own entries, if any, are stale).
+    """
+    transfer = parts['transfer_account_id'].notna()
+    whole = transfer & ~parts['split']
+    txn, other = parts['txn'], parts['transfer_id']
+    booked = (set(parts.loc[transfer & parts['split'], 'transfer_id'].dropna())
+              | _booked_transfers(cxn, txn[whole].tolist()))
+    new = ~txn.isin(list(imported))
+    dup = whole & (txn.isin(list(booked)) | other.isin(list(imported))
+                   | (new & other.notna() & (other < txn))
+                   | (new & other.isna() & (parts['milliunits'] > 0)))
+    return dup, booked
+
+
+def _signatures(lines: DataFrame) -> dict[str, tuple]:
+    """
+    Comparable form of each transaction's entry: date, description and the
+    sorted (account, debit, credit) lines, amounts as scaled integers.
+    """
+    df = DataFrame({
+        'ref': lines['reference'].to_numpy(),
+        'date': lines['entry_date'].astype(str).to_numpy(),
+        'desc': lines['description'].to_numpy(),
+        'line': list(zip(lines['account_id'].astype(int64).tolist(),
+                         lines['debit'].tolist(), lines['credit'].tolist())),
+    })
+    return {ref: (g['date'].iloc[0], g['desc'].iloc[0],
+                  tuple(sorted(g['line'])))
+            for ref, g in df.groupby('ref', sort=False)}
+
+
+def _stored_signatures(cxn: Connection, entry_ids: list[int]
+                       ) -> dict[str, tuple]:
+    rows = []
+    for i in range(0, len(entry_ids), 500):
+        chunk = entry_ids[i:i + 500]
+        rows.extend(cxn.execute(
+            "SELECT je.reference, je.entry_date, je.description, "
+            "jel.account_id, jel.debit_amount, jel.credit_amount "
+            "FROM journal_entries je "
+            "JOIN journal_entry_lines jel ON jel.journal_entry_id = je.id "
+            f"WHERE je.id IN ({', '.join('?'*len(chunk))})", chunk,
+        ))
+    df = DataFrame(rows, columns=['reference', 'entry_date', 'description',
+                                  'account_id', 'debit', 'credit'])
+    df['debit'] = amounts_to_intvals(df['debit'])
+    df['credit'] = amounts_to_intvals(df['credit'])
+    return _signatures(df)
+
+
+@log_func_call
+def map_ynab_transactions(cxn: Connection, budget_id: str,
+                          transactions: Iterable[dict],
+                          default_account_id: int = None):
+    """
+    Map YNAB transaction dicts (amounts in milliunits or Money) onto
+    balanced journal entry lines, as a frame with one row per line that
+    post_journal_entries accepts.
+
+    Each transaction is one entry with entry_number 'YNAB-<id>' and the
+    YNAB id as its reference.  The YNAB account's ledger account takes the
+    net amount; each part (subtransaction, if split) is offset against its
+    transfer account, else its category's account, else its payee's account,
+    else `default_account_id`.  YNAB reports a transfer from both accounts,
+    so only one side of each pair is mapped (see _transfer_duplicates); its
+    transfer line is marked with the other side's id.
+
+    Transactions already imported unchanged, and those of zero amount, are
+    skipped.  Those that were deleted, changed (including to zero) or are
+    now booked by the other side of a transfer are returned as stale,
+    mapping their YNAB id to the entry to delete (changed ones are mapped
+    again, to replace it).
+
+    Returns (lines, [(id, reason)] for skipped transactions, {id: reason}
+    for unmappable transactions, stale entries).
+    """
+    parts, deleted = _transaction_parts(transactions)
+    imported = _imported_entries(cxn, list(dict.fromkeys(
+        [*parts['txn'], *deleted, *parts['transfer_id'].dropna()]
+    )))
+    dup, booked = _transfer_duplicates(cxn, parts, imported)
+    parts = parts[~dup]
+    # deleted transactions, and transfers now booked by their other side
+    stale = {t: imported[t] for t in [*deleted, *booked] if t in imported}
+    parts = parts[~parts['txn'].isin(list(stale))]
+
+    maps = get_account_map(cxn, budget_id)
+    counter = parts['transfer_account_id'].map(maps['account'])
+    counter = counter.where(parts['transfer_account_id'].notna(),
+                            parts['category_id'].map(maps['category']))
+    counter = counter.fillna(parts['payee_id'].map(maps['payee']))
+    if default_account_id is not None:
+        counter = counter.fillna(default_account_id)
+    own = parts['account_id'].map(maps['account'])
+
+    failures = {}
+    for mask, reason in ((own.isna(), 'YNAB account is not mapped'),
+                         (counter.isna(), 'no ledger account for category, '
+                                          'payee or transfer')):
+        for txn in parts.loc[mask, 'txn'].unique():
+            failures.setdefault(txn, reason)
+    ok = ~parts['txn'].isin(list(failures))
+    parts = parts[ok].assign(counter=counter[ok].astype(int64),
+                             own=own[ok].astype(int64),
+                             intvals=parts.loc[ok, 'milliunits']
+                             * _MILLIUNIT_SCALE)
+    mark = (_TRANSFER_MARK + parts['transfer_id']).where(
+        parts['transfer_account_id'].notna()
+    )
+
+    heads = parts.groupby('txn', sort=False).agg(
+        date=('date', 'first'), description=('description', 'first'),
+        account_id=('own', 'first'), intvals=('intvals', 'sum'),
+    ).reset_index()
+    lines = concat([
+        heads[['txn', 'date', 'description', 'account_id', 'intvals']],
+        DataFrame({'txn': parts['txn'], 'date': parts['date'],
+                   'description': parts['description'],
+                   'account_id': parts['counter'],
+                   'intvals': -parts['intvals'], 'mark': mark}),
+    ], ignore_index=True)
+    lines = lines[lines['intvals'] != 0]
+    # transactions left without lines have nothing to post
+    zero = heads.loc[~heads['txn'].isin(lines['txn']), 'txn'].tolist()
+    stale.update((t, imported[t]) for t in zero if t in imported)
+    # keep each entry's lines together, own account first
+    order = Series(range(len(heads)), index=heads['txn'])
+    lines = lines.iloc[order[lines['txn']].to_numpy().argsort(kind='stable')]
+    lines = lines.reset_index(drop=True)
+
+    signed = lines['intvals'].to_numpy(dtype=int64)
+    lines = DataFrame({
+        'entry_number': _ENTRY_PREFIX + lines['txn'],
+        'entry_date': lines['date'],
+        'description': lines['description'],
+        'reference': lines['txn'],
+        'source_document': YNAB_SOURCE,
+        'created_by': YNAB_SOURCE,
+        'account_id': lines['account_id'],
+        'debit': where(signed > 0, signed, 0),
+        'credit': where(signed < 0, -signed, 0),
+        'line_description': lines['mark'].astype(object).where(
+            lines['mark'].notna(), None
+        ),
+    })
+
+    # imported transactions: skip if unchanged, else replace their entries
+    seen = {t: imported[t] for t in lines['reference'].unique()
+            if t in imported}
+    new = _signatures(lines[lines['reference'].isin(list(seen))])
+    old = _stored_signatures(cxn, list(seen.values()))
+    unchanged = sorted(t for t in seen if new.get(t) == old.get(t))
+    stale.update((t, seen[t]) for t in seen if t not in unchanged)
+    lines = lines[~lines['reference'].isin(unchanged)]
+    skipped = [(t, 'already imported') for t in unchanged]
+    skipped.extend((t, 'zero amount') for t in zero if t not in imported)
+
+    lines = lines.assign(
+        debit_amount=MoneyExtensionArray(lines.pop('debit').to_numpy()),
+        credit_amount=MoneyExtensionArray(lines.pop('credit').to_numpy()),
+    ).reset_index(drop=True)
+    return lines, skipped, failures, stale
+
+
+@log_func_call
+def import_ynab_transactions(cxn: Connection, budget_id: str,
+                             transactions: Iterable[dict],
+                             default_account_id: int = None,
+                             posted: bool = True,
+                             batch_size: int = 5000) -> ImportResult:
+    """
+    Map and post YNAB transactions as journal entries in batches of
+    `batch_size`, each in one transaction.  `transactions` may be any
+    iterable, such as sync.iter_ynab_entities, so a full history never has
+    to be held in memory.  Re-importing the same transactions is a no-op,
+    while transactions deleted or changed in YNAB since they were imported
+    have their entries deleted or replaced (unless their fiscal period is
+    closed, which is reported as a failure).
+    """
+    log = get_logger()
+    result = ImportResult([], 0, [], [], [])
+    for batch in iter_batches(transactions, batch_size):
+        lines, skipped, failures, stale = map_ynab_transactions(
+            cxn, budget_id, batch, default_account_id,
+        )
+        result.skipped.extend(skipped)
+        result.failures.extend(failures.items())
+        closed = set(get_closed_period_entries(cxn, stale.values()))
+        kept = [t for t, i in stale.items() if i in closed]
+        result.failures.extend((t, "Imported entry is in a closed fiscal "
+                                "period") for t in kept)
+        lines = lines[~lines['reference'].isin(kept)]
+        stale = {t: i for t, i in stale.items() if i not in closed}
+        refs = lines['reference'].drop_duplicates().tolist()
+        # changed transactions replace their entries; the old entry goes in
+        # the same transaction as the new one is posted, so it is kept if
+        # posting fails
+        replaced = {t: stale.pop(t) for t in refs if t in stale}
+        if lines.empty:
+            delete_journal_entries(cxn, stale.values())
+            result.removed.extend(stale)
+            continue
+        posting = post_journal_entries(
+            cxn, lines, posted,
+            {_ENTRY_PREFIX + t: i for t, i in replaced.items()},
+            stale.values(),
+        )
+        result.entry_ids.extend(posting.entry_ids)
+        failed = {refs[f.index]: f.reason for f in posting.failures}
+        result.failures.extend(failed.items())
+        result.removed.extend(stale)
+        result.removed.extend(t for t in replaced if t not in failed)
+        result = result._replace(nlines=result.nlines + posting.nlines)
+
+    log.info(f"Imported {len(result.entry_ids)} YNAB transactions "
+             f"({len(result.skipped)} skipped, "
+             f"{len(result.removed)} removed or replaced, "
+             f"{len(result.failures)} failed)")
+    return result
+
+
+@log_func_call
+def get_mirrored_transactions(cxn: Connection, budget_id: str):
+    "Yield the transaction dicts stored in the local YNAB mirror by date."
+    for (data,) in cxn.execute(
+        "SELECT data FROM ynab_transactions WHERE budget_id = ? "
+        "ORDER BY date, id", (budget_id,)
+    ):
+        yield loads(data)
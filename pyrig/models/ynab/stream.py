@@ -0,0 +1,152 @@
+from codecs import getincrementaldecoder
+from itertools import islice
+from json import JSONDecoder, JSONDecodeError
+from re import compile as re_compile
+from typing import Iterable, Iterator
+
+from ..acctng.money import Money
+
+_WS = re_compile(r'[ \t\n\r]*')
+
+# YNAB amount fields, all in milliunits
+MILLIUNIT_FIELDS = (
+    'amount',
+    'balance',
+    'cleared_balance',
+    'uncleared_balance',
+    'budgeted',
+    'activity',
+)
+# Money.intval per milliunit
+_MILLIUNIT_SCALE = Money.INTSCALAR//1000
+
+
+def milliunits_to_money(milliunits: int) -> Money:
+    "Convert an exact YNAB milliunit amount to Money."
+    return Money(intval=milliunits*_MILLIUNIT_SCALE)
+
+
+def money_to_milliunits(value: Money) -> int:
+    "Convert Money back to YNAB milliunits."
+    return value.intval//_MILLIUNIT_SCALE
+
+
+def convert_milliunits(entity: dict, fields=MILLIUNIT_FIELDS) -> dict:
+    "Convert milliunit fields (and those of subtransactions) to Money."
+    for field in fields:
+        value = entity.get(field)
+        if isinstance(value, int) and not isinstance(value, bool):
+            entity[field] = milliunits_to_money(value)
+    for sub in entity.get('subtransactions') or ():
+        convert_milliunits(sub, fields)
+    return entity
+
+
+def iter_batches(items: Iterable, size: int) -> Iterator[list]:
+    "Group an iterable into lists of at most `size` items."
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+class JsonArrayStream:
+    """
+    Incrementally parse a JSON document from an iterable of byte or text
+    chunks, yielding the elements of the array found at `path` (a sequence
+    of object keys, e.g. ('data', 'transactions')) one at a time.
+
+    Only the current element and the unparsed tail of the last chunk are
+    held in memory.  Scalar members of the objects along the path (such as
+    YNAB's server_knowledge, which follows the array) are collected into
+    `extras` as they are passed, so they are complete once iteration ends.
+    """
+    def __init__(self, chunks: Iterable[bytes | str], path: tuple[str, ...]):
+        self.path = tuple(path)
+        self.extras = {}
+        self._chunks = iter(chunks)
+        self._text = getincrementaldecoder('utf-8')()
+        self._decoder = JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        "Append the next chunk to the buffer; False at end of input."
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            if isinstance(chunk, bytes):
+                chunk = self._text.decode(chunk)
+            if chunk:
+                self._buf = self._buf[self._pos:] + chunk
+                self._pos = 0
+                return True
+        self._buf = self._buf[self._pos:] + self._text.decode(b'', True)
+        self._pos = 0
+        self._eof = True
+        return False
+
+    def _peek(self) -> str:
+        "Skip whitespace and return the next character."
+        while True:
+            self._pos = _WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if c not in chars:
+            raise ValueError(f"Expected one of {chars!r} in JSON input, "
+                             f"got {c!r}")
+        self._pos += 1
+        return c
+
+    def _value(self):
+        "Decode the next complete JSON value."
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # a number at the end of the buffer may continue
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def _array(self) -> Iterator:
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def _object(self, depth: int) -> Iterator:
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == self.path[depth]:
+                if depth == len(self.path) - 1:
+                    yield from self._array()
+                else:
+                    yield from self._object(depth + 1)
+            else:
+                value = self._value()
+                if not isinstance(value, (dict, list)):
+                    self.extras[key] = value
+            if self._expect(',}') == '}':
+                return
+
+    def __iter__(self) -> Iterator:
+        return self._object(0)
@@ -0,0 +1,309 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from json import dumps
+from sqlite3 import Connection
+from typing import Callable, NamedTuple
+
+from ...logging import log_func_call, get_logger
+from ..acctng.money import Money
+from .budget import get_ynab_budget
+from .comm import YnabClient, get_ynab_client
+from .stream import convert_milliunits, iter_batches, money_to_milliunits
+
+
+class SyncEndpoint(NamedTuple):
+    table: str
+    columns: tuple[str, ...]
+    # pulls the entity dicts out of the endpoint's response data
+    extract: Callable[[dict], list[dict]]
+    # key of the flat entity array under 'data', for streaming
+    stream_key: str = None
+
+
+def _categories(data: dict) -> list[dict]:
+    "Flatten category groups, tagging each category with its group name."
+    return [
+        {**cat, 'category_group_name': group.get('name')}
+        for group in data.get('category_groups', ())
+        for cat in group.get('categories', ())
+    ]
+
+
+# budget endpoints that support last_knowledge_of_server delta requests
+SYNC_ENDPOINTS = {
+    'accounts': SyncEndpoint(
+        'ynab_accounts',
+        ('name', 'type', 'on_budget', 'closed', 'balance', 'deleted'),
+        lambda data: data.get('accounts', []),
+        'accounts',
+    ),
+    'categories': SyncEndpoint(
+        'ynab_categories',
+        ('category_group_id', 'category_group_name', 'name', 'hidden',
+         'budgeted', 'activity', 'balance', 'deleted'),
+        _categories,
+    ),
+    'payees': SyncEndpoint(
+        'ynab_payees',
+        ('name', 'transfer_account_id', 'deleted'),
+        lambda data: data.get('payees', []),
+        'payees',
+    ),
+    'transactions': SyncEndpoint(
+        'ynab_transactions',
+        ('date', 'amount', 'memo', 'cleared', 'approved', 'account_id',
+         'payee_id', 'category_id', 'transfer_account_id', 'import_id',
+         'deleted'),
+        lambda data: data.get('transactions', []),
+        'transactions',
+    ),
+}
+
+BUDGET_COLUMNS = ('name', 'last_modified_on', 'first_month', 'last_month')
+
+
+class SyncResult(NamedTuple):
+    # entities received per (budget_id, endpoint)
+    counts: dict[tuple[str, str], int]
+    # error message per (budget_id, endpoint) that was not synced
+    failures: dict[tuple[str, str], str]
+
+
+def _value(v):
+    if isinstance(v, bool):
+        return int(v)
+    if isinstance(v, Money):
+        return money_to_milliunits(v)
+    return v
+
+
+def _json_default(v):
+    if isinstance(v, Money):
+        return money_to_milliunits(v)
+    raise TypeError(f"{type(v).__name__} is not JSON serializable")
+
+
+def get_server_knowledge(cxn: Connection, budget_id: str,
+                         endpoint: str) -> int | None:
+    "Server knowledge from the last sync of an endpoint, if any."
+    row = cxn.execute("SELECT server_knowledge FROM ynab_sync_state "
+                      "WHERE budget_id = ? AND endpoint = ?",
+                      (budget_id, endpoint)).fetchone()
+    return row[0] if row else None
+
+
+@log_func_call
+def upsert_entities(cxn: Connection, endpoint: str, budget_id: str,
+                    entities: list[dict]) -> int:
+    """
+    Upsert entity dicts of a sync endpoint into its mirror table.  Deleted
+    entities from delta responses are kept with deleted = 1.  Must be called
+    inside the caller's transaction.
+    """
+    spec = SYNC_ENDPOINTS[endpoint]
+    cols = ('id', 'budget_id') + spec.columns + ('data',)
+    updates = ', '.join(f'{c} = excluded.{c}' for c in cols[1:])
+    cxn.executemany(f"""
+    INSERT INTO {spec.table} ({', '.join(cols)})
+    VALUES ({', '.join('?'*len(cols))})
+    ON CONFLICT(id) DO UPDATE SET {updates}
+    """, [
+        (e['id'], budget_id,
+         *(_value(e.get(c, False if c == 'deleted' else None))
+           for c in spec.columns),
+         dumps(e, separators=(',', ':'), default=_json_default))
+        for e in entities
+    ])
+    return len(entities)
+
+
+def _store_knowledge(cxn: Connection, budget_id: str, endpoint: str,
+                     knowledge: int):
+    cxn.execute("""
+    INSERT INTO ynab_sync_state (budget_id, endpoint, server_knowledge)
+    VALUES (?, ?, ?)
+    ON CONFLICT(budget_id, endpoint) DO UPDATE SET
+        server_knowledge = excluded.server_knowledge,
+        synced_at = CURRENT_TIMESTAMP
+    """, (budget_id, endpoint, knowledge))
+
+
+@log_func_call
+def apply_endpoint_delta(cxn: Connection, budget_id: str, endpoint: str,
+                         data: dict) -> int:
+    """
+    Apply one endpoint response (full or delta) and store its
+    server_knowledge in a single transaction.  Returns the number of
+    entities upserted.
+    """
+    entities = SYNC_ENDPOINTS[endpoint].extract(data)
+    with cxn:
+        n = upsert_entities(cxn, endpoint, budget_id, entities)
+        if data.get('server_knowledge') is not None:
+            _store_knowledge(cxn, budget_id, endpoint,
+                             data['server_knowledge'])
+    return n
+
+
+def endpoint_params(cxn: Connection, budget_id: str, endpoint: str,
+                    full: bool = False) -> dict:
+    "Query params for a (delta) request of an endpoint."
+    knowledge = None if full else get_server_knowledge(cxn, budget_id,
+                                                       endpoint)
+    if knowledge is None:
+        return {}
+    return {'last_knowledge_of_server': knowledge}
+
+
+@log_func_call
+def sync_endpoint(cxn: Connection, budget_id: str, endpoint: str,
+                  client: YnabClient = None, full: bool = False) -> int:
+    """
+    Sync one budget endpoint into its mirror table.  After the first sync
+    only the changes since the stored server_knowledge are requested.  The
+    response cache is bypassed, so a full sync never reads stale data.
+    """
+    client = client or get_ynab_client()
+    data = client.get(f'budgets/{budget_id}/{endpoint}', use_cache=False,
+                      params=endpoint_params(cxn, budget_id, endpoint, full))
+    return apply_endpoint_delta(cxn, budget_id, endpoint, data)
+
+
+def iter_ynab_entities(budget_id: str, endpoint: str = 'transactions',
+                       client: YnabClient = None, params: dict = None):
+    """
+    Yield the entities of a budget endpoint as they are parsed from the
+    response, with milliunit amounts converted to Money.
+    """
+    client = client or get_ynab_client()
+    stream = client.stream(f'budgets/{budget_id}/{endpoint}',
+                           SYNC_ENDPOINTS[endpoint].stream_key,
+                           params=params)
+    yield from map(convert_milliunits, stream)
+
+
+@log_func_call
+def sync_endpoint_streaming(cxn: Connection, budget_id: str,
+                            endpoint: str = 'transactions',
+                            client: YnabClient = None, full: bool = False,
+                            batch_size: int = 1000) -> int:
+    """
+    Like sync_endpoint, but parses the response incrementally and upserts
+    it in batches of `batch_size`, so memory stays flat however long the
+    history is.  All batches and the new server_knowledge commit together.
+    """
+    client = client or get_ynab_client()
+    stream = client.stream(f'budgets/{budget_id}/{endpoint}',
+                           SYNC_ENDPOINTS[endpoint].stream_key,
+                           params=endpoint_params(cxn, budget_id, endpoint,
+                                                  full))
+    n = 0
+    with cxn:
+        for batch in iter_batches(map(convert_milliunits, stream),
+                                  batch_size):
+            n += upsert_entities(cxn, endpoint, budget_id, batch)
+        knowledge = stream.extras.get('server_knowledge')
+        if knowledge is not None:
+            _store_knowledge(cxn, budget_id, endpoint, knowledge)
+    get_logger().info(f"Streamed {n} {endpoint} for budget {budget_id}")
+    return n
+
+
+@log_func_call
+def sync_budgets(cxn: Connection, client: YnabClient = None) -> int:
+    "Mirror the budget list (no delta support, but it is small)."
+    client = client or get_ynab_client()
+    budgets = client.get('budgets').get('budgets', [])
+    cols = ('id',) + BUDGET_COLUMNS + ('currency_iso', 'data')
+    updates = ', '.join(f'{c} = excluded.{c}' for c in cols[1:])
+    with cxn:
+        cxn.executemany(f"""
+        INSERT INTO ynab_budgets ({', '.join(cols)})
+        VALUES ({', '.join('?'*len(cols))})
+        ON CONFLICT(id) DO UPDATE SET {updates}
+        """, [
+            (b['id'], *(b.get(c) for c in BUDGET_COLUMNS),
+             (b.get('currency_format') or {}).get('iso_code'),
+             dumps(b, separators=(',', ':')))
+            for b in budgets
+        ])
+    return len(budgets)
+
+
+@log_func_call
+def sync_budget(cxn: Connection, budget_id: str = None,
+                client: YnabClient = None, endpoints=None,
+                full: bool = False) -> dict[str, int]:
+    """
+    Sync a budget's endpoints (all of SYNC_ENDPOINTS by default) into the
+    local mirror, each as a delta since its last sync unless `full`.
+    Returns the number of entities received per endpoint.
+    """
+    budget_id = budget_id or get_ynab_budget()
+    client = client or get_ynab_client()
+    counts = {}
+    for endpoint in endpoints or SYNC_ENDPOINTS:
+        counts[endpoint] = sync_endpoint(cxn, budget_id, endpoint, client,
+                                         full)
+    get_logger().info(f"Synced YNAB budget {budget_id}: "
+                      + ', '.join(f'{n} {e}' for e, n in counts.items()))
+    return counts
+
+
+@log_func_call
+def sync_budgets_concurrent(cxn: Connection, budget_ids: list[str] = None,
+                            client: YnabClient = None, endpoints=None,
+                            max_workers: int = 4,
+                            full: bool = False) -> SyncResult:
+    """
+    Sync several budgets, running the per-budget, per-endpoint requests on a
+    bounded thread pool so their round trips overlap.
+
+    Responses are applied to the local mirror on the calling thread as they
+    complete, each in its own transaction, so nothing waits for the slowest
+    request.  Only as many requests as the client's remaining hourly budget
+    allows are submitted; the rest are reported as failures to retry later.
+    With no `budget_ids`, the budget list is synced first and all budgets
+    are used.
+    """
+    log = get_logger()
+    client = client or get_ynab_client()
+    if budget_ids is None:
+        sync_budgets(cxn, client)
+        budget_ids = [r[0] for r in cxn.execute(
+            "SELECT id FROM ynab_budgets ORDER BY id"
+        )]
+
+    jobs = [(b, e) for b in budget_ids for e in endpoints or SYNC_ENDPOINTS]
+    failures = {}
+    budget = getattr(client, 'remaining', len(jobs))
+    if budget < len(jobs):
+        log.warning(f"Only {budget} of {len(jobs)} YNAB requests fit in the "
+                    "remaining hourly budget")
+        for job in jobs[budget:]:
+            failures[job] = 'rate limit budget exhausted'
+        jobs = jobs[:budget]
+
+    counts = {}
+    with ThreadPoolExecutor(max_workers=max_workers,
+                            thread_name_prefix='ynab-sync') as pool:
+        futures = {
+            pool.submit(client.get, f'budgets/{b}/{e}', use_cache=False,
+                        params=endpoint_params(cxn, b, e, full)): (b, e)
+            for b, e in jobs
+        }
+        for future in as_completed(futures):
+            budget_id, endpoint = job = futures[future]
+            try:
+                data = future.result()
+            except Exception as e:
+                log.warning(f"YNAB sync of {endpoint} for budget "
+                            f"{budget_id} failed: {e}")
+                failures[job] = str(e)
+                continue
+            counts[job] = apply_endpoint_delta(cxn, budget_id, endpoint,
+                                               data)
+
+    log.info(f"Synced {len(counts)} YNAB endpoints for {len(budget_ids)} "
+             f"budgets ({sum(counts.values())} entities, "
+             f"{len(failures)} failed)")
+    return SyncResult(counts, failures)
@@ -206,6 +206,38 @@ class TestPyRig(TestCase):
         self.assertEqual(ceil(f), Fixed4(124))
         self.assertEqual(ceil(fneg), Fixed4(-987))
 
+    def test_fixed4_exact(self):
+        from decimal import Decimal
+        from math import trunc
+        from pyrig.models.acctng.fixed4 import Fixed4
+        from pyrig.models.acctng.money import Money
+
+        self.assertEqual(Fixed4(10**20).intval, 10**24)
+        self.assertEqual(Fixed4('0.00005').intval, 1)
+        self.assertEqual(Fixed4('-0.00005').intval, -1)
+        self.assertEqual(Fixed4('0.00004').intval, 0)
+        self.assertEqual(Fixed4(Decimal('-123.45675')).intval, -1234568)
+        self.assertEqual(Money(' 1.10 ').intval, 11000)
+        self.assertEqual([Fixed4(x).intval for x in ('-.5', '+2', '1e3')],
+                         [-5000, 20000, 10000000])
+        for bad in ('abc', '-', '.', '', '+-1', '1.2.3'):
+            with self.assertRaises(ValueError):
+                Fixed4(bad)
+
+        self.assertEqual(Fixed4(intval=5)/10, Fixed4(intval=1))
+        self.assertEqual(Fixed4(intval=-5)/10, Fixed4(intval=-1))
+        self.assertEqual(Fixed4(intval=-14)/10, Fixed4(intval=-1))
+        self.assertEqual(Fixed4(intval=10**21)/3,
+                         Fixed4(intval=333333333333333333333))
+        self.assertEqual(Fixed4(10**12)*Fixed4('0.0001'), Fixed4(10**8))
+        self.assertEqual(Fixed4(intval=5)*Fixed4('0.5'), Fixed4(intval=3))
+        self.assertEqual(Fixed4(intval=-5)*Fixed4('0.5'), Fixed4(intval=-3))
+        self.assertEqual(3*Money('0.3333'), Money('0.9999'))
+        self.assertEqual(1/Fixed4(3), Fixed4('0.3333'))
+        self.assertEqual(trunc(Fixed4(-5)), Fixed4(-5))
+        self.assertTrue(Fixed4(1) <= Fixed4(1))
+        self.assertTrue(Money(1) >= Money(1))
+
     def test_money(self):
         from pyrig.models.acctng.money import Money
         with self.assertRaises(TypeError):
@@ -381,6 +413,1689 @@ class TestPyRig(TestCase):
         self.assertEqual(ceil(m), Money(124))
         self.assertEqual(ceil(mneg), Money(-987))
 
+    def test_fixed4array(self):
+        from math import floor, ceil, trunc
+        from pyrig.models.acctng.fixed4 import Fixed4, Fixed4Array
+        with self.assertRaises(TypeError):
+            Fixed4Array([1], [10000])
+
+        vals = [123.456789, -987.654321, 0.00005, -0.00005, 5]
+        a = Fixed4Array(vals)
+        scalars = [Fixed4(v) for v in vals]
+        f = scalars[0]
+
+        self.assertEqual(a.intvals.tolist(),
+                         [1234568, -9876543, 1, -1, 50000])
+        self.assertEqual(len(a), 5)
+        self.assertEqual(a[0], f)
+        self.assertEqual(list(a), scalars)
+        self.assertIsInstance(a[1:], Fixed4Array)
+        self.assertEqual(Fixed4Array(['1.5', Fixed4(2)]).intvals.tolist(),
+                         [15000, 20000])
+        self.assertEqual(Fixed4Array([1, 2]).intvals.tolist(),
+                         [10000, 20000])
+        self.assertEqual(str(a[:2]), '[123.4568, -987.6543]')
+
+        def check(arr, expected):
+            out = list(arr) if isinstance(arr, Fixed4Array) else arr.tolist()
+            self.assertEqual(out, expected)
+
+        check(-a, [-x for x in scalars])
+        check(abs(a), [abs(x) for x in scalars])
+        check(a + a, [x + x for x in scalars])
+        check(a + 1, [x + 1 for x in scalars])
+        check(1 + a, [1 + x for x in scalars])
+        check(f + a, [f + x for x in scalars])
+        check(a - f, [x - f for x in scalars])
+        check(1 - a, [1 - x for x in scalars])
+        check(a*2, [x*2 for x in scalars])
+        check(2*a, [2*x for x in scalars])
+        check(a*1.5, [x*1.5 for x in scalars])
+        check(a*a, [x*x for x in scalars])
+        check(f*a, [f*x for x in scalars])
+
+        # products past int64 are computed exactly or raise, never wrap
+        from math import isqrt
+        from numpy import iinfo, int64
+        big = Fixed4Array([300000.0])
+        self.assertEqual((big*big)[0], Fixed4(90000000000))
+        edge = isqrt(iinfo(int64).max*10000)
+        top = Fixed4Array(intvals=[edge, -edge])
+        self.assertEqual((top*top).intvals.tolist(),
+                         [Fixed4(intval=edge)._mul_fixed4(
+                             Fixed4(intval=edge)).intval]*2)
+        self.assertTrue(((top*top).intvals > 0).all())
+        over = Fixed4Array(intvals=[edge + 1])
+        with self.assertRaises(OverflowError):
+            over*over
+        with self.assertRaises(OverflowError):
+            Fixed4Array(intvals=[iinfo(int64).max // 2])*3
+        with self.assertRaises(OverflowError):
+            big*1e15
+        huge = Fixed4Array([9e14])
+        with self.assertRaises(OverflowError):
+            huge + huge
+        with self.assertRaises(OverflowError):
+            huge - -huge
+        with self.assertRaises(OverflowError):
+            -huge - huge
+        with self.assertRaises(OverflowError):
+            Fixed4Array([9e14, 9e14]).cumsum()
+        self.assertEqual(Fixed4Array([9e14, 9e14]).sum(),
+                         Fixed4(intval=18*10**18))
+        self.assertEqual((huge - huge)[0], Fixed4(0))
+        self.assertEqual(list(Fixed4Array([9e14, -9e14, 9e14]).cumsum()),
+                         [Fixed4(9e14), Fixed4(0), Fixed4(9e14)])
+        check(a/3, [x/3 for x in scalars])
+        check(a/2.5, [x/2.5 for x in scalars])
+        check(a/f, [x/f for x in scalars])
+        check(a // 100, [x // 100 for x in scalars])
+        check(a // f, [x // f for x in scalars])
+        check(a % 100, [x % 100 for x in scalars])
+        check(a % scalars[1], [x % scalars[1] for x in scalars])
+        check(1000 // a[:2], [1000 // x for x in scalars[:2]])
+        check(floor(a), [floor(x) for x in scalars])
+        check(ceil(a), [ceil(x) for x in scalars])
+        check(trunc(a), [Fixed4(123), Fixed4(-987), Fixed4(), Fixed4(),
+                         Fixed4(5)])
+        for n in (-2, 0, 1, 2, 3, 4):
+            check(round(a, n), [round(x, n) for x in scalars])
+        with self.assertRaises(ValueError):
+            round(a, 5)
+
+        check(a == f, [True, False, False, False, False])
+        check(f == a, [True, False, False, False, False])
+        check(a != f, [False, True, True, True, True])
+        check(a > 0, [True, False, True, False, True])
+        check(0 < a, [True, False, True, False, True])
+        check(a <= f, [True, True, True, True, True])
+        with self.assertRaises(TypeError):
+            a > 1
+
+        self.assertEqual(a.sum(), sum(scalars, Fixed4()))
+        self.assertEqual(a.min(), scalars[1])
+        self.assertEqual(a.max(), f)
+        check(a.cumsum(), [Fixed4(intval=x) for x in
+                           (1234568, -8641975, -8641974, -8641975, -8591975)])
+
+    def test_moneyarray(self):
+        from pyrig.models.acctng.money import Money, MoneyArray
+        m = MoneyArray([1.005, 2, -3.333])
+        self.assertEqual(list(m), [Money(1.005), Money(2), Money(-3.333)])
+        self.assertEqual(str(m), '[$1.01, $2.00, $-3.33]')
+        self.assertEqual(m.sum(), Money(-0.3280))
+        self.assertEqual(list(m + 0), list(m))
+        self.assertEqual(list(Money(1) + m),
+                         [Money(2.005), Money(3), Money(-2.333)])
+        self.assertEqual(list(m*2), [Money(2.01), Money(4), Money(-6.666)])
+        self.assertEqual((m/m).tolist(), [1.0, 1.0, 1.0])
+        with self.assertRaises(TypeError):
+            m + 1
+        with self.assertRaises(TypeError):
+            m*m
+        with self.assertRaises(TypeError):
+            m < 1
+        with self.assertRaises(TypeError):
+            1/m
+
+    def test_money_dtype(self):
+        from pandas import Series, DataFrame, NA
+        from pyrig.models.acctng.fixed4 import Fixed4
+        from pyrig.models.acctng.money import Money
+
+        s = Series([1.005, 2, None, -3.3333], dtype='money')
+        self.assertEqual(str(s.dtype), 'money')
+        self.assertEqual(s[0], Money(1.005))
+        self.assertIs(s[2], NA)
+        self.assertEqual(s.sum(), Money(-0.3283))
+        self.assertEqual(s.min(), Money(-3.3333))
+        self.assertEqual(s.max(), Money(2))
+        self.assertEqual(s.cumsum().tolist(),
+                         [Money(1.005), Money(3.005), NA, Money(-0.3283)])
+        huge = Series([9e14, 9e14, None], dtype='money')
+        with self.assertRaises(OverflowError):
+            huge.sum()
+        with self.assertRaises(OverflowError):
+            huge.cumsum()
+        with self.assertRaises(OverflowError):
+            huge.groupby([1, 1, 1]).sum()
+        self.assertEqual((s*2).tolist(),
+                         [Money(2.01), Money(4), NA, Money(-6.6666)])
+        self.assertEqual((s + Money(1))[0], Money(2.005))
+        self.assertEqual((s > 0).tolist(), [True, True, NA, False])
+        self.assertEqual(str(s.astype('fixed4').dtype), 'fixed4')
+        self.assertEqual(s.astype(float)[3], -3.3333)
+        with self.assertRaises(TypeError):
+            s + 1
+
+        # int and bool scalars can be set like any other value
+        for dtype, cls in (('money', Money), ('fixed4', Fixed4)):
+            t = Series([1.5, 2, 3], dtype=dtype)
+            t.loc[0] = 5
+            t.iloc[1] = True
+            t[2] = False
+            self.assertEqual(t.tolist(), [cls(5), cls(1), cls(0)])
+            t[[0, 2]] = 7
+            t[1] = None
+            self.assertEqual(t.tolist(), [cls(7), NA, cls(7)])
+
+        df = DataFrame({'acct': [1, 2, 1, 2], 'amt': s})
+        sums = df.groupby('acct')['amt'].sum()
+        self.assertEqual(str(sums.dtype), 'money')
+        self.assertEqual(sums.tolist(), [Money(1.005), Money(-1.3333)])
+
+        merged = df.merge(DataFrame({'acct': [1, 2], 'x': ['a', 'b']}),
+                          on='acct')
+        self.assertEqual(str(merged['amt'].dtype), 'money')
+        self.assertEqual(len(s.unique()), 4)
+
+        f = Series(['1.5', '2.25'], dtype='fixed4')
+        self.assertEqual((f*f).astype(float).tolist(), [2.25, 5.0625])
+
+        # to_sql/read_sql round trip through REAL columns
+        from sqlite3 import connect
+        from pyrig.models.acctng import fixed_to_sql, read_sql_fixed
+        cxn = connect(':memory:')
+        fixed_to_sql(DataFrame({'amt': s, 'f': Series(['1.1', '-2', None,
+                                                       '0.0001'],
+                                                      dtype='fixed4')}),
+                     'amounts', cxn, index=False)
+        self.assertEqual(cxn.execute("SELECT type FROM pragma_table_info("
+                                     "'amounts')").fetchall(),
+                         [('REAL',), ('REAL',)])
+        self.assertEqual(cxn.execute("SELECT f FROM amounts").fetchall(),
+                         [(1.1,), (-2.0,), (None,), (0.0001,)])
+        back = read_sql_fixed("SELECT * FROM amounts", cxn,
+                              {'amt': 'money', 'f': 'fixed4'})
+        self.assertEqual(back['amt'].dtype, s.dtype)
+        self.assertEqual(back['amt'].tolist(), s.tolist())
+        self.assertEqual(str(back['f'][0]), '1.1000')
+        self.assertEqual(cxn.execute("SELECT ?", (Money('1.23'),)
+                                     ).fetchone(), (1.23,))
+
+    def _make_acctng_db(self):
+        from sqlite3 import connect
+        from pyrig.models.acctng.db import (
+            create_account_closure, create_accounting_tables,
+            insert_default_accounts,
+        )
+        cxn = connect(':memory:')
+        create_accounting_tables(cxn)
+        insert_default_accounts(cxn)
+        create_account_closure(cxn)
+        cxn.commit()
+        return cxn
+
+    def test_post_journal_entries(self):
+        from pandas import DataFrame
+        from pyrig.models.acctng.money import Money
+        from pyrig.models.acctng.posting import post_journal_entries
+
+        cxn = self._make_acctng_db()
+        entries = [
+            {'entry_number': 'A1', 'entry_date': '2024-01-05',
+             'description': 'rent',
+             'lines': [{'account_id': 28, 'debit_amount': Money(1000)},
+                       {'account_id': 3, 'credit_amount': '1000'}]},
+            {'entry_number': 'A2', 'entry_date': '2024-01-06',
+             'description': 'unbalanced',
+             'lines': [{'account_id': 28, 'debit_amount': 5},
+                       {'account_id': 3, 'credit_amount': 4}]},
+            {'entry_number': 'A3', 'entry_date': '2024-01-06',
+             'description': 'bad account',
+             'lines': [{'account_id': 999, 'debit_amount': 5},
+                       {'account_id': 3, 'credit_amount': 5}]},
+        ]
+        result = post_journal_entries(cxn, entries)
+        self.assertEqual(result.entry_ids, [1])
+        self.assertEqual(result.nlines, 2)
+        self.assertEqual([(f.index, f.entry_number, f.reason)
+                          for f in result.failures],
+                         [(1, 'A2', 'debits do not equal credits'),
+                          (2, 'A3', 'unknown account')])
+        self.assertEqual(cxn.execute(
+            "SELECT account_id, debit_amount, credit_amount, line_number "
+            "FROM journal_entry_lines ORDER BY id"
+        ).fetchall(), [(28, 1000, 0, 1), (3, 0, 1000, 2)])
+
+        result = post_journal_entries(cxn, entries[:1])
+        self.assertEqual(result.failures[0].reason,
+                         'entry_number already exists')
+
+        df = DataFrame({
+            'entry_number': ['B1', 'B1', 'B2', 'B2'],
+            'entry_date': '2024-02-01',
+            'description': 'bulk',
+            'account_id': [28, 3, 28, 3],
+            'debit_amount': [12.34, 0, 1, 0],
+            'credit_amount': [0, 12.34, 0, 1],
+        })
+        result = post_journal_entries(cxn, df)
+        self.assertEqual(result.entry_ids, [2, 3])
+        self.assertEqual(result.nlines, 4)
+        self.assertEqual(result.failures, [])
+
+        # rows without an entry_number cannot be grouped into entries
+        df['entry_number'] = ['C1', 'C1', None, None]
+        with self.assertRaises(ValueError):
+            post_journal_entries(cxn, df)
+        with self.assertRaises(ValueError):
+            post_journal_entries(cxn, df.drop(columns='entry_number'))
+        self.assertEqual(cxn.execute(
+            "SELECT COUNT(*) FROM journal_entries").fetchone(), (3,))
+
+    def test_post_journal_entries_concurrent(self):
+        from sqlite3 import Connection, OperationalError, connect
+        from tempfile import TemporaryDirectory
+        from pyrig.models.acctng.db import (
+            create_accounting_tables, insert_default_accounts,
+        )
+        from pyrig.models.acctng.posting import post_journal_entries
+
+        def entry(num):
+            return {'entry_number': num, 'entry_date': '2024-01-05',
+                    'description': 'race',
+                    'lines': [{'account_id': 28, 'debit_amount': 5},
+                              {'account_id': 3, 'credit_amount': 5}]}
+
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp)/'race.db'
+            other = connect(path, timeout=0)
+            other.execute("PRAGMA journal_mode = WAL")
+            create_accounting_tables(other)
+            insert_default_accounts(other)
+            other.commit()
+            raced = []
+
+            class Racing(Connection):
+                "Lets another poster in right after the ids are read."
+                def execute(self, sql, *args):
+                    cur = super().execute(sql, *args)
+                    if 'MAX(id)' in sql and not raced:
+                        try:
+                            post_journal_entries(other, [entry('B1')])
+                            raced.append('posted')
+                        except OperationalError:
+                            raced.append('locked')
+                    return cur
+
+            cxn = connect(path, factory=Racing, timeout=0)
+            result = post_journal_entries(cxn, [entry('A1'), entry('A2')])
+            self.assertEqual(raced, ['locked'])
+            self.assertEqual(result.failures, [])
+            self.assertEqual(result.entry_ids, [1, 2])
+            self.assertEqual(post_journal_entries(other, [entry('B1')]
+                                                  ).entry_ids, [3])
+            cxn.close()
+            other.close()
+
+    def test_account_balances(self):
+        from pyrig.models.acctng.balances import (
+            check_account_balances, get_trial_balance,
+            rebuild_account_balances,
+        )
+        from pyrig.models.acctng.money import Money
+        from pyrig.models.acctng.posting import (
+            post_journal_entries, unpost_journal_entries,
+        )
+
+        cxn = self._make_acctng_db()
+        cxn.executemany(
+            "INSERT INTO fiscal_periods (id, period_name, start_date, "
+            "end_date, fiscal_year) VALUES (?, ?, ?, ?, 2024)",
+            [(1, 'Jan', '2024-01-01', '2024-01-31'),
+             (2, 'Feb', '2024-02-01', '2024-02-29')],
+        )
+
+        def entry(num, date, amt):
+            return {'entry_number': num, 'entry_date': date,
+                    'description': 'rent',
+                    'lines': [{'account_id': 28, 'debit_amount': amt},
+                              {'account_id': 3, 'credit_amount': amt}]}
+
+        post_journal_entries(cxn, [entry('F1', '2024-02-03', '10.01')])
+        post_journal_entries(cxn, [entry('J1', '2024-01-03', '100'),
+                                   entry('X1', '2023-06-01', '7')])
+        rows = cxn.execute(
+            "SELECT account_id, fiscal_period_id, opening_balance, "
+            "debit_total, credit_total, closing_balance "
+            "FROM account_balances ORDER BY account_id, fiscal_period_id"
+        ).fetchall()
+        self.assertEqual(rows, [(3, 1, 0, 0, 100, -100),
+                                (3, 2, -100, 0, 10.01, -110.01),
+                                (28, 1, 0, 100, 0, 100),
+                                (28, 2, 100, 10.01, 0, 110.01)])
+        self.assertTrue(check_account_balances(cxn).empty)
+
+        tb = get_trial_balance(cxn, 2)
+        self.assertEqual(tb['account_id'].tolist(), [3, 28])
+        self.assertEqual(tb['debit'].tolist(), [Money(0), Money('110.01')])
+        self.assertEqual(tb['credit'].tolist(), [Money('110.01'), Money(0)])
+
+        self.assertEqual(unpost_journal_entries(cxn, [2, 2]), 1)
+        self.assertEqual(unpost_journal_entries(cxn, [2]), 0)
+        self.assertEqual(cxn.execute(
+            "SELECT closing_balance FROM account_balances "
+            "WHERE account_id = 28 AND fiscal_period_id = 2"
+        ).fetchone()[0], 10.01)
+        self.assertTrue(check_account_balances(cxn).empty)
+
+        cxn.execute("UPDATE account_balances SET closing_balance = 0")
+        self.assertEqual(len(check_account_balances(cxn)), 2)
+        rebuild_account_balances(cxn)
+        self.assertTrue(check_account_balances(cxn).empty)
+
+    def test_account_rollup(self):
+        from sqlite3 import IntegrityError
+        from pyrig.models.acctng.balances import (
+            get_account_rollup, get_subtree_account_ids,
+        )
+        from pyrig.models.acctng.money import Money
+        from pyrig.models.acctng.posting import post_journal_entries
+
+        cxn = self._make_acctng_db()
+        self.assertEqual(get_subtree_account_ids(cxn, 1),
+                         [1, 2, 7, 3, 4, 5, 6, 8, 9])
+        cxn.execute("INSERT INTO fiscal_periods (id, period_name, "
+                    "start_date, end_date, fiscal_year) "
+                    "VALUES (1, 'Jan', '2024-01-01', '2024-01-31', 2024)")
+        cxn.execute("INSERT INTO accounts (id, code, name, account_type, "
+                    "parent_account_id) VALUES (40, '1105', 'Petty Cash', "
+                    "'ASSET', 2)")
+        post_journal_entries(cxn, [{
+            'entry_number': 'R1', 'entry_date': '2024-01-03',
+            'description': 'rent',
+            'lines': [{'account_id': 28, 'debit_amount': 100},
+                      {'account_id': 3, 'credit_amount': 60},
+                      {'account_id': 40, 'credit_amount': 40}],
+        }])
+
+        rollup = get_account_rollup(cxn, 1).set_index('account_id')
+        closing = rollup['closing_balance']
+        self.assertEqual(closing[1], Money(-100))
+        self.assertEqual(closing[2], Money(-100))
+        self.assertEqual(closing[7], Money(0))
+        self.assertEqual(closing[24], Money(100))
+        self.assertEqual(rollup.loc[24, 'debit_total'], Money(100))
+
+        # move petty cash under non-current assets with its balance
+        cxn.execute("UPDATE accounts SET parent_account_id = 7 "
+                    "WHERE id = 40")
+        closing = get_account_rollup(cxn, 1).set_index('account_id')[
+            'closing_balance']
+        self.assertEqual(closing[2], Money(-60))
+        self.assertEqual(closing[7], Money(-40))
+        self.assertEqual(closing[1], Money(-100))
+        self.assertEqual(cxn.execute(
+            "SELECT ancestor_id, depth FROM account_closure "
+            "WHERE descendant_id = 40 ORDER BY depth"
+        ).fetchall(), [(40, 0), (7, 1), (1, 2)])
+
+        with self.assertRaises(IntegrityError):
+            cxn.execute("UPDATE accounts SET parent_account_id = 40 "
+                        "WHERE id = 7")
+
+    def test_close_fiscal_period(self):
+        from sqlite3 import connect
+        from tempfile import TemporaryDirectory
+        from pyrig.models.acctng.balances import (
+            check_account_balances, get_account_balances,
+            rebuild_account_balances,
+        )
+        from pyrig.models.acctng.periods import close_fiscal_period
+        from pyrig.models.acctng.posting import (
+            post_journal_entries, unpost_journal_entries,
+        )
+
+        cxn = self._make_acctng_db()
+        cxn.executemany(
+            "INSERT INTO fiscal_periods (id, period_name, start_date, "
+            "end_date, fiscal_year) VALUES (?, ?, ?, ?, 2024)",
+            [(1, 'Jan', '2024-01-01', '2024-01-31'),
+             (2, 'Feb', '2024-02-01', '2024-02-29'),
+             (3, 'Mar', '2024-03-01', '2024-03-31')],
+        )
+
+        def entry(num, date, amt):
+            return {'entry_number': num, 'entry_date': date,
+                    'description': 'rent',
+                    'lines': [{'account_id': 28, 'debit_amount': amt},
+                              {'account_id': 3, 'credit_amount': amt}]}
+
+        post_journal_entries(cxn, [entry('J1', '2024-01-03', 100),
+                                   entry('M1', '2024-03-03', 5)])
+        with self.assertRaises(ValueError):
+            close_fiscal_period(cxn, 2)
+
+        # unposted entries block the close rather than being archived
+        draft = post_journal_entries(cxn, [entry('D1', '2024-01-20', 7)],
+                                     posted=False).entry_ids
+        with self.assertRaisesRegex(ValueError, 'unposted.*D1'):
+            close_fiscal_period(cxn, 1, archive=True)
+        cxn.execute("DELETE FROM journal_entry_lines "
+                    "WHERE journal_entry_id = ?", draft)
+        cxn.execute("DELETE FROM journal_entries WHERE id = ?", draft)
+        cxn.commit()
+
+        with TemporaryDirectory() as tmp:
+            archive = f'{tmp}/archive.db'
+            self.assertEqual(close_fiscal_period(cxn, 1, True, archive), 2)
+            acxn = connect(archive)
+            self.assertEqual(acxn.execute(
+                "SELECT COUNT(*) FROM journal_entry_lines_archive "
+                "WHERE fiscal_period_id = 1"
+            ).fetchone()[0], 2)
+            acxn.close()
+
+        self.assertEqual(cxn.execute(
+            "SELECT COUNT(*) FROM journal_entry_lines").fetchone()[0], 2)
+        self.assertEqual(cxn.execute(
+            "SELECT account_id, opening_balance, closing_balance "
+            "FROM account_balances WHERE fiscal_period_id = 2 "
+            "ORDER BY account_id"
+        ).fetchall(), [(3, -100, -100), (28, 100, 100)])
+
+        result = post_journal_entries(cxn, [entry('J2', '2024-01-09', 1),
+                                            entry('F1', '2024-02-09', 1)])
+        self.assertEqual([f.reason for f in result.failures],
+                         ['fiscal period is closed'])
+        with self.assertRaises(ValueError):
+            unpost_journal_entries(cxn, [1])
+
+        rebuild_account_balances(cxn)
+        self.assertTrue(check_account_balances(cxn).empty)
+        bal = get_account_balances(cxn, 3).set_index('account_id')
+        self.assertEqual(bal.loc[28, 'closing_balance'], 1060000)
+        self.assertEqual(bal.loc[28, 'opening_balance'], 1010000)
+
+        close_fiscal_period(cxn, 2, archive=True)
+        close_fiscal_period(cxn, 3)
+        self.assertEqual(cxn.execute(
+            "SELECT COUNT(*) FROM journal_entry_lines_archive"
+        ).fetchone()[0], 2)
+        bal = get_account_balances(cxn, 3).set_index('account_id')
+        self.assertEqual(bal.loc[3, 'closing_balance'], -1060000)
+
+    def test_balances_with_archive_db(self):
+        from tempfile import TemporaryDirectory
+        from pyrig.models.acctng.periods import (
+            close_fiscal_period, get_archive_dbs,
+        )
+        from pyrig.models.acctng.posting import post_journal_entries
+        from pyrig.models.acctng.reports import get_balances_as_of
+
+        cxn = self._make_acctng_db()
+        cxn.executemany(
+            "INSERT INTO fiscal_periods (id, period_name, start_date, "
+            "end_date, fiscal_year) VALUES (?, ?, ?, ?, 2024)",
+            [(1, 'Jan', '2024-01-01', '2024-01-31'),
+             (2, 'Feb', '2024-02-01', '2024-02-29')],
+        )
+        cxn.commit()
+
+        def entry(num, date, amt):
+            return {'entry_number': num, 'entry_date': date,
+                    'description': num,
+                    'lines': [{'account_id': 3, 'debit_amount': amt},
+                              {'account_id': 21, 'credit_amount': amt}]}
+
+        post_journal_entries(cxn, [entry('D1', '2023-12-15', 7),
+                                   entry('J1', '2024-01-10', 100),
+                                   entry('J2', '2024-01-20', 20),
+                                   entry('F1', '2024-02-05', 1)])
+        expected = {'2023-12-31': 7, '2024-01-15': 107, '2024-01-31': 127,
+                    '2024-02-10': 128}
+
+        def cash(as_of):
+            return get_balances_as_of(cxn, as_of).get(3, 0)//10000
+
+        self.assertEqual({d: cash(d) for d in expected}, expected)
+        with TemporaryDirectory() as tmp:
+            archive = Path(tmp)/'archive.db'
+            self.assertEqual(close_fiscal_period(cxn, 1, True, archive), 4)
+            self.assertEqual(get_archive_dbs(cxn), [str(archive.resolve())])
+            # mid-period balances read the lines back from the archive file
+            self.assertEqual({d: cash(d) for d in expected}, expected)
+            self.assertEqual(
+                [r[1] for r in cxn.execute("PRAGMA database_list")],
+                ['main'])
+
+    def test_reports(self):
+        from csv import reader
+        from tempfile import TemporaryDirectory
+        from pyrig.models.acctng.money import Money
+        from pyrig.models.acctng.periods import close_fiscal_period
+        from pyrig.models.acctng.posting import post_journal_entries
+        from pyrig.models.acctng.reports import (
+            export_report, iter_balance_sheet, iter_income_statement,
+            iter_trial_balance,
+        )
+
+        cxn = self._make_acctng_db()
+        cxn.executemany(
+            "INSERT INTO fiscal_periods (id, period_name, start_date, "
+            "end_date, fiscal_year) VALUES (?, ?, ?, ?, 2024)",
+            [(1, 'Jan', '2024-01-01', '2024-01-31'),
+             (2, 'Feb', '2024-02-01', '2024-02-29')],
+        )
+
+        def entry(num, date, debit, credit, amt):
+            return {'entry_number': num, 'entry_date': date,
+                    'description': num,
+                    'lines': [{'account_id': debit, 'debit_amount': amt},
+                              {'account_id': credit, 'credit_amount': amt}]}
+
+        post_journal_entries(cxn, [
+            entry('C1', '2024-01-02', 3, 19, 1000),  # owner capital
+            entry('S1', '2024-01-10', 3, 21, 300),   # sales
+            entry('R1', '2024-02-05', 28, 3, 100),   # rent
+            entry('S2', '2024-02-20', 3, 21, 50),
+        ])
+        close_fiscal_period(cxn, 1, archive=True)
+
+        tb = list(iter_trial_balance(cxn, '2024-02-10'))
+        self.assertEqual([(r.code, r.debit, r.credit) for r in tb],
+                         [('1101', Money(1200), Money(0)),
+                          ('3102', Money(0), Money(1000)),
+                          ('4101', Money(0), Money(300)),
+                          ('5103', Money(100), Money(0)),
+                          (None, Money(1300), Money(1300))])
+
+        pnl = {r.name: r.amount for r in
+               iter_income_statement(cxn, fiscal_period_id=2)}
+        self.assertEqual(pnl['Total Revenue'], Money(50))
+        self.assertEqual(pnl['Total Expense'], Money(100))
+        self.assertEqual(pnl['Net Income'], Money(-50))
+        pnl = {r.name: r.amount for r in
+               iter_income_statement(cxn, '2024-01-05', '2024-02-10')}
+        self.assertEqual(pnl['Net Income'], Money(200))
+        self.assertEqual(pnl['Sales Revenue'], Money(300))
+
+        bs = {r.name: r for r in iter_balance_sheet(cxn, fiscal_period_id=2)}
+        self.assertEqual(bs['ASSETS'].amount, Money(1250))
+        self.assertEqual(bs['Cash and Cash Equivalents'].depth, 2)
+        self.assertEqual(bs['Current Earnings'].amount, Money(250))
+        self.assertEqual(bs['Total Liabilities and Equity'].amount,
+                         bs['Total Asset'].amount)
+
+        with TemporaryDirectory() as tmp:
+            path = f'{tmp}/tb.csv'
+            self.assertEqual(export_report(iter(tb), path, chunksize=2), 5)
+            with open(path, newline='') as f:
+                rows = list(reader(f))
+        self.assertEqual(rows[0], list(tb[0]._fields))
+        self.assertEqual(rows[1][4:], ['1200.0000', '0.0000'])
+        self.assertEqual(len(rows), 6)
+
+    def test_pyrig_connection_pool(self):
+        from tempfile import TemporaryDirectory
+        from threading import Thread
+        from pyrig.models.db.connection import (
+            close_pyrig_connections, get_pyrig_connection, pyrig_db,
+        )
+
+        with TemporaryDirectory() as tmp:
+            path = f'{tmp}/pool.db'
+            cxn = get_pyrig_connection(path)
+            self.assertIs(get_pyrig_connection(path), cxn)
+            self.assertEqual(cxn.execute("PRAGMA journal_mode").fetchone(),
+                             ('wal',))
+            self.assertEqual(cxn.execute("PRAGMA foreign_keys").fetchone(),
+                             (1,))
+            self.assertEqual(cxn.execute("PRAGMA synchronous").fetchone(),
+                             (1,))
+
+            with pyrig_db(path) as db:
+                db.execute("CREATE TABLE t (x INTEGER)")
+                db.execute("INSERT INTO t VALUES (1)")
+
+            seen = []
+
+            def worker():
+                other = get_pyrig_connection(path)
+                seen.append((other is cxn, other.execute(
+                    "SELECT x FROM t").fetchall()))
+
+            thread = Thread(target=worker)
+            thread.start()
+            thread.join()
+            self.assertEqual(seen, [(False, [(1,)])])
+
+            # connections of exited threads are closed, not leaked
+            from gc import collect
+            from sqlite3 import ProgrammingError
+            from pyrig.models.db import connection
+            leaked = []
+            thread = Thread(target=lambda: leaked.append(
+                get_pyrig_connection(path)))
+            thread.start()
+            thread.join()
+            collect()
+            self.assertNotIn(leaked[0], connection._open)
+            with self.assertRaises(ProgrammingError):
+                leaked[0].execute("SELECT 1")
+            self.assertIn(cxn, connection._open)
+
+            close_pyrig_connections()
+            self.assertIsNot(get_pyrig_connection(path), cxn)
+            close_pyrig_connections()
+
+    def test_schema_user_version(self):
+        from sqlite3 import connect
+        from pyrig.models.db.migrations import (
+            PACKAGE_SCHEMA_VERSION, check_schema_version, get_user_version,
+            init_pyrig_db, set_user_version,
+        )
+
+        cxn = connect(':memory:')
+        init_pyrig_db(cxn)
+        self.assertEqual(get_user_version(cxn), 0)
+        check_schema_version(cxn)
+        self.assertEqual(get_user_version(cxn), PACKAGE_SCHEMA_VERSION)
+
+        # databases migrated before user_version was kept get it synced
+        set_user_version(cxn, 0)
+        check_schema_version(cxn)
+        self.assertEqual(get_user_version(cxn), PACKAGE_SCHEMA_VERSION)
+
+    def test_check_pyrig_db_dry_run(self):
+        from tempfile import TemporaryDirectory
+        from pyrig.models import db
+        from pyrig.models.db import (
+            check_pyrig_db, close_pyrig_connections, get_pyrig_connection,
+        )
+        from pyrig.models.db.migrations import PACKAGE_SCHEMA_VERSION
+
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp)/'pyrig.db'
+            with db.pyrig_db(path) as cxn:
+                cxn.execute("CREATE TABLE t (x INTEGER)")
+            close_pyrig_connections()
+            before = path.read_bytes()
+
+            with mock.patch.object(db, 'get_pyrig_db_path',
+                                   return_value=path):
+                # initializing and migrating only touch an in-memory copy
+                check_pyrig_db(create_if_missing=True, dry_run=True)
+                self.assertEqual(path.read_bytes(), before)
+
+                check_pyrig_db(create_if_missing=True)
+                cxn = get_pyrig_connection(path)
+                self.assertEqual(cxn.execute("PRAGMA user_version").fetchone(),
+                                 (PACKAGE_SCHEMA_VERSION,))
+                close_pyrig_connections()
+
+            # a missing database is not created by a dry run
+            missing = Path(tmp)/'missing.db'
+            with mock.patch.object(db, 'get_pyrig_db_path',
+                                   return_value=missing):
+                check_pyrig_db(create_if_missing=True, dry_run=True)
+            self.assertFalse(missing.exists())
+
+    def test_migration_runner(self):
+        from sqlite3 import connect
+        from types import SimpleNamespace
+        from pyrig.models.db.migrations import (
+            PACKAGE_SCHEMA_VERSION, _apply_chunked, dry_run_migrations,
+            get_current_schema_version, get_migration_checkpoint,
+            init_pyrig_db,
+        )
+
+        cxn = connect(':memory:')
+        init_pyrig_db(cxn)
+        timings = dry_run_migrations(cxn)
+        self.assertEqual([t.version for t in timings],
+                         list(range(1, PACKAGE_SCHEMA_VERSION + 1)))
+        self.assertEqual(get_current_schema_version(cxn), 0)
+        self.assertNotIn('accounts', [r[0] for r in cxn.execute(
+            "SELECT name FROM sqlite_master")])
+
+        # chunked migration that dies after its second chunk, then resumes
+        calls = []
+
+        def migrate(cxn):
+            cxn.execute("CREATE TABLE nums (n INTEGER)")
+
+        def migrate_chunk(cxn, checkpoint):
+            start = checkpoint or 0
+            if start == 20 and not calls:
+                calls.append(start)
+                raise RuntimeError('interrupted')
+            cxn.executemany("INSERT INTO nums VALUES (?)",
+                            [(n,) for n in range(start, start + 10)])
+            return start + 10 if start < 30 else None
+
+        module = SimpleNamespace(migrate=migrate, migrate_chunk=migrate_chunk)
+        with self.assertRaises(RuntimeError):
+            _apply_chunked(cxn, 9, module)
+        self.assertEqual(get_migration_checkpoint(cxn, 9), (True, 20))
+        self.assertEqual(cxn.execute("SELECT COUNT(*) FROM nums").fetchone(),
+                         (20,))
+
+        self.assertEqual(_apply_chunked(cxn, 9, module), 2)
+        self.assertEqual(get_migration_checkpoint(cxn, 9), (False, None))
+        self.assertEqual(get_current_schema_version(cxn), 9)
+        self.assertEqual(cxn.execute(
+            "SELECT COUNT(DISTINCT n) FROM nums").fetchone(), (40,))
+
+    def test_ynab_client(self):
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from json import dumps
+        from threading import Thread
+        from pyrig.models.ynab.comm import YnabClient, YnabRateLimitError
+
+        script = [(503, {}), (429, {'Retry-After': '2'}),
+                  (200, {'X-Rate-Limit': '7/10'})]
+        seen = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                seen.append((self.path, self.headers['Authorization']))
+                status, headers = script.pop(0) if script else (200, {})
+                body = dumps({'data': {'path': self.path}}).encode()
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            base = f'http://127.0.0.1:{server.server_port}/v1'
+            with YnabClient('tok', base, backoff=0.25) as client:
+                delays = []
+                client._sleep = delays.append
+                self.assertEqual(client.get('budgets'),
+                                 {'path': '/v1/budgets'})
+                self.assertEqual(delays, [0.25, 2.0])
+                self.assertEqual(seen, [('/v1/budgets', 'Bearer tok')]*3)
+                self.assertEqual(client.remaining, 3)
+
+                for _ in range(3):
+                    client.get('user')
+                self.assertEqual(client.remaining, 0)
+                with self.assertRaises(YnabRateLimitError):
+                    client.get('user')
+                self.assertEqual(len(seen), 6)
+
+            # a POST is resent after 429 but never after a 5xx
+            from requests import HTTPError
+            script[:] = [(429, {}), (503, {})]
+            with YnabClient('tok', base, backoff=0.25) as client:
+                delays = []
+                client._sleep = delays.append
+                with self.assertRaises(HTTPError):
+                    client.request('POST', 'budgets/b1/transactions')
+                self.assertEqual(delays, [0.25])
+                self.assertEqual(len(seen), 8)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # a malformed Retry-After falls back to the default backoff
+        from types import SimpleNamespace
+        with YnabClient('tok', 'http://127.0.0.1:1/v1',
+                        backoff=0.25) as client:
+            for header in ('soon', 'Fri, 99 Foo 2024 25:00:00', 'nan', '-1'):
+                response = SimpleNamespace(headers={'Retry-After': header})
+                self.assertEqual(client._retry_delay(1, response), 0.5)
+
+            # a POST is retried when it could not connect, but not after a
+            # read timeout since the server may have applied it
+            from requests.exceptions import ConnectionError, ReadTimeout
+            delays = []
+            client._sleep = delays.append
+            client.max_retries = 2
+            with self.assertRaises(ConnectionError):
+                client.request('POST', 'budgets/b1/transactions')
+            self.assertEqual(delays, [0.25, 0.5])
+
+            def timeout(*args, **kwargs):
+                calls.append(args[0])
+                raise ReadTimeout('read timed out')
+            calls = []
+            client.session.request = timeout
+            with self.assertRaises(ReadTimeout):
+                client.request('POST', 'budgets/b1/transactions')
+            self.assertEqual(calls, ['POST'])
+            with self.assertRaises(ReadTimeout):
+                client.request('GET', 'budgets')
+            self.assertEqual(calls, ['POST'] + ['GET']*3)
+
+    def test_ynab_delta_sync(self):
+        from sqlite3 import connect
+        from pyrig.models.ynab.db import create_ynab_tables
+        from pyrig.models.ynab.sync import get_server_knowledge, sync_budget
+
+        responses = {
+            None: {'transactions': [
+                {'id': 't1', 'date': '2024-01-02', 'amount': -12340,
+                 'approved': True, 'deleted': False},
+                {'id': 't2', 'date': '2024-01-03', 'amount': 5000},
+            ], 'payees': [{'id': 'p1', 'name': 'Shop'}],
+                'server_knowledge': 10},
+            10: {'transactions': [
+                {'id': 't1', 'date': '2024-01-02', 'amount': -20000},
+                {'id': 't2', 'deleted': True},
+            ], 'payees': [], 'server_knowledge': 12},
+        }
+        calls = []
+        test = self
+
+        class FakeClient:
+            def get(self, path, params=None, use_cache=True):
+                test.assertFalse(use_cache)
+                calls.append((path, params))
+                return responses[(params or {}).get(
+                    'last_knowledge_of_server'
+                )]
+
+        cxn = connect(':memory:')
+        create_ynab_tables(cxn)
+        endpoints = ('transactions', 'payees')
+        self.assertEqual(sync_budget(cxn, 'b1', FakeClient(), endpoints),
+                         {'transactions': 2, 'payees': 1})
+        self.assertEqual(sync_budget(cxn, 'b1', FakeClient(), endpoints),
+                         {'transactions': 2, 'payees': 0})
+        self.assertEqual(calls[2], ('budgets/b1/transactions',
+                                    {'last_knowledge_of_server': 10}))
+        self.assertEqual(get_server_knowledge(cxn, 'b1', 'transactions'), 12)
+        self.assertEqual(cxn.execute(
+            "SELECT id, amount, approved, deleted FROM ynab_transactions "
+            "ORDER BY id"
+        ).fetchall(), [('t1', -20000, None, 0), ('t2', None, None, 1)])
+
+    def test_ynab_concurrent_sync(self):
+        from sqlite3 import connect
+        from threading import Lock
+        from time import sleep
+        from pyrig.models.ynab.db import create_ynab_tables
+        from pyrig.models.ynab.sync import sync_budgets_concurrent
+
+        lock = Lock()
+        active = [0, 0]
+
+        class FakeClient:
+            remaining = 5
+
+            def get(self, path, params=None, use_cache=True):
+                if use_cache:
+                    raise RuntimeError('sync read the response cache')
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active)
+                sleep(0.05)
+                with lock:
+                    active[0] -= 1
+                if path == 'budgets/b2/payees':
+                    raise RuntimeError('boom')
+                budget = path.split('/')[1]
+                return {'payees': [{'id': f'{budget}-p', 'name': path}],
+                        'accounts': [{'id': f'{budget}-a'}],
+                        'server_knowledge': 3}
+
+        cxn = connect(':memory:')
+        create_ynab_tables(cxn)
+        result = sync_budgets_concurrent(
+            cxn, ['b1', 'b2', 'b3'], FakeClient(), ('accounts', 'payees'),
+        )
+        self.assertGreater(active[1], 1)
+        self.assertEqual(sorted(result.counts), [
+            ('b1', 'accounts'), ('b1', 'payees'), ('b2', 'accounts'),
+            ('b3', 'accounts'),
+        ])
+        self.assertEqual(sorted(result.failures), [('b2', 'payees'),
+                                                   ('b3', 'payees')])
+        self.assertEqual(cxn.execute(
+            "SELECT COUNT(*) FROM ynab_sync_state").fetchone(), (4,))
+
+    def test_ynab_streaming_sync(self):
+        from json import dumps
+        from sqlite3 import connect
+        from pyrig.models.acctng.money import Money
+        from pyrig.models.ynab.db import create_ynab_tables
+        from pyrig.models.ynab.stream import JsonArrayStream
+        from pyrig.models.ynab.sync import sync_endpoint_streaming
+
+        body = dumps({'data': {'transactions': [
+            {'id': f't{i}', 'amount': -1234*i, 'memo': 'café ☕',
+             'subtransactions': [{'amount': 10}]}
+            for i in range(50)
+        ], 'server_knowledge': 77}}).encode()
+        chunks = [body[i:i + 7] for i in range(0, len(body), 7)]
+
+        items = list(JsonArrayStream(chunks, ('data', 'transactions')))
+        self.assertEqual(len(items), 50)
+        self.assertEqual(items[3]['memo'], 'café ☕')
+
+        class FakeClient:
+            def stream(self, path, key, params=None):
+                return JsonArrayStream(iter(chunks), ('data', key))
+
+        cxn = connect(':memory:')
+        create_ynab_tables(cxn)
+        self.assertEqual(sync_endpoint_streaming(
+            cxn, 'b1', client=FakeClient(), batch_size=8
+        ), 50)
+        self.assertEqual(cxn.execute(
+            "SELECT amount FROM ynab_transactions WHERE id = 't2'"
+        ).fetchone(), (-2468,))
+        self.assertEqual(cxn.execute(
+            "SELECT server_knowledge FROM ynab_sync_state"
+        ).fetchone(), (77,))
+
+        from pyrig.models.ynab.stream import convert_milliunits
+        t = convert_milliunits(items[1])
+        self.assertEqual(t['amount'], Money('-1.234'))
+        self.assertEqual(t['subtransactions'][0]['amount'], Money('0.01'))
+
+    def test_ynab_ledger_import(self):
+        from pyrig.models.acctng.balances import check_account_balances
+        from pyrig.models.acctng.money import Money
+        from pyrig.models.ynab.db import create_ynab_ledger_map
+        from pyrig.models.ynab.ledger import (
+            import_ynab_transactions, set_account_map,
+        )
+
+        cxn = self._make_acctng_db()
+        create_ynab_ledger_map(cxn)
+        cxn.execute("INSERT INTO fiscal_periods (id, period_name, "
+                    "start_date, end_date, fiscal_year) "
+                    "VALUES (1, 'Jan', '2024-01-01', '2024-01-31', 2024)")
+        set_account_map(cxn, 'b1', 'account', {'chk': 3, 'card': 13})
+        set_account_map(cxn, 'b1', 'category', {'rent': 28, 'util': 29})
+        set_account_map(cxn, 'b1', 'payee', {'acme': 21})
+        with self.assertRaises(ValueError):
+            set_account_map(cxn, 'b1', 'group', {})
+
+        transactions = [
+            {'id': 't1', 'date': '2024-01-02', 'account_id': 'chk',
+             'payee_name': 'Landlord', 'amount': -1500000,
+             'category_id': 'rent'},
+            {'id': 't2', 'date': '2024-01-03', 'account_id': 'chk',
+             'amount': Money('-120.5'), 'subtransactions': [
+                 {'amount': Money('-100'), 'category_id': 'rent'},
+                 {'amount': Money('-20.5'), 'category_id': 'util'},
+             ]},
+            {'id': 't3', 'date': '2024-01-04', 'account_id': 'chk',
+             'amount': 250000, 'payee_id': 'acme'},
+            # both sides of a card payment, only the outflow is imported
+            {'id': 't4', 'date': '2024-01-05', 'account_id': 'chk',
+             'amount': -40000, 'transfer_account_id': 'card'},
+            {'id': 't5', 'date': '2024-01-05', 'account_id': 'card',
+             'amount': 40000, 'transfer_account_id': 'chk'},
+            {'id': 't6', 'date': '2024-01-06', 'account_id': 'chk',
+             'amount': -1000, 'category_id': 'unknown'},
+            {'id': 't7', 'date': '2024-01-06', 'account_id': 'chk',
+             'amount': -1000, 'deleted': True},
+            {'id': 't8', 'date': '2024-01-07', 'account_id': 'chk',
+             'amount': 0, 'category_id': 'rent'},
+        ]
+        result = import_ynab_transactions(cxn, 'b1', transactions,
+                                          batch_size=4)
+        self.assertEqual(len(result.entry_ids), 4)
+        self.assertEqual(result.nlines, 9)
+        self.assertEqual(result.failures, [('t6', 'no ledger account for '
+                                                  'category, payee or '
+                                                  'transfer')])
+        self.assertEqual(result.skipped, [('t8', 'zero amount')])
+        self.assertEqual(cxn.execute(
+            "SELECT reference, description FROM journal_entries ORDER BY id"
+        ).fetchall(), [('t1', 'Landlord'), ('t2', 'YNAB transaction'),
+                       ('t3', 'YNAB transaction'),
+                       ('t4', 'YNAB transaction')])
+        self.assertEqual(dict(cxn.execute(
+            "SELECT account_id, SUM(debit_amount - credit_amount) "
+            "FROM journal_entry_lines GROUP BY account_id"
+        )), {3: -1410.5, 13: 40, 21: -250, 28: 1600, 29: 20.5})
+        self.assertTrue(check_account_balances(cxn).empty)
+
+        again = import_ynab_transactions(cxn, 'b1', transactions)
+        self.assertEqual(again.entry_ids, [])
+        self.assertEqual(again.skipped, [(t, 'already imported')
+                                         for t in ('t1', 't2', 't3', 't4')]
+                         + [('t8', 'zero amount')])
+
+        # a transaction changed to zero has its entry removed
+        transactions[2] = {**transactions[2], 'amount': 0}
+        again = import_ynab_transactions(cxn, 'b1', transactions)
+        self.assertEqual(again.removed, ['t3'])
+        self.assertEqual([r for (r,) in cxn.execute(
+            "SELECT reference FROM journal_entries ORDER BY id"
+        )], ['t1', 't2', 't4'])
+        self.assertTrue(check_account_balances(cxn).empty)
+
+    def test_ynab_ledger_transfers_and_changes(self):
+        from pyrig.models.acctng.balances import check_account_balances
+        from pyrig.models.ynab.db import create_ynab_ledger_map
+        from pyrig.models.ynab.ledger import (
+            import_ynab_transactions, set_account_map,
+        )
+
+        cxn = self._make_acctng_db()
+        create_ynab_ledger_map(cxn)
+        cxn.execute("INSERT INTO fiscal_periods (id, period_name, "
+                    "start_date, end_date, fiscal_year) "
+                    "VALUES (1, 'Jan', '2024-01-01', '2024-01-31', 2024)")
+        set_account_map(cxn, 'b1', 'account', {'chk': 3, 'card': 13})
+        set_account_map(cxn, 'b1', 'category', {'rent': 28, 'util': 29})
+
+        def sums(where=''):
+            return dict(cxn.execute(
+                "SELECT account_id, SUM(debit_amount - credit_amount) "
+                "FROM journal_entry_lines l JOIN journal_entries je "
+                f"ON je.id = l.journal_entry_id {where} GROUP BY account_id"
+            ))
+
+        transactions = [
+            # a split paying part to the card: its counterpart is not booked
+            {'id': 's1', 'date': '2024-01-10', 'account_id': 'chk',
+             'amount': -150000, 'subtransactions': [
+                 {'id': 's1a', 'amount': -100000, 'category_id': 'rent'},
+                 {'id': 's1b', 'amount': -50000,
+                  'transfer_account_id': 'card',
+                  'transfer_transaction_id': 'c1'},
+             ]},
+            {'id': 'c1', 'date': '2024-01-10', 'account_id': 'card',
+             'amount': 50000, 'transfer_account_id': 'chk',
+             'transfer_transaction_id': 's1b'},
+            # a plain transfer, paired by id rather than sign
+            {'id': 'w1', 'date': '2024-01-11', 'account_id': 'card',
+             'amount': 30000, 'transfer_account_id': 'chk',
+             'transfer_transaction_id': 'w2'},
+            {'id': 'w2', 'date': '2024-01-11', 'account_id': 'chk',
+             'amount': -30000, 'transfer_account_id': 'card',
+             'transfer_transaction_id': 'w1'},
+            {'id': 'r1', 'date': '2024-01-12', 'account_id': 'chk',
+             'amount': -10000, 'category_id': 'rent'},
+            {'id': 'r2', 'date': '2024-01-12', 'account_id': 'chk',
+             'amount': -5000, 'category_id': 'util'},
+        ]
+        result = import_ynab_transactions(cxn, 'b1', transactions)
+        self.assertEqual(result.failures, [])
+        self.assertEqual([r for (r,) in cxn.execute(
+            "SELECT reference FROM journal_entries ORDER BY id"
+        )], ['s1', 'w1', 'r1', 'r2'])
+        self.assertEqual(sums("WHERE je.reference = 's1'"),
+                         {3: -150, 13: 50, 28: 100})
+        self.assertEqual(sums(), {3: -195, 13: 80, 28: 110, 29: 5})
+        self.assertTrue(check_account_balances(cxn).empty)
+
+        # the other sides alone (e.g. a delta sync) are still duplicates
+        alone = import_ynab_transactions(cxn, 'b1', transactions[1:4:2])
+        self.assertEqual((alone.entry_ids, alone.removed), ([], []))
+
+        transactions[4] = {**transactions[4], 'amount': -12000}
+        transactions[5] = {**transactions[5], 'deleted': True}
+        again = import_ynab_transactions(cxn, 'b1', transactions)
+        self.assertEqual(sorted(again.removed), ['r1', 'r2'])
+        self.assertEqual(again.skipped, [('s1', 'already imported'),
+                                         ('w1', 'already imported')])
+        self.assertEqual(len(again.entry_ids), 1)
+        self.assertEqual(sums(), {3: -192, 13: 80, 28: 112})
+        self.assertTrue(check_account_balances(cxn).empty)
+
+        # a replacement that cannot be posted keeps the entry it replaces
+        cxn.execute("INSERT INTO fiscal_periods (id, period_name, "
+                    "start_date, end_date, fiscal_year, is_closed) "
+                    "VALUES (2, 'Dec', '2023-12-01', '2023-12-31', 2023, 1)")
+        transactions[4] = {**transactions[4], 'date': '2023-12-15'}
+        moved = import_ynab_transactions(cxn, 'b1', transactions)
+        self.assertEqual(moved.failures, [('r1', 'fiscal period is closed')])
+        self.assertEqual((moved.entry_ids, moved.removed), ([], []))
+        self.assertEqual(sums(), {3: -192, 13: 80, 28: 112})
+        self.assertTrue(check_account_balances(cxn).empty)
+
+    def test_ynab_response_cache(self):
+        from tempfile import TemporaryDirectory
+        from pyrig.models.ynab.cache import ResponseCache
+        from pyrig.models.ynab.comm import YnabClient
+
+        sent = []
+
+        class Response:
+            def __init__(self, status, data=None, etag=None):
+                self.status_code = status
+                self.headers = {'ETag': etag} if etag else {}
+                self._data = data
+
+            def json(self):
+                return {'data': self._data}
+
+        def request(method, path, **kwargs):
+            sent.append((method, path, kwargs.get('headers')))
+            if (kwargs.get('headers') or {}).get('If-None-Match') == '"v1"':
+                return Response(304)
+            return Response(200, {'path': path, 'n': len(sent)}, '"v1"')
+
+        with TemporaryDirectory() as tmp:
+            cache = ResponseCache(f'{tmp}/cache.db', max_bytes=100)
+            client = YnabClient('tok', cache=cache)
+            client.request = request
+
+            self.assertEqual(client.get('budgets/b1/payees')['n'], 1)
+            self.assertEqual(client.get('budgets/b1/payees')['n'], 1)
+            client.get('budgets/b1/transactions')
+            client.get('budgets/b1/transactions')
+            client.get('budgets/b1/accounts',
+                       params={'last_knowledge_of_server': 3})
+            self.assertEqual(len(sent), 4)
+            self.assertEqual(cache.stats['hits'], 1)
+
+            # expired with an ETag: revalidated instead of refetched
+            cache._cxn.execute("UPDATE ynab_responses SET expires_at = 0")
+            self.assertEqual(client.get('budgets/b1/payees')['n'], 1)
+            self.assertEqual(sent[-1][2], {'If-None-Match': '"v1"'})
+            self.assertEqual(cache.stats['revalidated'], 1)
+
+            client.get('budgets/b2/categories')
+            client.get('budgets/b1/categories')
+            self.assertLessEqual(cache.size(), 100)
+            self.assertGreater(cache.stats['evictions'], 0)
+
+            self.assertEqual(cache.invalidate('budgets/b1'), 1)
+            self.assertEqual(cache.lookup(cache.key(
+                'tok', 'budgets/b2/categories'))[0]['path'],
+                'budgets/b2/categories')
+            cache.close()
+
+    def test_credential_store(self):
+        from pathlib import Path
+        from sqlite3 import connect
+        from tempfile import TemporaryDirectory
+        from pyrig.models.db import credentials
+        from pyrig.models.db.credentials import (
+            CredentialStore, decrypt_secret, encrypt_secret,
+            load_credential_key,
+        )
+
+        with TemporaryDirectory() as tmp:
+            key = load_credential_key(f'{tmp}/pyrig.key')
+            self.assertEqual(load_credential_key(f'{tmp}/pyrig.key'), key)
+            value = encrypt_secret(key, 'sëcret')
+            self.assertNotIn('cret', value)
+            self.assertNotEqual(encrypt_secret(key, 'sëcret'), value)
+            self.assertEqual(decrypt_secret(key, value), 'sëcret')
+            with self.assertRaises(ValueError):
+                decrypt_secret(bytes(32), value)
+            with self.assertRaises(ValueError):
+                decrypt_secret(key, 'plain')
+
+            dbpath = f'{tmp}/data.db'
+            with connect(dbpath) as cxn:
+                cxn.execute("CREATE TABLE settings (name TEXT PRIMARY KEY, "
+                            "value TEXT NOT NULL)")
+                cxn.execute("INSERT INTO settings VALUES ('tok', 'legacy')")
+            cxn.close()
+
+            store = CredentialStore(dbpath, f'{tmp}/pyrig.key')
+            opened = []
+            pyrig_db = credentials.pyrig_db
+
+            def counting_db(path):
+                opened.append(path)
+                return pyrig_db(path)
+
+            with mock.patch.object(credentials, 'pyrig_db', counting_db):
+                self.assertEqual(store.get('tok', 'from-config'), 'legacy')
+                self.assertEqual(store.get('tok'), 'legacy')
+                self.assertEqual(store.get('tok', 'legacy'), 'legacy')
+                self.assertEqual(len(opened), 1)
+                self.assertEqual(store.get('new', 'abc'), 'abc')
+                self.assertEqual(len(opened), 2)
+
+            with connect(dbpath) as cxn:
+                stored = dict(cxn.execute("SELECT name, value FROM settings"))
+            cxn.close()
+            self.assertEqual(decrypt_secret(key, stored['tok']), 'legacy')
+            self.assertEqual(decrypt_secret(key, stored['new']), 'abc')
+
+            # reading the token never writes; failures fall back to config
+            from pyrig.models.ynab import auth
+            for name in ('missing.db', 'nosettings.db'):
+                bare = CredentialStore(f'{tmp}/{name}', f'{tmp}/new.key')
+                if name == 'nosettings.db':
+                    connect(bare.dbpath).close()
+                with mock.patch.object(auth, 'get_credential_store',
+                                       lambda: bare), \
+                        mock.patch.object(auth, '_get_local_ynab_token',
+                                          lambda: 'local'), \
+                        mock.patch.object(auth, 'PyRigApp'):
+                    self.assertEqual(auth.get_ynab_token(), 'local')
+            self.assertFalse(Path(f'{tmp}/missing.db').exists())
+            self.assertFalse(Path(f'{tmp}/new.key').exists())
+
+            # the client's token lookup encrypts a plaintext row in place
+            # and stores a config-only token, once, when the database exists
+            from pyrig.models.ynab.comm import YnabClient
+            for name, row, local in (('plain.db', 'plain', None),
+                                     ('cfg.db', None, 'cfg')):
+                path = f'{tmp}/{name}'
+                with connect(path) as cxn:
+                    cxn.execute("CREATE TABLE settings (name TEXT PRIMARY "
+                                "KEY, value TEXT NOT NULL)")
+                    if row:
+                        cxn.execute("INSERT INTO settings VALUES "
+                                    "('ynab_token', ?)", (row,))
+                cxn.close()
+                app_store = CredentialStore(path, f'{tmp}/pyrig.key')
+                opened.clear()
+                with mock.patch.object(auth, 'get_credential_store',
+                                       lambda: app_store), \
+                        mock.patch.object(auth, '_get_local_ynab_token',
+                                          lambda: local), \
+                        mock.patch.object(auth, 'PyRigApp'), \
+                        mock.patch.object(credentials, 'pyrig_db',
+                                          counting_db):
+                    self.assertEqual(YnabClient().token, row or local)
+                    self.assertEqual(YnabClient().token, row or local)
+                self.assertEqual(len(opened), 1)
+                with connect(path) as cxn:
+                    (value,), = cxn.execute("SELECT value FROM settings")
+                cxn.close()
+                self.assertTrue(value.startswith('fernet:'))
+                self.assertEqual(decrypt_secret(key, value), row or local)
+
+            nokey = CredentialStore(dbpath, f'{tmp}/new.key')
+            with self.assertRaisesRegex(ValueError, 'missing'):
+                nokey.get('tok', save=False)
+            self.assertFalse(Path(f'{tmp}/new.key').exists())
+            from pyrig.models.db import close_pyrig_connections
+            close_pyrig_connections()
+
+    def _make_avcad_dir(self, tmp):
+        from sqlite3 import connect
+        for manuf, tables in {
+            'Acme': {'Speakers': [('SP-100', 'Ceiling speaker'),
+                                  ('SP-200', 'Pendant speaker')],
+                     'Options': [('ignored', 'x')]},
+            'Bolt': {'Amplifiers': [('AMP-4', '4 channel amplifier')],
+                     'Speakers': [('BS-1', 'Wall speaker')]},
+        }.items():
+            with connect(f'{tmp}/{manuf}.xml') as db:
+                for tbl, rows in tables.items():
+                    db.execute(f'CREATE TABLE "{tbl}" '
+                               '(Model TEXT, Description TEXT)')
+                    db.executemany(f'INSERT INTO "{tbl}" VALUES (?, ?)',
+                                   rows)
+            db.close()
+
+    def test_avcad_catalog(self):
+        from os import utime
+        from pathlib import Path
+        from tempfile import TemporaryDirectory
+        from pyrig.models.avcad.catalog import (
+            find_avcad_model, index_avcad_catalog, search_avcad_models,
+        )
+        from pyrig.models.db import close_pyrig_connections
+
+        with TemporaryDirectory() as tmp:
+            self._make_avcad_dir(tmp)
+            catalog = f'{tmp}/catalog.db'
+            self.assertEqual(index_avcad_catalog(tmp, catalog),
+                             {'indexed': 2, 'removed': 0, 'unchanged': 0})
+            self.assertEqual(index_avcad_catalog(tmp, catalog),
+                             {'indexed': 0, 'removed': 0, 'unchanged': 2})
+
+            hits = search_avcad_models('speak', catalog=catalog)
+            self.assertEqual(sorted(h.model for h in hits),
+                             ['BS-1', 'SP-100', 'SP-200'])
+            hits = search_avcad_models('acme ceiling', catalog=catalog)
+            self.assertEqual([(h.category, h.model, h.fields) for h in hits],
+                             [('Speakers', 'SP-100',
+                               {'Description': 'Ceiling speaker'})])
+            self.assertEqual(search_avcad_models('ignored', catalog=catalog),
+                             [])
+            self.assertEqual(len(search_avcad_models(
+                'speaker', manufacturer='Bolt', catalog=catalog)), 1)
+            self.assertEqual(find_avcad_model('amp-4', catalog)[0][:3],
+                             ('Bolt', 'Amplifiers', 'AMP-4'))
+
+            # results go through tqdm.write so progress bars stay intact
+            from pyrig.models.avcad import catalog as catalog_mod
+            written = []
+            with mock.patch.object(catalog_mod, 'index_avcad_catalog'), \
+                    mock.patch.object(
+                        catalog_mod, 'search_avcad_models',
+                        lambda text: search_avcad_models(text,
+                                                         catalog=catalog),
+                    ), \
+                    mock.patch.object(catalog_mod.FileSetTqdm, 'write',
+                                      written.append), \
+                    mock.patch('builtins.print') as printed:
+                catalog_mod.print_model_search('wall speaker')
+            self.assertEqual(written, ['Bolt / Speakers / BS-1'])
+            printed.assert_not_called()
+
+            Path(f'{tmp}/Acme.xml').unlink()
+            utime(f'{tmp}/Bolt.xml', ns=(0, 0))
+            self.assertEqual(index_avcad_catalog(tmp, catalog),
+                             {'indexed': 1, 'removed': 1, 'unchanged': 0})
+            self.assertEqual(find_avcad_model('SP-100', catalog), [])
+            close_pyrig_connections()
+
+    def test_avcad_db_uri(self):
+        from sqlite3 import connect
+        from tempfile import TemporaryDirectory
+        from pyrig.models.avcad.db import avcad_db_uri, read_avcad_db_models
+
+        self.assertEqual(avcad_db_uri('//server/share/AV CAD/Acme.xml'),
+                         'file:////server/share/AV%20CAD/Acme.xml'
+                         '?mode=ro&immutable=1')
+        with TemporaryDirectory() as tmp:
+            path = f'{tmp}/50% off #1?.xml'
+            with connect(path) as db:
+                db.execute('CREATE TABLE Speakers (Model TEXT)')
+                db.execute("INSERT INTO Speakers VALUES ('SP-1')")
+            db.close()
+            self.assertIn('/50%25%20off%20%231%3F.xml?', avcad_db_uri(path))
+            self.assertEqual(read_avcad_db_models(path),
+                             {'Speakers': ['SP-1']})
+
+    def test_avcad_parallel_scan(self):
+        from pathlib import Path
+        from tempfile import TemporaryDirectory
+        from pyrig.models.avcad.db import (
+            get_avcad_tables, read_avcad_db_models, scan_avcad_dbs,
+            set_avcad_db_dir,
+        )
+        from pyrig.models.avcad.reader import get_avcad_reader
+
+        with TemporaryDirectory() as tmp:
+            self._make_avcad_dir(tmp)
+            set_avcad_db_dir(tmp)
+            self.assertEqual(get_avcad_tables(Path(tmp)/'Acme.xml'),
+                             ['Speakers'])
+            get_avcad_reader().close()
+            expected = [
+                (Path('Acme.xml'), {'Speakers': ['SP-100', 'SP-200']}),
+                (Path('Bolt.xml'), {'Amplifiers': ['AMP-4'],
+                                    'Speakers': ['BS-1']}),
+            ]
+            self.assertEqual(list(scan_avcad_dbs(read_avcad_db_models,
+                                                 max_workers=2)), expected)
+            self.assertEqual(list(scan_avcad_dbs(read_avcad_db_models,
+                                                 max_workers=2,
+                                                 processes=True)), expected)
+            # read-only connections leave no journal files behind
+            self.assertEqual(sorted(p.name for p in Path(tmp).iterdir()),
+                             ['Acme.xml', 'Bolt.xml'])
+
+    def test_avcad_reader(self):
+        from sqlite3 import connect
+        from tempfile import TemporaryDirectory
+        from threading import Thread
+        from pyrig.models.avcad.reader import AvcadReader
+
+        with TemporaryDirectory() as tmp:
+            self._make_avcad_dir(tmp)
+            with AvcadReader(tmp, max_open=1) as reader:
+                for _ in range(3):
+                    self.assertEqual(reader.tables('Bolt'),
+                                     ['Amplifiers', 'Speakers'])
+                    self.assertEqual(reader.models('Bolt', 'Speakers'),
+                                     ['BS-1'])
+                self.assertEqual(reader.opens, 1)
+                self.assertEqual(reader.columns('Bolt', 'Amplifiers'),
+                                 ('Model', 'Description'))
+                self.assertEqual(reader.select(
+                    'Acme.xml', 'Speakers', ('Description',), 'Model = ?',
+                    ('SP-200',)
+                ), [('Pendant speaker',)])
+                # the single slot is reused, cached metadata is not reread
+                self.assertEqual(reader.opens, 2)
+                self.assertEqual(reader.tables('Bolt'),
+                                 ['Amplifiers', 'Speakers'])
+                self.assertEqual(reader.opens, 2)
+                reader.models('Bolt', 'Amplifiers')
+                self.assertEqual(reader.opens, 3)
+                self.assertEqual(len(reader._cxns), 1)
+
+                reader.invalidate('Bolt')
+                self.assertEqual(len(reader._cxns), 0)
+                reader.tables('Bolt')
+                self.assertEqual(reader.opens, 4)
+
+                # pooled handles are not immutable: they see later writes
+                with connect(f'{tmp}/Bolt.xml') as db:
+                    db.execute("INSERT INTO Speakers VALUES ('BS-2', 'x')")
+                db.close()
+                self.assertEqual(reader.models('Bolt', 'Speakers'),
+                                 ['BS-1', 'BS-2'])
+
+                # a watcher thread may invalidate the shared reader
+                errors = []
+
+                def invalidate():
+                    try:
+                        reader.invalidate()
+                    except Exception as e:
+                        errors.append(e)
+
+                thread = Thread(target=invalidate)
+                thread.start()
+                thread.join()
+                self.assertEqual(errors, [])
+                self.assertEqual((reader._cxns, reader._tables,
+                                  reader._columns), ({}, {}, {}))
+
+    def test_avcad_frame_loader(self):
+        from os import utime
+        from sqlite3 import connect
+        from tempfile import TemporaryDirectory
+        from pyrig.models.avcad import frame
+        from pyrig.models.avcad.frame import load_avcad_models
+
+        with TemporaryDirectory() as tmp:
+            self._make_avcad_dir(tmp)
+            with connect(f'{tmp}/Bolt.xml') as db:
+                db.execute('ALTER TABLE Amplifiers ADD COLUMN Watts INTEGER')
+                db.execute("UPDATE Amplifiers SET Watts = 400")
+            db.close()
+            cache_dir = f'{tmp}/cache'
+            reads = []
+            read = frame.read_avcad_frame
+
+            def counting_read(path):
+                reads.append(path.name)
+                return read(path)
+
+            with mock.patch.object(frame, 'read_avcad_frame', counting_read):
+                df = load_avcad_models(tmp, cache_dir)
+                self.assertEqual(sorted(reads), ['Acme.xml', 'Bolt.xml'])
+                self.assertEqual(list(df.columns[:4]), [
+                    'manufacturer', 'category', 'Model', 'Description',
+                ])
+                self.assertEqual(len(df), 4)
+                self.assertEqual(str(df['manufacturer'].dtype), 'category')
+                self.assertEqual(str(df['Watts'].dtype), 'Int64')
+                self.assertEqual(df.loc[df['Model'] == 'AMP-4',
+                                        'Watts'].tolist(), [400])
+
+                # touched but unchanged: revalidated by hash, not reread
+                utime(f'{tmp}/Acme.xml', ns=(0, 0))
+                again = load_avcad_models(tmp, cache_dir)
+                self.assertEqual(len(reads), 2)
+                self.assertTrue(again.equals(df))
+
+                with connect(f'{tmp}/Acme.xml') as db:
+                    db.execute("DELETE FROM Speakers WHERE Model = 'SP-200'")
+                db.close()
+                self.assertEqual(len(load_avcad_models(tmp, cache_dir)), 3)
+                self.assertEqual(reads[2:], ['Acme.xml'])
+
+    def test_avcad_library_watcher(self):
+        from os import utime
+        from pathlib import Path
+        from tempfile import TemporaryDirectory
+        from pyrig.models.avcad.layers import (
+            forget_avcad_layers, load_avcad_layers,
+        )
+        from pyrig.models.avcad.watch import (
+            WATCH_CHANGED, Inotify, LibraryWatcher, WatchEvent,
+            refresh_avcad_caches,
+        )
+
+        def touch(path, ns):
+            path.write_text(str(ns))
+            utime(path, ns=(ns, ns))
+
+        modes = [False] + [True]*Inotify.available()
+        for use_inotify in modes:
+            with TemporaryDirectory() as tmp:
+                tmp = Path(tmp)
+                (tmp/'Settings').mkdir()
+                layers = tmp/'Settings'/'Layers.txt'
+                touch(tmp/'Acme.xml', 1)
+                touch(tmp/'Bolt.xml', 1)
+                touch(layers, 1)
+                batches = []
+                watcher = LibraryWatcher(tmp, layers, batches.append,
+                                         settle=0.05,
+                                         use_inotify=use_inotify)
+                self.assertEqual(watcher.polling, not use_inotify)
+                self.assertEqual(watcher.check(0.2), [])
+
+                touch(tmp/'Acme.xml', 2)
+                (tmp/'Bolt.xml').unlink()
+                touch(tmp/'Cue.xml', 1)
+                touch(tmp/'notes.txt', 1)
+                touch(layers, 2)
+                events = watcher.check(1.0)
+                self.assertEqual(
+                    [(e.kind, e.path.name) for e in events],
+                    [('changed', 'Acme.xml'), ('removed', 'Bolt.xml'),
+                     ('added', 'Cue.xml'), ('changed', 'Layers.txt')],
+                )
+                self.assertEqual(batches, [events])
+                self.assertEqual(watcher.check(0.1), [])
+                watcher.stop()
+
+        # a layers event drops the parsed file, even with the same stat
+        with TemporaryDirectory() as tmp:
+            layers = Path(tmp)/'Layers.txt'
+            touch(layers, 1)
+            self.assertEqual(load_avcad_layers(layers)['1'].order, 0)
+            layers.write_text('2')
+            utime(layers, ns=(1, 1))
+            self.assertIn('1', load_avcad_layers(layers))
+            refresh_avcad_caches([WatchEvent(WATCH_CHANGED, layers)])
+            self.assertEqual(list(load_avcad_layers(layers).layers), ['2'])
+            forget_avcad_layers()
+
+    def test_cxns_parser(self):
+        from pandas import Series
+        from pyrig.models.avcad.cxns import (
+            Connector, parse_cxns, parse_cxns_column,
+        )
+
+        stereo = 'Input:1_XLR(Left)\\Input:2_XLR(Right)\\'
+        self.assertEqual(parse_cxns(stereo), (
+            Connector('Input', 1, 'XLR', 'Left'),
+            Connector('Input', 2, 'XLR', 'Right'),
+        ))
+        self.assertEqual(parse_cxns('Mic In:10_(Mic:Line)'),
+                         (Connector('Mic In', 10, '', 'Mic:Line'),))
+        self.assertEqual(parse_cxns('none'), ())
+        parse_cxns(stereo)
+        self.assertGreaterEqual(parse_cxns.cache_info().hits, 1)
+
+        col = Series([stereo, None, 'AC:1_IEC C14(Power)', stereo, 'x'],
+                     index=list('abcde'))
+        df = parse_cxns_column(col)
+        self.assertEqual(df.index.tolist(), [('a', 0), ('a', 1), ('c', 0),
+                                             ('d', 0), ('d', 1)])
+        self.assertEqual(str(df['index'].dtype), 'int64')
+        self.assertEqual(
+            [Connector(*r) for r in df.itertuples(index=False)],
+            list(parse_cxns(stereo) + parse_cxns('AC:1_IEC C14(Power)')
+                 + parse_cxns(stereo)),
+        )
+        self.assertTrue(parse_cxns_column([]).empty)
+
+    def test_avcad_layers(self):
+        from os import utime
+        from tempfile import TemporaryDirectory
+        from pyrig.models.avcad import layers as layers_mod
+        from pyrig.models.avcad.layers import (
+            Layer, load_avcad_layers, parse_layers,
+        )
+
+        text = ('\ufeff# AVCAD layers\r\n'
+                'Walls\t#FF0000\t1\r\n'
+                '\r\n'
+                'Cables\t0 128 255\toff\r\n'
+                'Notes\r\n'
+                'Walls\t7\tyes\r\n')
+        parsed = parse_layers(text.encode().splitlines())
+        self.assertEqual(parsed, [Layer('Walls', 7, True, 0),
+                                  Layer('Cables', 0x0080FF, False, 1),
+                                  Layer('Notes', None, True, 2)])
+        self.assertEqual(parse_layers([b'Grid|bad|hidden']),
+                         [Layer('Grid', None, False, 0)])
+        # ';' separates fields rather than starting a comment
+        self.assertEqual(parse_layers([b'Walls;#FF0000;0', b'# note',
+                                       b'// note']),
+                         [Layer('Walls', 0xFF0000, False, 0)])
+
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp)/'Layers.txt'
+            path.write_bytes(text.encode())
+            layers = load_avcad_layers(path)
+            self.assertEqual(len(layers), 3)
+            self.assertEqual(layers['Cables'].order, 1)
+            self.assertFalse(layers.is_visible('Cables'))
+            self.assertTrue(layers.toggle('Cables'))
+            self.assertTrue(layers.is_visible('Unknown'))
+            with self.assertRaises(KeyError):
+                layers.set_visible('Unknown', False)
+            # unchanged file: same parsed layers, keeping the toggle
+            self.assertIs(load_avcad_layers(path), layers)
+            self.assertTrue(load_avcad_layers(path).is_visible('Cables'))
+
+            path.write_bytes(b'Doors,#00FF00,0\n')
+            st = path.stat()
+            utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            reloaded = load_avcad_layers(path)
+            self.assertIsNot(reloaded, layers)
+            self.assertEqual(list(reloaded),
+                             [Layer('Doors', 0x00FF00, False, 0)])
+
+            # large files are memory-mapped
+            big = Path(tmp)/'Big.txt'
+            big.write_bytes(b''.join(f'L{i}\t{i}\t1\n'.encode()
+                                     for i in range(200000)))
+            self.assertGreater(big.stat().st_size,
+                               layers_mod.LAYERS_MMAP_THRESHOLD)
+            layers = load_avcad_layers(big)
+            self.assertEqual(len(layers), 200000)
+            self.assertEqual(layers['L199999'], Layer('L199999', 199999,
+                                                      True, 199999))
+            self.assertEqual(len(load_avcad_layers(Path(tmp)/'none')), 0)
+
+            # listeners hear of changes, one failing does not stop others
+            heard = []
+
+            def broken(path):
+                raise RuntimeError('gone')
+
+            layers_mod.add_layers_listener(broken)
+            layers_mod.add_layers_listener(heard.append)
+            layers_mod.avcad_layers_changed(big)
+            self.assertEqual(heard, [big])
+            self.assertIsNot(load_avcad_layers(big), layers)
+            layers_mod.remove_layers_listener(broken)
+            layers_mod.remove_layers_listener(heard.append)
+            self.assertEqual(layers_mod._listeners, [])
+            layers_mod.forget_avcad_layers()
+
 
 if __name__ == '__main__':
     ttr = TextTestRunner(stream=sys.stdout,